@@ -0,0 +1,272 @@
+"""Benchmarks for the hot spots of the deploy path.
+
+Run with `python -m bench.deploy_paths`, optionally with `--output FILE`.
+Results are written as a JSON document: some information about the run,
+then one record per benchmark with the timings of each repetition in
+seconds and, where it makes sense, the number of bytes processed and the
+throughput in bytes per second. Comparing the documents from two versions
+shows any regressions.
+
+Trees of a few shapes are generated in a temporary folder for the file
+benchmarks. The site construction benchmarks need a docker daemon, and are
+recorded as skipped if none is reachable. With `--fake LATENCY` they're run
+against the in-process stand-in daemon instead, each API call taking
+LATENCY seconds, so they can be run anywhere.
+"""
+import json
+import os
+import platform
+import sys
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from os.path import join
+from shutil import rmtree
+from statistics import mean, median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+from src import misc_functions
+from src.archive import ArchiveCache, tar_stream
+from src.config import Config
+
+# name: (number of folders deep, folders per level, files per folder, size)
+TREE_SHAPES = {
+    'flat': (1, 1, 2000, 4 * 1024),
+    'deep': (8, 2, 8, 4 * 1024),
+    'large_files': (1, 1, 8, 16 * 1024 * 1024),
+}
+
+
+def make_tree(top: str, depth: int, width: int, files: int, size: int):
+    """Fill top with a tree of the given shape."""
+    os.makedirs(top, exist_ok=True)
+    data = os.urandom(size)
+    for number in range(files):
+        with open(join(top, "file_%d.bin" % number), 'wb') as f:
+            f.write(data)
+    if depth > 1:
+        for number in range(width):
+            make_tree(
+                join(top, "folder_%d" % number), depth - 1, width, files, size
+            )
+
+
+def tree_size(top: str) -> int:
+    """The total size of the files in a tree."""
+    return sum(
+        entry.stat().st_size for entry in misc_functions.walk_tree(top)
+    )
+
+
+def measure(
+            name: str,
+            function: Callable[[], object],
+            repeat: int,
+            size: Optional[int]=None,
+            setup: Optional[Callable[[], object]]=None,
+            **details
+        ) -> Dict:
+    """Time repeat calls of function, each after a call of setup.
+
+    A benchmark which raises an error is recorded with the error instead of
+    timings, so that one failure doesn't lose the rest of the run.
+    """
+    timings = []
+    try:
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            started = perf_counter()
+            function()
+            timings.append(perf_counter() - started)
+    except Exception as error:
+        return dict(details, name=name, error=repr(error))
+    record = dict(details, name=name, seconds=timings, summary={
+        'min': min(timings), 'median': median(timings), 'mean': mean(timings)
+    })
+    if size is not None:
+        record['bytes'] = size
+        record['bytes_per_second'] = size / median(timings)
+    return record
+
+
+def consume(stream) -> int:
+    """Read a stream of chunks to the end, returning its length."""
+    return sum(len(chunk) for chunk in stream)
+
+
+def file_benchmarks(workdir: str, repeat: int) -> List[Dict]:
+    """Benchmark the archive, walking, hashing and copying helpers."""
+    from src.basic_nginx_site import CopyFoldersToMounts
+    results = []
+    for shape, (depth, width, files, size) in TREE_SHAPES.items():
+        tree = join(workdir, shape)
+        make_tree(tree, depth, width, files, size)
+        total = tree_size(tree)
+        paths = misc_functions.list_recursively(tree)
+        results.append(measure(
+            'tar_stream', lambda: consume(tar_stream(tree)), repeat, total,
+            shape=shape, files=len(paths)
+        ))
+        cache = ArchiveCache(join(workdir, 'cache', shape), 2 ** 40)
+        Config.archive_cache = cache
+        mount_point = join(workdir, 'mounts', shape)
+
+        def get_mount_for():
+            _, archive = CopyFoldersToMounts.get_mount_for(
+                None, tree, '/usr/share/nginx/html', mount_point
+            )
+            return consume(archive)
+        results.append(measure(
+            'get_mount_for_cold', get_mount_for, repeat, total,
+            setup=cache.entries.clear, shape=shape, files=len(paths)
+        ))
+        results.append(measure(
+            'get_mount_for_cached', get_mount_for, repeat, total,
+            setup=lambda: consume(cache.stream(tree)),
+            shape=shape, files=len(paths)
+        ))
+        results.append(measure(
+            'list_recursively',
+            lambda: misc_functions.list_recursively(tree),
+            repeat, shape=shape, files=len(paths)
+        ))
+        results.append(measure(
+            'hash_of_file',
+            lambda: [misc_functions.hash_of_file(path) for path in paths],
+            repeat, total, shape=shape, files=len(paths)
+        ))
+        results.append(measure(
+            'hash_of_files',
+            lambda: misc_functions.hash_of_files(paths),
+            repeat, total, shape=shape, files=len(paths)
+        ))
+        copy_target = join(workdir, 'copies', shape)
+
+        def clear_copy():
+            if os.path.exists(copy_target):
+                rmtree(copy_target)
+        results.append(measure(
+            'check_isdir_copy',
+            lambda: misc_functions.check_isdir(copy_target, src=tree),
+            repeat, total, setup=clear_copy, shape=shape, files=len(paths)
+        ))
+        clear_copy()
+    return results
+
+
+def typecheck_benchmarks(repeat: int, calls: int=100000) -> List[Dict]:
+    """Benchmark the cost per call of the runtime type checks.
+
+    A trivial function is called undecorated (as it is with the checks
+    turned off), with strict_hint's checks and with src.typecheck's.
+    """
+    from strict_hint import strict as strict_hint
+    from src.typecheck import strict
+
+    def probe(f: str, *filepath: str, src: str='') -> str:
+        return f
+
+    results = []
+    for variant, function in (
+                ('unchecked', probe),
+                ('strict_hint', strict_hint(probe)),
+                ('typecheck', strict(probe)),
+            ):
+        def call_repeatedly():
+            for _ in range(calls):
+                function('/', 'path', src='')
+        record = measure(
+            'typecheck', call_repeatedly, repeat, variant=variant, calls=calls
+        )
+        if 'summary' in record:
+            record['seconds_per_call'] = record['summary']['median'] / calls
+        results.append(record)
+    return results
+
+
+def construction_benchmarks(workdir: str, repeat: int) -> List[Dict]:
+    """Benchmark the construction of each variant of BasicNginXSite."""
+    from src import basic_nginx_site as sites
+    try:
+        Config.client.ping()
+    except Exception as error:
+        return [{
+            'name': 'construction',
+            'skipped': "No docker daemon: %s" % error
+        }]
+    webroot = join(workdir, 'flat')
+    variants = {
+        'BasicNginXSite': lambda name: sites.BasicNginXSite(
+            name=name, image=sites.BasicNginXSite.default_image,
+            network=sites.BasicNginXSite.get_network(name).id
+        ),
+        'BlankMounted_BasicNginXSite':
+            lambda name: sites.BlankMounted_BasicNginXSite(name),
+        'CopyFilesToMountedWebroot_BasicNginxSite':
+            lambda name: sites.CopyFilesToMountedWebroot_BasicNginxSite(
+                name, webroot
+            ),
+        'CopyFoldersToMounts': lambda name: sites.CopyFoldersToMounts(
+            name, webroot={join(workdir, 'site_webroot', name): webroot}
+        ),
+    }
+    results = []
+    for variant, construct in variants.items():
+        name = "bench_%s" % variant.lower()
+        results.append(measure(
+            'construction', lambda: construct(name), repeat, variant=variant
+        ))
+        sites.BasicNginXSite.check_for_existing_instance(name)
+    return results
+
+
+def run(repeat: int, fake: Optional[float]=None) -> Dict:
+    """Run every benchmark, returning the results document.
+
+    If fake is given, the in-process daemon is used with that latency.
+    """
+    if fake is not None:
+        from src.fake_docker import FakeDockerClient
+        Config.client = FakeDockerClient(
+            latency=fake, images=['nginx:latest']
+        )
+    with TemporaryDirectory(prefix='quick_deployments-bench-') as workdir:
+        results = file_benchmarks(workdir, repeat)
+        results += typecheck_benchmarks(repeat)
+        results += construction_benchmarks(workdir, repeat)
+    return {
+        'run': {
+            'started': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': repeat,
+            'fake_latency': fake,
+        },
+        'results': results,
+    }
+
+
+def main(argv: Optional[List[str]]=None):
+    """Parse the command line, run the benchmarks and write the results."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--output', help="File to write the results to; stdout by default."
+    )
+    parser.add_argument(
+        '--fake', type=float, metavar='LATENCY',
+        help="Use the in-process daemon, with this latency per API call."
+    )
+    args = parser.parse_args(argv)
+    document = json.dumps(run(args.repeat, args.fake), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
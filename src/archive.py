@@ -0,0 +1,347 @@
+"""Tar archives built on the fly, for feeding to container.put_archive.
+
+The archives produced here are never written to disk. Each one is a
+generator of byte strings which the docker client sends with chunked
+transfer encoding, so at most one chunk of file data is held in memory at a
+time no matter how large the source tree is. Archives may be built from a
+directory (tar_stream) or copied member by member out of an open tarfile
+(restream_tar).
+
+ArchiveCache keeps archives of source trees on disk keyed by a fingerprint
+of the tree, so that an unchanged tree doesn't need its archive rebuilt.
+"""
+import os
+import tarfile
+from collections import OrderedDict
+from copy import copy
+from hashlib import sha256
+from io import BytesIO
+from os.path import isdir, join
+from threading import Lock, get_ident
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from src.misc_functions import walk_tree
+from src.typecheck import strict
+
+CHUNK_SIZE = 64 * 1024
+
+
+@strict
+def padding(size: int) -> bytes:
+    """The NUL bytes needed to pad size bytes out to a whole tar block."""
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        return tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+    return b''
+
+
+def end_of_archive(written: int) -> bytes:
+    """The trailer which ends an archive of which written bytes came before.
+
+    Like tarfile, two empty blocks are written and the archive is then padded
+    out to a whole record.
+    """
+    trailer = tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+    remainder = (written + len(trailer)) % tarfile.RECORDSIZE
+    if remainder:
+        trailer += tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+    return trailer
+
+
+def header_for(info: tarfile.TarInfo) -> bytes:
+    """The header block(s) for a tar member."""
+    return info.tobuf(
+        tarfile.DEFAULT_FORMAT, tarfile.ENCODING, 'surrogateescape'
+    )
+
+
+def member_data(
+            fileobj, size: int, chunk_size: int=CHUNK_SIZE
+        ) -> Iterator[bytes]:
+    """Yield exactly size bytes from fileobj, then the block padding."""
+    remaining = size
+    while remaining:
+        chunk = fileobj.read(min(chunk_size, remaining))
+        if not chunk:
+            raise OSError(
+                "Unexpected end of data, %d bytes short." % remaining
+            )
+        remaining -= len(chunk)
+        yield chunk
+    yield padding(size)
+
+
+def tree_members(source: str) -> Iterator[Tuple[os.DirEntry, str]]:
+    """Yield (entry, name in the archive) for everything under source.
+
+    Names are relative to source, so the archive extracts into the target
+    directory rather than recreating source's full path inside it. Entries
+    are found lazily by walk_tree, so the tree is never listed in full.
+    """
+    if not isdir(source):
+        for entry in walk_tree(source):
+            yield entry, entry.name
+        return
+    start = len(source.rstrip(os.sep)) + 1
+    for entry in walk_tree(source, directories=True):
+        yield entry, entry.path[start:]
+
+
+def tar_stream(
+            source: str, chunk_size: int=CHUNK_SIZE
+        ) -> Iterator[bytes]:
+    """Yield an uncompressed tar archive of source, a file or directory.
+
+    If source is itself a tar archive its bytes are passed through as they
+    are, since put_archive extracts it just the same.
+    """
+    if not isdir(source) and tarfile.is_tarfile(source):
+        with open(source, 'rb') as archive:
+            yield from iter(lambda: archive.read(chunk_size), b'')
+        return
+    # A TarFile is only used for building member headers from stat data. It
+    # also keeps track of inodes, so hard links come out as links.
+    builder = tarfile.TarFile(fileobj=BytesIO(), mode='w')
+    written = 0
+    for entry, arcname in tree_members(source):
+        path = entry.path
+        info = builder.gettarinfo(path, arcname)
+        if info is None:
+            # sockets and the like can't be archived.
+            continue
+        header = header_for(info)
+        written += len(header)
+        yield header
+        if info.isreg():
+            with open(path, 'rb') as data:
+                for chunk in member_data(data, info.size, chunk_size):
+                    written += len(chunk)
+                    yield chunk
+    yield end_of_archive(written)
+
+
+def restream_tar(
+            source: tarfile.TarFile,
+            rename: Optional[Callable[[str], Optional[str]]]=None,
+            include: Optional[Callable[[tarfile.TarInfo], bool]]=None,
+            chunk_size: int=CHUNK_SIZE
+        ) -> Iterator[bytes]:
+    """Yield a new archive made of the members of an open tarfile.
+
+    Each member's header is rewritten and its data copied straight across;
+    nothing is extracted. Members are read in order, so source may have been
+    opened as a stream (mode 'r|*').
+
+    rename, if given, maps each member name to the name it will have in the
+    new archive, or to None to leave the member out. include, if given, is
+    called with each member and the member is left out if it returns False.
+    Hard links are renamed along with the member they point to.
+    """
+    written = 0
+    for info in source:
+        if include is not None and not include(info):
+            continue
+        data = source.extractfile(info) if info.isreg() else None
+        info = copy(info)
+        if rename is not None:
+            # Long or non-ASCII names are also kept in the PAX header, which
+            # would override the new name when the header is written.
+            info.pax_headers = {
+                key: value for key, value in info.pax_headers.items()
+                if key not in ('path', 'linkpath')
+            }
+            info.name = rename(info.name)
+            if info.name is None:
+                continue
+            if info.islnk():
+                info.linkname = rename(info.linkname)
+                if info.linkname is None:
+                    continue
+        if info.sparse is not None:
+            # extractfile fills in the holes, so write it out as a whole file
+            # of its real size, without the PAX records which described it as
+            # sparse (or its stored size).
+            info.type = tarfile.REGTYPE
+            info.sparse = None
+            info.pax_headers = {
+                key: value for key, value in info.pax_headers.items()
+                if not key.startswith('GNU.sparse.') and key != 'size'
+            }
+        header = header_for(info)
+        written += len(header)
+        yield header
+        if data is not None:
+            for chunk in member_data(data, info.size, chunk_size):
+                written += len(chunk)
+                yield chunk
+    yield end_of_archive(written)
+
+
+def strip_prefix(prefix: str) -> Callable[[str], Optional[str]]:
+    """A rename function for restream_tar which drops a leading directory.
+
+    Members which aren't under prefix are left out.
+    """
+    prefix = prefix.strip('/') + '/'
+
+    def rename(name: str) -> Optional[str]:
+        if name.startswith(prefix) and name != prefix:
+            return name[len(prefix):]
+        return None
+    return rename
+
+
+class ArchiveCache():
+    """A size-bounded, least-recently-used store of built archives.
+
+    Archives are stored under directory, named by a fingerprint of their
+    source tree: the name, type, mode, size, modification time, inode number
+    and change time of every entry in it. Contents can't be rewritten, nor a
+    tree restored with its old modification times, without changing an
+    entry's change time or inode, so any change to the tree changes the
+    fingerprint without a file having to be read. A stored archive never
+    needs invalidating; it just stops being used and is eventually evicted
+    once the store grows past max_bytes. A tree whose archive would be
+    larger than max_bytes on its own is never stored.
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        """Create a cache in directory. It's read the first time it's used."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = None    # type: Optional[OrderedDict]
+
+    @classmethod
+    def fingerprint(cls, source: str) -> str:
+        """A hash of the metadata of every entry in the source tree."""
+        return cls.survey(source)[0]
+
+    @staticmethod
+    def survey(source: str) -> Tuple[str, int]:
+        """The fingerprint of the source tree and the size of its archive.
+
+        The size is worked out from the same walk, without reading any file,
+        so it doesn't allow for headers longer than one block.
+        """
+        digest = sha256()
+        size = 0
+        members = sorted(
+            tree_members(source), key=lambda member: member[1]
+        )
+        for entry, arcname in members:
+            stat = entry.stat(follow_symlinks=False)
+            digest.update(("%s\0%o\0%d\0%d\0%d\0%d\n" % (
+                arcname, stat.st_mode, stat.st_size, stat.st_mtime_ns,
+                stat.st_ino, stat.st_ctime_ns
+            )).encode('utf-8', 'surrogateescape'))
+            size += tarfile.BLOCKSIZE
+            if entry.is_file(follow_symlinks=False):
+                size += stat.st_size + len(padding(stat.st_size))
+        return digest.hexdigest(), size + len(end_of_archive(size))
+
+    def path_for(self, key: str) -> str:
+        """Where the archive with this fingerprint is stored."""
+        return join(self.directory, "%s.tar" % key)
+
+    @property
+    def entries(self) -> 'OrderedDict[str, int]':
+        """Stored archive sizes by fingerprint, least recently used first."""
+        if self._entries is None:
+            os.makedirs(self.directory, exist_ok=True)
+            found = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.tar') and entry.is_file():
+                    stat = entry.stat()
+                    found.append(
+                        (stat.st_mtime, entry.name[:-4], stat.st_size)
+                    )
+            self._entries = OrderedDict(
+                (key, size) for _, key, size in sorted(found)
+            )
+        return self._entries
+
+    @property
+    def size(self) -> int:
+        """The total size of the stored archives, in bytes."""
+        with self._lock:
+            return sum(self.entries.values())
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Counters describing how the cache has performed."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': sum(self.entries.values())
+            }
+
+    def stream(
+                self, source: str, chunk_size: int=CHUNK_SIZE
+            ) -> Iterator[bytes]:
+        """Yield the archive of source, from the store if it's there.
+
+        On a miss the archive is built with tar_stream and written to the
+        store as it's yielded. It's only added once the whole archive has
+        been read, so an abandoned stream leaves nothing behind. An archive
+        too large to be stored is only streamed.
+        """
+        if not isdir(source) and tarfile.is_tarfile(source):
+            # Already an archive, there's nothing to build.
+            yield from tar_stream(source, chunk_size)
+            return
+        key, size = self.survey(source)
+        path = self.path_for(key)
+        if size > self.max_bytes:
+            with self._lock:
+                self.misses += 1
+            yield from tar_stream(source, chunk_size)
+            return
+        with self._lock:
+            hit = key in self.entries
+            if hit:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            try:
+                archive = open(path, 'rb')
+            except FileNotFoundError:
+                # Removed by someone else; build it again.
+                with self._lock:
+                    self.entries.pop(key, None)
+            else:
+                with archive:
+                    os.utime(path)
+                    yield from iter(lambda: archive.read(chunk_size), b'')
+                return
+        partial = "%s.%d-%d.partial" % (path, os.getpid(), get_ident())
+        try:
+            with open(partial, 'wb') as store:
+                for chunk in tar_stream(source, chunk_size):
+                    store.write(chunk)
+                    yield chunk
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        with self._lock:
+            self.entries[key] = os.path.getsize(path)
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used archives until under max_bytes.
+
+        The caller must hold the lock.
+        """
+        total = sum(self.entries.values())
+        while total > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            total -= size
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,384 @@
+"""An asyncio counterpart to BasicNginXSite.
+
+AsyncDockerClient speaks just enough HTTP/1.1 to use the docker engine API
+over its unix socket with asyncio's non-blocking streams, so no thread is
+tied up while a request is in flight. AsyncBasicNginXSite drives a site's
+container through its lifecycle with it: create, start, stop, remove,
+inspect and put_archive. It takes the same arguments as the
+BasicNginXSite constructor, and can adopt a site which was created by one
+of the existing variants, so those can be deployed as usual and then
+managed from an event loop.
+"""
+import asyncio
+import json
+import re
+import shlex
+from collections.abc import Iterator
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import quote, urlencode
+from src.config import Config
+from src.images import normalise, split_reference
+
+
+class AsyncAPIError(Exception):
+    """The docker daemon responded with an error."""
+    def __init__(self, status_code: int, explanation: str):
+        """Store the status code and the daemon's explanation."""
+        super().__init__("%d: %s" % (status_code, explanation))
+        self.status_code = status_code
+        self.explanation = explanation
+
+
+class AsyncDockerClient():
+    """A minimal, non-blocking client for the docker engine API.
+
+    Each request is made on its own connection to the unix socket, which is
+    cheap to open. At most `connections` requests are in flight at once.
+    """
+    def __init__(
+                self,
+                socket_path: Optional[str]=None,
+                version: Optional[str]=None,
+                connections: int=32
+            ):
+        """Use the socket and API version from Config unless given others."""
+        if socket_path is None:
+            socket_path = '/' + Config.docker_url.split('://', 1)[-1] \
+                .lstrip('/')
+        self.socket_path = socket_path
+        self.version = version or Config.docker_api_version
+        self.connections = connections
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """Limits the requests in flight. Created in the running loop."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.connections)
+        return self._semaphore
+
+    def url(self, path: str, params: Optional[Dict[str, Any]]=None) -> str:
+        """The request target for an API path, with its query string."""
+        target = "/v%s%s" % (self.version, path)
+        if params:
+            target += '?' + urlencode({
+                key: json.dumps(value) if isinstance(value, (dict, bool))
+                else value
+                for key, value in params.items() if value is not None
+            })
+        return target
+
+    async def request(
+                self,
+                method: str,
+                path: str,
+                params: Optional[Dict[str, Any]]=None,
+                body: Any=None,
+                content_type: str='application/json'
+            ) -> Tuple[int, bytes]:
+        """Make a request, returning the status code and response body.
+
+        body may be bytes, an object to be sent as JSON, or an iterator of
+        byte strings. An iterator is sent with chunked transfer encoding, and
+        each chunk is fetched from it on the default executor, since
+        producing it (e.g. reading a file for a tar archive) may block.
+
+        Raises AsyncAPIError for a 4xx or 5xx response.
+        """
+        if body is not None and not isinstance(body, (bytes, Iterator)):
+            body = json.dumps(body).encode()
+        headers = [
+            "%s %s HTTP/1.1" % (method, self.url(path, params)),
+            "Host: docker",
+            "Connection: close",
+        ]
+        if isinstance(body, bytes):
+            headers += [
+                "Content-Type: %s" % content_type,
+                "Content-Length: %d" % len(body)
+            ]
+        elif body is not None:
+            headers += [
+                "Content-Type: %s" % content_type,
+                "Transfer-Encoding: chunked"
+            ]
+        async with self.semaphore:
+            reader, writer = await asyncio.open_unix_connection(
+                self.socket_path
+            )
+            try:
+                writer.write(("\r\n".join(headers) + "\r\n\r\n").encode())
+                if isinstance(body, bytes):
+                    writer.write(body)
+                elif body is not None:
+                    await self._send_chunked(writer, body)
+                await writer.drain()
+                status, response = await self._read_response(reader)
+            finally:
+                writer.close()
+        if status >= 400:
+            try:
+                explanation = json.loads(response.decode())['message']
+            except (ValueError, KeyError, TypeError):
+                explanation = response.decode(errors='replace')
+            raise AsyncAPIError(status, explanation)
+        return status, response
+
+    @staticmethod
+    async def _send_chunked(writer: asyncio.StreamWriter, body: Iterator):
+        """Send the chunks of body, each as it's produced."""
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await loop.run_in_executor(None, next, body, None)
+            if chunk is None:
+                break
+            if chunk:
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+        writer.write(b"0\r\n\r\n")
+
+    @staticmethod
+    async def _read_response(
+                reader: asyncio.StreamReader
+            ) -> Tuple[int, bytes]:
+        """Read a response's status code and its (de-chunked) body."""
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+            return status, bytes(body)
+        if 'content-length' in headers:
+            return status, await reader.readexactly(
+                int(headers['content-length'])
+            )
+        return status, await reader.read()
+
+    async def json(self, method: str, path: str, **kwargs) -> Any:
+        """Make a request and decode its JSON response, if there is one."""
+        _, response = await self.request(method, path, **kwargs)
+        return json.loads(response.decode()) if response.strip() else None
+
+
+def _port_key(port) -> str:
+    """A container port as the API names it, e.g. 80 -> '80/tcp'."""
+    port = str(port)
+    return port if '/' in port else port + '/tcp'
+
+
+def _binding(host) -> Dict[str, str]:
+    """A host port binding: a port, an (address, port) tuple, or None."""
+    if isinstance(host, tuple):
+        return {'HostIp': host[0], 'HostPort': str(host[1])}
+    return {'HostIp': '', 'HostPort': '' if host is None else str(host)}
+
+
+def create_body(
+            image: str,
+            command=None,
+            labels: Optional[Dict[str, str]]=None,
+            ports: Optional[Dict[Any, Any]]=None,
+            mounts: Optional[list]=None,
+            network: Optional[str]=None,
+            auto_remove: bool=False,
+            environment: Optional[Dict[str, str]]=None
+        ) -> Dict[str, Any]:
+    """The body of a /containers/create request.
+
+    The arguments are the subset of docker's containers.create() which the
+    BasicNginXSite variants use; anything else is a TypeError.
+    """
+    if isinstance(command, str):
+        command = shlex.split(command)
+    ports = ports or {}
+    host_config = {
+        'AutoRemove': auto_remove,
+        'Mounts': list(mounts or []),
+        'PortBindings': {
+            _port_key(port): [
+                _binding(host) for host in
+                (hosts if isinstance(hosts, list) else [hosts])
+            ] for port, hosts in ports.items()
+        },
+    }
+    if network is not None:
+        host_config['NetworkMode'] = network
+    return {
+        'Image': image,
+        'Cmd': command,
+        'Labels': dict(labels or {}),
+        'Env': [
+            "%s=%s" % item for item in (environment or {}).items()
+        ],
+        'ExposedPorts': {_port_key(port): {} for port in ports},
+        'HostConfig': host_config,
+    }
+
+
+def stream_errors(response: bytes) -> Iterator:
+    """Yield the error messages in a stream of JSON progress objects."""
+    decoder = json.JSONDecoder()
+    text = response.decode(errors='replace')
+    position = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == len(text):
+            return
+        message, position = decoder.raw_decode(text, position)
+        if isinstance(message, dict) and message.get('error'):
+            yield message
+
+
+class AsyncBasicNginXSite():
+    """A site's container, managed from an event loop.
+
+    Create one with create(), which accepts the same arguments as
+    BasicNginXSite, or adopt() a site made by one of the existing variants.
+    """
+    default_image = "nginx:latest"
+
+    def __init__(self, container_id: str, client: AsyncDockerClient):
+        """Wrap an existing container."""
+        self.container_id = container_id
+        self.client = client
+        self.state = None
+
+    @classmethod
+    def adopt(
+                cls, site, client: Optional[AsyncDockerClient]=None
+            ) -> 'AsyncBasicNginXSite':
+        """Manage the container of an existing BasicNginXSite."""
+        adopted = cls(site.container.id, client or AsyncDockerClient())
+        adopted.state = site.state
+        return adopted
+
+    @classmethod
+    async def create(
+                cls,
+                *args,
+                client: Optional[AsyncDockerClient]=None,
+                **kwargs
+            ) -> 'AsyncBasicNginXSite':
+        """Create a container, as the BasicNginXSite constructor does.
+
+        Any existing containers with the same name are removed and the image
+        is pulled if it isn't present. As with docker's containers.create(),
+        the image and command may be given positionally; see create_body()
+        for the other arguments.
+        """
+        client = client or AsyncDockerClient()
+        kwargs.update(zip(('image', 'command'), args))
+        kwargs.setdefault('image', cls.default_image)
+        name = kwargs.pop('name', None)
+        body = create_body(**kwargs)
+        if name is not None:
+            await cls.remove_existing(name, client)
+        await cls.ensure_image(body['Image'], client)
+        created = await client.json(
+            'POST', '/containers/create',
+            params={'name': name}, body=body
+        )
+        site = cls(created['Id'], client)
+        await site.inspect()
+        return site
+
+    @staticmethod
+    async def ensure_image(image: str, client: AsyncDockerClient):
+        """Pull image unless it's already present.
+
+        image may name a tag or, as in repository@sha256:..., a digest.
+
+        The daemon reports a failed pull in the progress stream of a 200
+        response, so that's checked too; AsyncAPIError is raised for it.
+        """
+        image = normalise(image)
+        try:
+            await client.request('GET', '/images/%s/json' % quote(image))
+        except AsyncAPIError as error:
+            if error.status_code != 404:
+                raise
+            repository, tag = split_reference(image)
+            # The progress stream is read to the end, which is when the pull
+            # has finished.
+            _, progress = await client.request(
+                'POST', '/images/create',
+                params={'fromImage': repository, 'tag': tag}
+            )
+            for message in stream_errors(progress):
+                raise AsyncAPIError(
+                    (message.get('errorDetail') or {}).get('code') or 500,
+                    message['error']
+                )
+
+    @staticmethod
+    async def remove_existing(name: str, client: AsyncDockerClient):
+        """Stop and remove every container matching name, concurrently."""
+        existing = await client.json(
+            'GET', '/containers/json',
+            params={
+                'all': True, 'filters': {'name': ['^/%s$' % re.escape(name)]}
+            }
+        )
+        await asyncio.gather(*(
+            AsyncBasicNginXSite(container['Id'], client).remove(force=True)
+            for container in existing
+        ))
+
+    async def inspect(self) -> dict:
+        """Inspect the container, storing the result in self.state."""
+        self.state = await self.client.json(
+            'GET', '/containers/%s/json' % self.container_id
+        )
+        return self.state
+
+    async def start(self):
+        """Start the container."""
+        await self.client.request(
+            'POST', '/containers/%s/start' % self.container_id
+        )
+
+    async def stop(self, timeout: int=10):
+        """Stop the container, killing it after timeout seconds."""
+        await self.client.request(
+            'POST', '/containers/%s/stop' % self.container_id,
+            params={'t': timeout}
+        )
+
+    async def remove(self, force: bool=False, v: bool=False):
+        """Remove the container. A vanished container isn't an error."""
+        try:
+            await self.client.request(
+                'DELETE', '/containers/%s' % self.container_id,
+                params={'force': force, 'v': v}
+            )
+        except AsyncAPIError as error:
+            if error.status_code != 404:
+                raise
+
+    async def put_archive(self, path: str, data) -> bool:
+        """Extract a tar archive into the container at path.
+
+        data may be bytes or an iterator of byte strings, such as the streams
+        made by src.archive, which are sent as they're produced.
+        """
+        await self.client.request(
+            'PUT', '/containers/%s/archive' % self.container_id,
+            params={'path': path},
+            body=data,
+            content_type='application/x-tar'
+        )
+        return True
@@ -1,20 +1,72 @@
 """A quick deployment for a basic NginX web page, with webroot provided."""
 import os
-from os import sep as root
+import re
+import sys
 import tarfile
-from shutil import copy
-from textwrap import dedent
-from typing import Union, Tuple, Dict, Optional
-from strict_hint import strict
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copy2, copytree, rmtree
+from tempfile import TemporaryDirectory
+from time import sleep
+from typing import Union, Tuple, Dict, Iterator, Optional
 from docker.types import Mount
 from docker.models.images import Image
 from docker.models.networks import Network
-from docker.errors import APIError
+from docker.errors import APIError, NotFound
+from docker.models.containers import Container
+from src.archive import restream_tar
 from src.config import Config
-from src.misc_functions import check_isdir, list_recursively, get_parent_dir
-from src.misc_functions import hash_of_str
+from src.images import pinned, split_reference
+from src.misc_functions import check_isdir, get_parent_dir
+from src.ports import fixed_ports, port_labels
+from src.readiness import Readiness, wait_until_ready
+from src.state import ContainerState
+from src.sync import SyncReport, manifest_path, sync_files
+from src.telemetry import carry, counted, span, traced
+from src.typecheck import strict
+from src.webroot_store import WEBROOT_LABEL
 MountPoint = Dict[str, Union[str, tarfile.TarFile]]
 OtherMount = Dict[str, Dict[str, str]]
+# A container -> host port mapping, AUTO_PORTS, or None for the default.
+Ports = Union[Dict[int, int], str, None]
+# Pass as the ports of a site to have free host ports allocated for it.
+AUTO_PORTS = 'auto'
+# Where nginx's configuration is mounted in a site's container.
+NGINX_CONFDIR = '/etc/nginx'
+
+
+class InvalidConfiguration(ValueError):
+    """nginx refused a site's configuration."""
+    def __init__(self, output: str):
+        """Store nginx's explanation."""
+        super().__init__(output)
+        self.output = output
+
+
+@strict
+def stop_or_kill(container: Container, grace: int):
+    """Stop a container, or kill it if it won't stop."""
+    try:
+        container.stop(timeout=grace)
+    except APIError:
+        try:
+            container.kill()
+        except APIError:
+            # It isn't running.
+            pass
+
+
+@strict
+def remove_stopped(container: Container):
+    """Remove a stopped container, unless it's already being removed."""
+    try:
+        container.remove(v=False)
+    except NotFound:
+        # It was created with auto_remove and is already gone.
+        pass
+    except APIError as error:
+        if error.status_code != 409:
+            raise
+        # Conflict: auto_remove has its removal in progress.
 
 
 class BasicNginXSite():
@@ -22,6 +74,10 @@ class BasicNginXSite():
 
     The webroot can be either a docker volume or a mounted local folder.
     """
+    # The image used by the variants below.
+    default_image = "nginx:latest"
+
+    @traced('construct')
     def __init__(self, *args, **kwargs):
         """Accept parameters to use to create a container.
 
@@ -30,12 +86,22 @@ class BasicNginXSite():
         in self.container.
 
         self.state is then created to store the current state of the container,
-        so that it can be recovered from being stopped.
+        so that it can be recovered from being stopped. The state from then
+        on is tracked from docker's events; see current_state.
 
         For containers with bind mounts, you must store them manually after
         running __init__(self), as a list of docker.types.Mount objects as
         self.mounts.
+
+        If replace=True is passed and the site is running, its container is
+        left alone and the new one is created beside it; see redeploy().
+        ports=AUTO_PORTS binds ports 80 and 443 to free host ports, as for
+        the variants; see resolve_ports().
         """
+        replace = kwargs.pop('replace', False)
+        automatic = kwargs.get('ports') == AUTO_PORTS
+        if automatic:
+            kwargs['ports'] = self.resolve_ports(kwargs['name'], AUTO_PORTS)
         try:
             self.image = kwargs['image']
         except AttributeError:
@@ -43,7 +109,28 @@ class BasicNginXSite():
                 "Image must be specified. Received kwargs: "
                 + str(kwargs.keys())
             )
+        self.replacing = self.running_instance(kwargs['name']) \
+            if replace else None
+        if self.replacing is not None:
+            if not automatic and fixed_ports(kwargs.get('ports') or {}):
+                raise ValueError(
+                    "%s uses fixed host ports, which can't be handed to a "
+                    "new container while the old one is serving on them. "
+                    "Use AUTO_PORTS, or put a proxy in front of the site."
+                    % kwargs['name']
+                )
+            # Created under another name, on host ports of its own, until it
+            # takes over.
+            kwargs['name'] = self.replacement_name(kwargs['name'])
+            kwargs['ports'] = Config.port_allocator.allocate(
+                kwargs['name'], tuple(kwargs.get('ports') or (80,))
+            )
         self.check_for_existing_instance(kwargs['name'])
+        if kwargs.get('ports'):
+            # Record the host ports, so that they aren't allocated to others.
+            kwargs['labels'] = dict(
+                kwargs.get('labels') or {}, **port_labels(kwargs['ports'])
+            )
         # I was going to check here for and raise errors if the needed ports
         # were already bound, but the docker client does that adequately.
         try:
@@ -53,21 +140,339 @@ class BasicNginXSite():
                 "WARNING: No Mounts specified for this container. There will",
                 "be no persistence of the content of this container."
             )
-        self.container = Config.client.containers.create(*args, **kwargs)
+        Config.state_tracker.watch()
+        with span('create'):
+            try:
+                self.container = self.create_container(*args, **kwargs)
+            except Exception:
+                if automatic or self.replacing is not None:
+                    # Nothing has the host ports allocated above after all.
+                    Config.port_allocator.release(kwargs['name'])
+                raise
+            self.state = Config.client.api.inspect_container(
+                self.container.id
+            )
+        Config.state_tracker.seed(self.state)
+
+    @staticmethod
+    def create_container(*args, **kwargs) -> Container:
+        """Create a container, with the arguments of containers.create().
+
+        If the daemon can't find the network, which the registry's network
+        may be if someone else removed it, one more attempt is made with a
+        new one.
+        """
+        try:
+            return Config.client.containers.create(*args, **kwargs)
+        except NotFound:
+            network = Config.networks.renew(kwargs.get('network'))
+            if network is None:
+                raise
+            kwargs['network'] = network.id
+            return Config.client.containers.create(*args, **kwargs)
+
+    @property
+    def current_state(self) -> ContainerState:
+        """The container's state, kept up to date from docker's events.
+
+        Unlike self.state, this doesn't go stale, and reading it doesn't
+        require the container to be inspected again.
+        """
+        return Config.state_tracker.get(self.container.id)
+
+    def wait_for_status(
+                self, *statuses: str, timeout: Optional[float]=None
+            ) -> ContainerState:
+        """Block until the container has one of the statuses, e.g. "running".
+
+        Raises TimeoutError if it hasn't after timeout seconds.
+        """
+        return Config.state_tracker.wait_for(
+            self.container.id,
+            lambda state: state.status in statuses,
+            timeout=timeout
+        )
+
+    @staticmethod
+    def resolve_ports(
+                name: str, ports: Ports=None
+            ) -> Dict[int, int]:
+        """Get the container -> host port mapping for a site.
+
+        By default ports 80 and 443 are bound to the same ports on the host,
+        so only one site can run on a host. Passing AUTO_PORTS binds them to
+        free host ports from Config.port_allocator instead; a site which is
+        being redeployed gets the same ports it had before. Any other value
+        is used as the mapping.
+        """
+        if ports is None:
+            return {80: 80, 443: 443}
+        if ports == AUTO_PORTS:
+            return Config.port_allocator.allocate(name, (80, 443))
+        return ports
+
+    def host_port(self, container_port: int=80) -> int:
+        """The port on the host which is bound to a port of the container."""
+        bindings = self.state['HostConfig']['PortBindings']
+        return int(bindings['%d/tcp' % container_port][0]['HostPort'])
+
+    def wait_until_ready(
+                self,
+                host: str='localhost',
+                path: str='/',
+                deadline: float=30.0
+            ) -> Readiness:
+        """Block until nginx is serving requests on the site's HTTP port.
+
+        The container should already have been started. The outcome,
+        including the time to the first byte of the first answer, is
+        returned and kept in self.readiness. See src.readiness.
+        """
+        self.readiness = wait_until_ready(
+            host=host, port=self.host_port(80), path=path, deadline=deadline
+        )
+        return self.readiness
+
+    @classmethod
+    def redeploy(
+                cls,
+                *args,
+                host: str='localhost',
+                path: str='/',
+                deadline: float=30.0,
+                **kwargs
+            ) -> 'BasicNginXSite':
+        """Construct a site, replacing its running container without downtime.
+
+        The arguments are those of the class's constructor. If the site
+        isn't running, this is the same as constructing it. Otherwise the
+        new container is created alongside the running one and takes over
+        from it once it's ready; see take_over().
+
+        Only clients on the site's networks, which reach it through its
+        network alias (the site's name), are switched without downtime. The
+        new container is left on the host ports allocated to it, since the
+        old container's can't be handed over while it's serving, so anyone
+        reaching the site through its host ports has to move to the new ones
+        (see host_port()) and loses service once the old container is gone.
+        For the same reason a running site must have been deployed with
+        AUTO_PORTS (or no fixed host ports) to be redeployed; ValueError is
+        raised otherwise.
+        """
+        site = cls(*args, replace=True, **kwargs)
+        if site.replacing is not None:
+            site.take_over(host=host, path=path, deadline=deadline)
+        return site
+
+    def take_over(
+                self,
+                host: str='localhost',
+                path: str='/',
+                deadline: float=30.0
+            ):
+        """Take over from the running container in self.replacing.
+
+        This container is started and, once it's ready (see
+        wait_until_ready()), given the site's name as its alias on each of
+        its networks while the old container is disconnected from them. The
+        old container has Config.drain_period seconds to finish the requests
+        it's serving before it's stopped and removed, and then this one is
+        renamed after the site. Once traffic has been switched, the takeover
+        has succeeded: if the old container isn't seen to be removed in time
+        a warning is printed, and this one is renamed anyway unless the old
+        one still has the name.
+
+        If this container doesn't become ready, it's removed and the old one
+        carries on serving.
+        """
+        old = self.replacing
+        name = old.name
+        temporary = self.container.name
+        try:
+            with span('start'):
+                self.container.start()
+            with span('readiness'):
+                self.wait_until_ready(host=host, path=path, deadline=deadline)
+        except Exception:
+            stop_or_kill(self.container, 0)
+            remove_stopped(self.container)
+            Config.port_allocator.release(temporary)
+            Config.webroot_store.release(temporary)
+            raise
+        with span('switch'):
+            networks = self.state['NetworkSettings']['Networks']
+            for network_name, settings in networks.items():
+                if network_name in ('bridge', 'host', 'none'):
+                    continue
+                network = Config.client.networks.get(settings['NetworkID'])
+                network.disconnect(self.container)
+                network.connect(self.container, aliases=[name])
+                try:
+                    network.disconnect(old)
+                except APIError:
+                    # It wasn't connected to this network.
+                    pass
+        try:
+            with span('drain'):
+                sleep(Config.drain_period)
+                Config.state_tracker.seed(old.attrs)
+                stop_or_kill(old, Config.stop_grace_period)
+                remove_stopped(old)
+                try:
+                    Config.state_tracker.wait_for(
+                        old.id,
+                        lambda state: state.status == 'removed',
+                        timeout=Config.stop_grace_period + 10
+                    )
+                except TimeoutError:
+                    print(
+                        "WARNING: %s was replaced, but its old container %s"
+                        " wasn't seen to be removed." % (name, old.id),
+                        file=sys.stderr
+                    )
+                Config.state_tracker.forget(old.id)
+        finally:
+            self.assume_name(name, temporary)
+
+    def assume_name(self, name: str, temporary: str):
+        """Rename this container after the site, and move its ports across.
+
+        Nothing is changed if another container still has the name.
+        """
+        try:
+            self.container.rename(name)
+        except APIError as error:
+            if error.status_code != 409:
+                raise
+            return
+        self.container.reload()
         self.state = Config.client.api.inspect_container(self.container.id)
+        Config.port_allocator.reserve(name, fixed_ports({
+            port: [binding['HostPort'] for binding in bindings]
+            for port, bindings in
+            (self.state['HostConfig']['PortBindings'] or {}).items()
+        }))
+        Config.port_allocator.release(temporary)
+        Config.webroot_store.transfer(temporary, name)
+        self.replacing = None
+
+    def configuration_folder(self) -> str:
+        """The host folder mounted as the container's nginx configuration."""
+        for mount in self.state.get('Mounts') or ():
+            if mount['Destination'].rstrip('/') == NGINX_CONFDIR:
+                return mount['Source']
+        raise ValueError(
+            "%s has no configuration folder mounted at %s."
+            % (self.container.name, NGINX_CONFDIR)
+        )
+
+    def nginx(self, *arguments: str) -> Tuple[int, str]:
+        """Run nginx in the container, returning its exit code and output."""
+        result = self.container.exec_run(['nginx'] + list(arguments))
+        return result.exit_code, result.output.decode(errors='replace')
+
+    @traced('reload_configuration')
+    def reload_configuration(
+                self, source: str, manifest: Optional[str]=None
+            ) -> SyncReport:
+        """Update the configuration of the running site without restarting.
+
+        The files in the source folder are synced into the mounted
+        configuration folder (see src.sync; manifest defaults to the site's
+        configuration manifest), nginx checks the result with `nginx -t`,
+        and then reloads it with `nginx -s reload`. Its workers finish the
+        requests they're serving, so no connections are dropped. Nothing is
+        run if no file changed.
+
+        If nginx rejects the configuration, the folder is restored to how it
+        was and InvalidConfiguration is raised with nginx's output.
+        """
+        confdir = self.configuration_folder()
+        if manifest is None:
+            manifest = manifest_path(self.container.name, "configuration")
+        sources = [
+            os.path.join(source, name) for name in sorted(os.listdir(source))
+        ]
+        with TemporaryDirectory() as backup:
+            with span('backup'):
+                copytree(
+                    confdir, os.path.join(backup, 'configuration'),
+                    symlinks=True
+                )
+                if os.path.exists(manifest):
+                    copy2(manifest, os.path.join(backup, 'manifest'))
+            with span('sync_files') as phase:
+                report = sync_files(manifest, confdir, *sources)
+                phase.add_bytes(report.bytes_copied)
+            if not report.copied and not report.deleted:
+                return report
+            with span('validate'):
+                exit_code, output = self.nginx('-t')
+                if exit_code == 0:
+                    exit_code, output = self.nginx('-s', 'reload')
+            if exit_code != 0:
+                with span('rollback'):
+                    for name in os.listdir(confdir):
+                        path = os.path.join(confdir, name)
+                        if os.path.isdir(path) and not os.path.islink(path):
+                            rmtree(path)
+                        else:
+                            os.remove(path)
+                    copytree(
+                        os.path.join(backup, 'configuration'), confdir,
+                        symlinks=True, dirs_exist_ok=True
+                    )
+                    if os.path.exists(os.path.join(backup, 'manifest')):
+                        copy2(os.path.join(backup, 'manifest'), manifest)
+                    elif os.path.exists(manifest):
+                        os.remove(manifest)
+                raise InvalidConfiguration(output)
+        return report
+
+    @staticmethod
+    def replacement_name(name: str) -> str:
+        """The name a site's container has while it replaces another."""
+        return "%s_replacement" % name
+
+    @staticmethod
+    def running_instance(name: str) -> Optional[Container]:
+        """The running container of a site, if it has one."""
+        running = Config.client.containers.list(
+            filters={'name': '^/%s$' % re.escape(name)}
+        )
+        return running[0] if running else None
 
     @staticmethod
+    @traced('teardown')
     @strict
-    def check_for_existing_instance(name):
-        """Check for an existing named container and remove it."""
-        for cont in Config.client.containers.list(
-                    all=True, filters={'name': name}
-                ):
-            try:
-                cont.stop()
-            except APIError:
-                pass
-            cont.remove(v=False)
+    def check_for_existing_instance(name, grace: int=None):
+        """Check for existing named containers and remove them.
+
+        Every matching container is stopped at the same time, each being
+        given grace seconds (Config.stop_grace_period by default) to exit
+        before the daemon kills it; if the stop request itself fails, the
+        container is killed outright. The containers are then removed,
+        Config.teardown_batch_size at a time, and the site's reference to
+        any tree in Config.webroot_store is released.
+        """
+        containers = Config.client.containers.list(
+            all=True, filters={'name': '^/%s$' % re.escape(name)}
+        )
+        if not containers:
+            return
+        if grace is None:
+            grace = Config.stop_grace_period
+        batch_size = Config.teardown_batch_size
+        with ThreadPoolExecutor(max_workers=batch_size) as pool:
+            list(pool.map(
+                carry(lambda cont: stop_or_kill(cont, grace)), containers
+            ))
+            for start in range(0, len(containers), batch_size):
+                list(pool.map(
+                    carry(remove_stopped),
+                    containers[start:start + batch_size]
+                ))
+        Config.webroot_store.release(name)
 
     @property
     @strict
@@ -82,52 +487,61 @@ class BasicNginXSite():
 
         The image is either retrieved or pulled and stored in self.image.
         """
-        try:
-            image_name, version = image.split(':', maxsplit=1)
-        except AttributeError:
-            # type Image doesn't have a split() attribute.
+        self._image = self.resolve_image(image)
+
+    @staticmethod
+    @traced('resolve_image')
+    @strict
+    def resolve_image(image: Union[str, Image]) -> Image:
+        """Get an image from the local cache, pulling it if it isn't there.
+
+        A tag pinned in Config.image_pins resolves to its pinned image.
+        """
+        if not isinstance(image, str):
             image = image.tags[0]
-            image_name, version = image.split(':', maxsplit=1)
-        except ValueError:
-            # If just the image name is passed, set the version tag as 'latest'
-            image_name = image
-            version = 'latest'
-            image = "%s:%s" % (image_name, version)
-        if image in Config.all_image_tags():
-            self._image = Config.client.images.get(image)
-        else:
-            self._image = Config.client.images.pull(
-                repository=image_name, tag=version
-            )
+        reference = pinned(image)
+        found = Config.image_index.get(reference)
+        if found is None:
+            repository, tag = split_reference(reference)
+            found = Config.client.images.pull(repository=repository, tag=tag)
+            Config.image_index.add(found)
+        return found
 
     @staticmethod
+    @traced('get_network')
     @strict
     def get_network(name: str) -> Network:
         """Retrieve the appropriate network for this named service."""
-        if "%s_network" % name not in [
-                    net.name for net in Config.client.networks.list()
-                ]:
-            # A network for this name doesn't yet exist
-            return Config.client.networks.create(name="%s_network" % name)
-        # A network for this name exists, get it.
-        networks = Config.client.networks.list(names=["%s_network" % name])
-        assert len(networks) == 1, dedent("""
-            Apparently it's possible to have more than one network with the
-            same name. I did not know that."""
-        )
-        return networks[0]
+        return Config.networks.get_or_create("%s_network" % name)
 
 
 class BlankMounted_BasicNginXSite(BasicNginXSite):
     r"""A version with an empty folder mounted to the host.
 
     The webroot will be in
-    /usr/share/quick_deployments/static/{name}/webroot.
+    /usr/share/quick_deployments/static/{name}/webroot,
+    unless it's shared; see __init__().
     The default nginx configuration will be copied to
     /usr/share/quick_deployments/static/{name}/configuration
     """
-    def __init__(self, name: str):
-        """Init self."""
+    @traced('deploy')
+    def __init__(
+                self,
+                name: str,
+                ports: Ports=None,
+                labels: Optional[Dict[str, str]]=None,
+                replace: bool=False,
+                shared_webroot: bool=False
+            ):
+        """Init self. See resolve_ports() for the ports argument.
+
+        labels are added to the container's labels; for replace, see
+        BasicNginXSite.redeploy().
+
+        If shared_webroot is True, the default webroot isn't copied for this
+        site; the site mounts the copy in Config.webroot_store, which every
+        site with the same webroot shares.
+        """
         network = self.get_network(name)
         parent_dir = get_parent_dir(name)
         webroot_path = os.path.join(
@@ -138,8 +552,25 @@ class BlankMounted_BasicNginXSite(BasicNginXSite):
             parent_dir,
             "configuration"
         )
-        check_isdir(webroot_path, src=Config.default_nginx_webroot)
-        check_isdir(confdir_path, src=Config.default_nginx_config)
+        with span('check_isdir'):
+            if shared_webroot:
+                if replace and self.running_instance(name) is not None:
+                    owner = self.replacement_name(name)
+                else:
+                    # The old container goes first, so that releasing its
+                    # reference doesn't release this site's.
+                    self.check_for_existing_instance(name)
+                    owner = name
+                webroot_path = Config.webroot_store.acquire(
+                    owner, Config.default_nginx_webroot
+                )
+                # So that the store can tell whether the site still exists.
+                labels = dict(labels or {}, **{
+                    WEBROOT_LABEL: os.path.basename(webroot_path)
+                })
+            else:
+                check_isdir(webroot_path, src=Config.default_nginx_webroot)
+            check_isdir(confdir_path, src=Config.default_nginx_config)
         webroot = Mount(
             target="/usr/share/nginx/html",
             source=webroot_path,
@@ -156,13 +587,13 @@ class BlankMounted_BasicNginXSite(BasicNginXSite):
         )
         super(BlankMounted_BasicNginXSite, self).__init__(
             name=name,
-            image="nginx:latest",
+            image=self.default_image,
             auto_remove=True,
             network=network.id,
-            ports={
-                80:     80,
-                443:    443
-            },
+            ports=ports if ports == AUTO_PORTS
+            else self.resolve_ports(name, ports),
+            labels=labels,
+            replace=replace,
             mounts=[
                 confdir,
                 webroot
@@ -174,21 +605,37 @@ class CopyFilesToMountedWebroot_BasicNginxSite(BasicNginXSite):
     """A version with individually passed files, mounted to a host folder.
 
     The *files should be strings representing the paths of files to be
-    copied recursively.
+    copied recursively. Only the files which are new or have changed since
+    the last deployment are copied, and files from the last deployment which
+    are no longer passed are removed; see src.sync. The outcome is stored in
+    self.sync_report.
 
     The resulting folder will be mounted at
     /usr/share/quick_deployments/static/{name}/webroot.
     The default nginx configuration will be copied to
     /usr/share/quick_deployments/static/{name}/configuration
     """
-    def __init__(self, name: str, *files):
-        """init self"""
+    @traced('deploy')
+    def __init__(
+                self,
+                name: str,
+                *files,
+                ports: Ports=None,
+                labels: Optional[Dict[str, str]]=None,
+                replace: bool=False
+            ):
+        """init self. See resolve_ports() for the ports argument.
+
+        labels are added to the container's labels; for replace, see
+        BasicNginXSite.redeploy().
+        """
         network = self.get_network(name)
         parent_dir = get_parent_dir(name)
         webroot_path = os.path.join(parent_dir, "webroot")
         confdir_path = os.path.join(parent_dir, "configuration")
-        check_isdir(webroot_path)
-        check_isdir(confdir_path)
+        with span('check_isdir'):
+            check_isdir(webroot_path)
+            check_isdir(confdir_path)
         webroot = Mount(
             target="/usr/share/nginx/html",
             source=webroot_path,
@@ -203,33 +650,39 @@ class CopyFilesToMountedWebroot_BasicNginxSite(BasicNginXSite):
             read_only=True
         )
         super(CopyFilesToMountedWebroot_BasicNginxSite, self).__init__(
-            image="nginx:latest",
+            name=name,
+            image=self.default_image,
             auto_remove=True,
             network=network.id,
-            ports={
-                80:     80,
-                443:    443
-            },
+            ports=ports if ports == AUTO_PORTS
+            else self.resolve_ports(name, ports),
+            labels=labels,
+            replace=replace,
             mounts=[
                 confdir,
                 webroot
             ]
         )
-        for f in files:
-            copy(
-                f,
-                os.path.join(webroot_path, os.path.basename(f))
+        with span('sync_files') as phase:
+            self.sync_report = sync_files(
+                manifest_path(name, "webroot"), webroot_path, *files
             )
+            phase.add_bytes(self.sync_report.bytes_copied)
 
 
 class CopyFoldersToMounts(BasicNginXSite):
     """Allow folders to be specified that hold various mounted directories."""
+    @traced('deploy')
     def __init__(
                 self,
                 name,
                 webroot: MountPoint,
                 confdir: Optional[MountPoint]=None,
-                other_mounts: Optional[OtherMount]=None
+                other_mounts: Optional[OtherMount]=None,
+                ports: Ports=None,
+                labels: Optional[Dict[str, str]]=None,
+                replace: bool=False,
+                volumes: bool=False
             ):
         """Allows folders to be specified that hold various mounted directories.
 
@@ -246,110 +699,128 @@ class CopyFoldersToMounts(BasicNginXSite):
                     "incoming_data": filepath of folder to be copied
                 }
             }
+
+        See resolve_ports() for the ports argument. labels are added to the
+        container's labels; for replace, see BasicNginXSite.redeploy().
+
+        If volumes is True, each source is instead copied into a named volume
+        (see src.volumes) which is mounted read-only. Sites with the same
+        content share a volume, so it's only filled once and the container
+        needs nothing copied into it. Sources must then be filepaths, and the
+        host mount points aren't used.
         """
-        if len(webroot) > 1:
+        if len(webroot) != 1:
             raise ValueError(
                 "The webroot mapping must have a length of one, it has %d"
                 % len(webroot)
             )
-        if len(confdir) > 1:
+        if confdir is None:
+            confdir = {
+                os.path.join(get_parent_dir(name), "configuration"):
+                    Config.default_nginx_config
+            }
+        if len(confdir) != 1:
             raise ValueError(
                 "The confdir mapping must have a length of one, it has %d"
                 % len(confdir)
             )
-        if confdir is None:
-            the_confdir = Config.default_nginx_config
-        else:
-            the_confdir = confdir
         network = self.get_network(name)
-        webroot_mount, webroot_archive = self.get_mount_for(
-            source=tuple(webroot.values())[0],
-            destination=tuple(webroot.keys())[0],
-            mount_point='/usr/share/nginx/html'
-        )
-        confdir_mount, confdir_archive = self.get_mount_for(
-            mount_point=tuple(confdir.keys())[0],
-            destination='/etc/nginx',
-            source=the_confdir
-        )
-        mounts = {
-            webroot_mount: webroot_archive,
-            confdir_mount: confdir_archive
-        }
+        (webroot_host, webroot_source), = webroot.items()
+        (confdir_host, confdir_source), = confdir.items()
+        wanted = [
+            (webroot_source, '/usr/share/nginx/html', webroot_host),
+            (confdir_source, '/etc/nginx', confdir_host)
+        ]
         try:
             for host_mnt, container_config in other_mounts.items():
-                mnt, tarfile = self.get_mount_for(
-                    source=container_config['incoming_data'],
-                    mount_point=host_mnt,
-                    destination=container_config['destination']
-                )
-                mounts.update({mnt: tarfile})
+                wanted.append((
+                    container_config['incoming_data'],
+                    container_config['destination'],
+                    host_mnt
+                ))
         except AttributeError:
             if other_mounts is not None:
                 # other_mounts is an optional argument, and errors caused by
                 # its lack of presence should simply be ignored.
                 raise
+        get_mount = self.get_volume_for if volumes else self.get_mount_for
+        mounts = [
+            get_mount(
+                source=source, destination=destination, mount_point=host_mnt
+            ) for source, destination, host_mnt in wanted
+        ]
         super().__init__(
-            image="nginx:latest",
+            name=name,
+            image=self.default_image,
             auto_remove=True,
             network=network.id,
-            ports={
-                80:     80,
-                443:    443
-            },
-            mounts=list(mounts.keys())
+            ports=ports if ports == AUTO_PORTS
+            else self.resolve_ports(name, ports),
+            labels=labels,
+            replace=replace,
+            mounts=[mount for mount, _ in mounts]
         )
-        for mount_point, archive in mounts.items():
-            self.container.put_archive(path=mount_point, data=archive)
+        for mount, archive in mounts:
+            if archive is None:
+                # Already in its volume.
+                continue
+            # The archive is a generator, streamed to the daemon as it's
+            # built, so this span includes building it.
+            with span('put_archive', path=mount['Target']) as phase:
+                self.container.put_archive(
+                    path=mount['Target'], data=counted(archive, phase)
+                )
 
+    @traced('get_mount_for')
     @strict
     def get_mount_for(
                 self,
                 source: Union[str, tarfile.TarFile],
                 destination: str,
                 mount_point: str
-            ) -> Tuple[Mount, str]:
-        """Return a mount and the location of a tarfile to put in that mount.
+            ) -> Tuple[Mount, Iterator[bytes]]:
+        """Return a mount and a stream of the tar archive to put in it.
 
         source should be the location of the source files
         destination should be the mount point inside the container
         mount_point should be the host mount point.
+
+        The archive of a source path comes from Config.archive_cache, and is
+        only built if the source has changed since it was last archived. An
+        open tarfile is copied member by member while put_archive reads it.
         """
-        tmpstore = os.path.join(
-            root, 'tmp', 'quick_deployments', 'tmpstore'
-        )
-        check_isdir(tmpstore)
+        check_isdir(mount_point)
         if isinstance(source, str):
-            with tarfile.open(os.path.join(
-                        tmpstore, '%s.tar' % hash_of_str(mount_point)[:15]
-                    ), 'w') as tf:
-                for f in list_recursively(source):
-                    tf.add(f)
+            archive = Config.archive_cache.stream(source)
         else:
-            os.makedirs(tmpstore)
-            # Extract the received tarfile into a temporary storage.
-            source.extractall(tmpstore)
-            # then write the temporary storage to a new archive.
-            with tarfile.open(os.path.join(
-                        root,
-                        'tmp',
-                        'quick_deployments',
-                        '%s.tar' % hash_of_str(mount_point)[:15]
-                    ), 'w') as tf:
-                for f in list_recursively(tmpstore):
-                    tf.add(f)
-            for f in list_recursively(tmpstore):
-                os.remove(f)
-            os.removedirs(tmpstore)
+            archive = restream_tar(source)
         mnt = Mount(
             target=destination,
             source=mount_point,
             type='bind',
-            read_only=True
-        )
-        return mnt, os.path.join(
-            root,
-            'tmp',
-            'quick_deployments',
-            '%s.tar' % hash_of_str(mount_point)[:15]
+            # put_archive refuses to write through a read-only mount.
+            read_only=False
         )
+        return mnt, archive
+
+    @traced('get_volume_for')
+    @strict
+    def get_volume_for(
+                self,
+                source: Union[str, tarfile.TarFile],
+                destination: str,
+                mount_point: str
+            ) -> Tuple[Mount, None]:
+        """Return a mount of a volume holding source, and no archive.
+
+        The arguments are those of get_mount_for(), though mount_point isn't
+        used. The volume comes from Config.content_volumes, and is only
+        filled if no volume holds the same content yet.
+        """
+        if not isinstance(source, str):
+            raise ValueError(
+                "Only folders can be copied into volumes, not open tarfiles."
+            )
+        image = self.resolve_image(self.default_image)
+        volume = Config.content_volumes.acquire(source, image.id)
+        return Config.content_volumes.mount(volume, destination), None
@@ -0,0 +1,88 @@
+"""Deployment of many sites at once.
+
+Each site's constructor makes several blocking requests to the docker
+daemon, one after another. deploy_many() runs many constructors side by side
+on a bounded pool of threads, after first resolving (and if necessary
+pulling) each distinct image the sites need exactly once.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic
+from src.basic_nginx_site import BasicNginXSite
+from src.typecheck import strict
+
+# The docker client keeps a pool of ten connections, so more threads than
+# that only queue for a connection.
+DEFAULT_WORKERS = 8
+
+
+class SiteSpec(namedtuple('SiteSpec', ['site', 'args', 'kwargs'])):
+    """A site to be deployed: a BasicNginXSite class and its arguments."""
+    @classmethod
+    def of(cls, site: type, *args, **kwargs) -> 'SiteSpec':
+        """Describe a site with the arguments its constructor should get."""
+        return cls(site, args, kwargs)
+
+    @property
+    def name(self) -> str:
+        """The name of the site, the first argument to each constructor."""
+        try:
+            return self.kwargs['name']
+        except KeyError:
+            return self.args[0]
+
+    @property
+    def image(self) -> str:
+        """The image the site will be created from."""
+        return self.kwargs.get('image', self.site.default_image)
+
+    def deploy(self) -> BasicNginXSite:
+        """Construct the site."""
+        return self.site(*self.args, **self.kwargs)
+
+
+DeployResult = namedtuple('DeployResult', ['sites', 'failures', 'elapsed'])
+DeployResult.__doc__ = """The outcome of deploy_many().
+
+sites maps the name of each site which was deployed to its instance,
+failures maps the name of each which wasn't to the exception raised, and
+elapsed is the time taken in seconds.
+"""
+
+
+@strict
+def deploy_many(specs: list, workers: int=DEFAULT_WORKERS) -> DeployResult:
+    """Deploy the sites described by specs, a list of SiteSpecs.
+
+    Up to workers sites are constructed at the same time. A failure to
+    deploy one site doesn't stop the others; it's recorded in the result.
+    Sites whose image couldn't be resolved aren't attempted.
+    """
+    started = monotonic()
+    sites = {}
+    failures = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        resolving = {
+            pool.submit(BasicNginXSite.resolve_image, image): image
+            for image in {spec.image for spec in specs}
+        }
+        unavailable = {}
+        for future in as_completed(resolving):
+            try:
+                future.result()
+            except Exception as error:
+                unavailable[resolving[future]] = error
+        deploying = {}
+        for spec in specs:
+            if spec.image in unavailable:
+                failures[spec.name] = unavailable[spec.image]
+            else:
+                deploying[pool.submit(spec.deploy)] = spec.name
+        for future in as_completed(deploying):
+            try:
+                sites[deploying[future]] = future.result()
+            except Exception as error:
+                failures[deploying[future]] = error
+    return DeployResult(
+        sites=sites, failures=failures, elapsed=monotonic() - started
+    )
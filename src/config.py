@@ -1,15 +1,303 @@
-"""Configuration values for the project."""
-from docker import DockerClient
+"""Configuration values for the project.
+
+Nothing from docker or nmap is imported until it is first needed, so
+importing this module (and the modules which only need its paths) is cheap
+and works on hosts which have neither installed.
+"""
 from os import sep as root
 from os.path import join
-from nmap.nmap import PortScanner
-from typing import List
-from strict_hint import strict
+from threading import Lock, RLock, Thread
+from time import monotonic
+from typing import Any, Callable, List, Dict, Optional, TYPE_CHECKING
+from src.typecheck import strict
+if TYPE_CHECKING:
+    from docker import DockerClient
+    from docker.models.images import Image
+    from docker.models.networks import Network
+    from nmap.nmap import PortScanner
+    from src.archive import ArchiveCache
+    from src.ports import PortAllocator
+    from src.state import StateTracker
+    from src.volumes import ContentVolumes
+    from src.webroot_store import WebrootStore
+
+
+class LazyAttribute():
+    """A class attribute which is only created when it is first read.
+
+    The factory is called once, under a lock, and its result is returned for
+    every read after that. A value may be injected instead by assigning to the
+    attribute on the owning class, e.g. `Config.client = some_client`, which
+    replaces this descriptor altogether.
+    """
+    def __init__(self, factory: Callable[[], Any]):
+        """Store the factory; it isn't called yet."""
+        self.factory = factory
+        self._lock = Lock()
+        self._created = False
+        self._value = None
+
+    def __get__(self, instance, owner):
+        """Create the value if necessary and return it."""
+        if not self._created:
+            with self._lock:
+                if not self._created:
+                    self._value = self.factory()
+                    self._created = True
+        return self._value
+
+
+def _docker_client() -> 'DockerClient':
+    """Connect to the docker daemon named in the configuration."""
+    from docker import DockerClient
+    return DockerClient(Config.docker_url, version=Config.docker_api_version)
+
+
+def _archive_cache() -> 'ArchiveCache':
+    """Create the archive cache at the configured location."""
+    from src.archive import ArchiveCache
+    return ArchiveCache(
+        Config.archive_cache_dir, Config.archive_cache_max_bytes
+    )
+
+
+def _state_tracker() -> 'StateTracker':
+    """Create the tracker which follows container events."""
+    from src.state import StateTracker
+    return StateTracker()
+
+
+def _port_allocator() -> 'PortAllocator':
+    """Create the allocator for host ports in the configured range."""
+    from src.ports import PortAllocator
+    return PortAllocator(Config.port_range)
+
+
+def _webroot_store() -> 'WebrootStore':
+    """Open the shared webroot store at the configured location."""
+    from src.webroot_store import WebrootStore
+    return WebrootStore(Config.webroot_store_dir)
+
+
+def _content_volumes() -> 'ContentVolumes':
+    """Open the record of the volumes holding deployed content."""
+    from src.volumes import ContentVolumes
+    return ContentVolumes(Config.content_volumes_dir)
+
+
+def _port_scanner() -> 'PortScanner':
+    """Create an nmap port scanner. This probes for the nmap binary."""
+    from nmap.nmap import PortScanner
+    return PortScanner()
+
+
+class ImageIndex():
+    """A shared mapping of image tags to the local images they refer to.
+
+    Images are also found by their digest references (repository@sha256:...).
+    The tag list is loaded from the daemon in a single request and kept until
+    either `ttl` seconds have passed or an image event is seen on the docker
+    event stream, which is followed from the first load on (see watch()).
+    Image objects are fetched the first time their
+    tag is asked for and reused afterwards, so a repeated lookup is a
+    dictionary hit. All access is guarded by a lock so that one index may be
+    shared between threads.
+    """
+    def __init__(self, ttl: float=60.0):
+        """Create an empty index; nothing is loaded until it's first used."""
+        self.ttl = ttl
+        self._lock = RLock()
+        self._ids = {}      # type: Dict[str, str]
+        self._images = {}   # type: Dict[str, 'Image']
+        self._loaded_at = None
+        self._watcher = None
+        self._events = None
+
+    @property
+    def stale(self) -> bool:
+        """Whether the index needs to be reloaded before it's next read."""
+        return self._loaded_at is None \
+            or monotonic() - self._loaded_at > self.ttl
+
+    def invalidate(self):
+        """Forget everything, causing a reload on the next lookup."""
+        with self._lock:
+            self._loaded_at = None
+            self._images.clear()
+
+    def load(self):
+        """Rebuild the tag -> image ID map with one request to the daemon."""
+        # Subscribed before listing, so no change after the list is missed.
+        self.watch()
+        ids = {}
+        for summary in Config.client.api.images():
+            for tag in (summary.get('RepoTags') or []) \
+                    + (summary.get('RepoDigests') or []):
+                ids[tag] = summary['Id']
+        present = set(ids.values())
+        with self._lock:
+            self._ids = ids
+            self._images = {
+                image_id: image for image_id, image in self._images.items()
+                if image_id in present
+            }
+            self._loaded_at = monotonic()
+
+    def tags(self) -> List[str]:
+        """Return a list of all available image tags."""
+        with self._lock:
+            if self.stale:
+                self.load()
+            return [tag for tag in self._ids if '@' not in tag]
+
+    def get(self, tag: str):
+        """Get the local image for tag, or None if it isn't present."""
+        with self._lock:
+            if self.stale:
+                self.load()
+            try:
+                image_id = self._ids[tag]
+            except KeyError:
+                return None
+            try:
+                return self._images[image_id]
+            except KeyError:
+                image = Config.client.images.get(image_id)
+                self._images[image_id] = image
+                return image
+
+    def add(self, image: 'Image'):
+        """Record an image which was just pulled or built."""
+        with self._lock:
+            self._images[image.id] = image
+            for tag in image.tags + (image.attrs.get('RepoDigests') or []):
+                self._ids[tag] = image.id
+
+    def watch(self):
+        """Invalidate the index whenever the daemon reports an image event.
+
+        The stream is opened before this returns and followed on a daemon
+        thread; calling this more than once has no further effect while that
+        thread is alive. load() calls it, so it needn't be called otherwise.
+        """
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._events = Config.client.events(
+                decode=True, filters={'type': 'image'}
+            )
+            self._watcher = Thread(
+                target=self._follow_events,
+                args=(self._events,),
+                name="image-index-events",
+                daemon=True
+            )
+            self._watcher.start()
+
+    def stop(self):
+        """Stop following the event stream."""
+        with self._lock:
+            events, self._events = self._events, None
+        if events is not None:
+            events.close()
+
+    def _follow_events(self, events):
+        """Consume image events until the stream closes."""
+        try:
+            for _ in events:
+                self.invalidate()
+        finally:
+            # The stream has closed, so changes may have been missed; the
+            # next load reopens it.
+            self.invalidate()
+
+
+class NetworkRegistry():
+    """A local registry of the networks which belong to each site.
+
+    Networks are looked up with a server-side name filter, so finding one
+    costs a single request no matter how many networks the daemon has, and
+    are remembered afterwards. Creation is serialised per name and a name
+    conflict reported by the daemon (another process created the network
+    first) is recovered from by fetching the network which won.
+    """
+    def __init__(self):
+        """Create an empty registry."""
+        self._lock = Lock()
+        self._networks = {}     # type: Dict[str, 'Network']
+        self._name_locks = {}   # type: Dict[str, Lock]
+
+    def _lock_for(self, name: str) -> Lock:
+        """Get the lock which serialises creation of the named network."""
+        with self._lock:
+            return self._name_locks.setdefault(name, Lock())
+
+    @staticmethod
+    def lookup(name: str):
+        """Find the network with exactly this name, or None."""
+        # The names filter matches substrings, so the result still needs
+        # checked for an exact match.
+        for network in Config.client.networks.list(names=[name]):
+            if network.name == name:
+                return network
+        return None
+
+    def get_or_create(self, name: str) -> 'Network':
+        """Get the named network, creating it if it doesn't yet exist."""
+        from docker.errors import APIError
+        try:
+            return self._networks[name]
+        except KeyError:
+            pass
+        with self._lock_for(name):
+            if name in self._networks:
+                # Created by another thread while this one waited.
+                return self._networks[name]
+            network = self.lookup(name)
+            if network is None:
+                try:
+                    network = Config.client.networks.create(
+                        name=name, check_duplicate=True
+                    )
+                except APIError as error:
+                    if error.status_code != 409:
+                        raise
+                    # Lost a race with someone outside this process.
+                    network = self.lookup(name)
+                    if network is None:
+                        raise
+            self._networks[name] = network
+            return network
+
+    def forget(self, name: str):
+        """Drop a network from the registry, e.g. after it was removed."""
+        with self._lock:
+            self._networks.pop(name, None)
+
+    def renew(self, network_id: str) -> Optional['Network']:
+        """Replace a remembered network which the daemon no longer has.
+
+        Call this when the daemon reports the network with this ID as not
+        found, e.g. because it was removed by another process. The network
+        is looked up or created again under the same name and returned, or
+        None is returned if the ID isn't one the registry remembers.
+        """
+        with self._lock:
+            names = [
+                name for name, network in self._networks.items()
+                if network.id == network_id
+            ]
+        if not names:
+            return None
+        self.forget(names[0])
+        return self.get_or_create(names[0])
 
 
 class Config():
     """Configuration values. Static object."""
-    client = DockerClient('unix://var/run/docker.sock', version='1.37')
+    docker_url = 'unix://var/run/docker.sock'
+    docker_api_version = '1.37'
+    client = LazyAttribute(_docker_client)
     default_nginx_webroot = join(
         root, 'usr', 'share', 'quick_deployments', 'nginx_default', 'webroot'
     )
@@ -21,14 +309,40 @@ class Config():
         'nginx_default',
         'configuration'
     )
-    port_scanner = PortScanner()
+    port_scanner = LazyAttribute(_port_scanner)
+    # Host ports are allocated from this range (inclusive). It's below the
+    # kernel's default range for ephemeral ports.
+    port_range = (20000, 29999)
+    port_allocator = LazyAttribute(_port_allocator)
+    archive_cache_dir = join(root, 'tmp', 'quick_deployments', 'archives')
+    archive_cache_max_bytes = 2 * 1024 ** 3
+    archive_cache = LazyAttribute(_archive_cache)
+    state_tracker = LazyAttribute(_state_tracker)
+    webroot_store_dir = join(
+        root, 'usr', 'share', 'quick_deployments', 'store'
+    )
+    webroot_store = LazyAttribute(_webroot_store)
+    content_volumes_dir = join(
+        root, 'usr', 'share', 'quick_deployments', 'volumes'
+    )
+    content_volumes = LazyAttribute(_content_volumes)
+    # Seconds a container being replaced has to exit before it's killed.
+    stop_grace_period = 3
+    # Seconds a replaced container keeps running after traffic is switched
+    # away from it, to finish the requests it's serving.
+    drain_period = 2.0
+    # How many containers are stopped or removed at a time.
+    teardown_batch_size = 8
+    # Called with each timing span of a deploy; see src.telemetry.
+    telemetry_sink = None   # type: Optional[Callable]
+    image_index = ImageIndex()
+    # Tags mapped to the digest references of the images to use for them, so
+    # that every deploy of a tag gets the same image; see src.images.
+    image_pins = {}     # type: Dict[str, str]
+    networks = NetworkRegistry()
 
     @staticmethod
     @strict
     def all_image_tags() -> List[str]:
         """Return a list of all available image tags."""
-        tags = []
-        for image in Config.client.images.list():
-            for tag in image.tags:
-                tags.append(tag)
-        return tags
+        return Config.image_index.tags()
@@ -0,0 +1,814 @@
+"""An in-process stand-in for the docker daemon.
+
+FakeDockerClient is a DockerClient whose low-level API client keeps images,
+networks and containers in memory instead of talking to a daemon. The
+high-level collections and models (client.containers, Container.stop() and
+so on) are docker's own, working on top of it, so the code under test runs
+exactly as it does against a real daemon. It covers the calls this project
+makes.
+
+Every API call can be slowed by a fixed latency, per call or for all of
+them, and made to fail, either at random or the next few times it's made,
+so that the throughput and concurrency of the deploy paths can be measured
+on any machine:
+
+    Config.client = FakeDockerClient(latency=0.005, images=['nginx:latest'])
+
+calls counts the calls made by name.
+"""
+import json
+import re
+import tarfile
+from collections import Counter
+from copy import deepcopy
+from datetime import datetime, timezone
+from hashlib import sha256
+from io import BytesIO
+from itertools import count
+from queue import Queue, Empty
+from random import Random
+from threading import RLock
+from time import sleep, time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from docker import DockerClient
+from docker.errors import APIError, ImageNotFound, NotFound
+
+_ids = count(1)
+
+
+def fake_id(kind: str) -> str:
+    """A new 64 digit hexadecimal ID, like the daemon's."""
+    return sha256(("%s-%d" % (kind, next(_ids))).encode()).hexdigest()
+
+
+def timestamp() -> str:
+    """The current time, formatted as the daemon formats times."""
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class FakeResponse():
+    """Just enough of a requests.Response for docker's APIError."""
+    def __init__(self, status_code: int, reason: str=''):
+        self.status_code = status_code
+        self.reason = reason
+
+
+def api_error(status_code: int, message: str, error: type=APIError):
+    """An APIError (or subclass) like the one the daemon would cause."""
+    return error(
+        message, response=FakeResponse(status_code), explanation=message
+    )
+
+
+class EventStream():
+    """A stream of events, like docker's CancellableStream."""
+    def __init__(self, unsubscribe: Callable[['EventStream'], None]):
+        self.queue = Queue()
+        self._unsubscribe = unsubscribe
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        while not self._closed:
+            try:
+                return self.queue.get(timeout=0.1)
+            except Empty:
+                continue
+        raise StopIteration
+
+    def close(self):
+        """End the stream."""
+        self._closed = True
+        self._unsubscribe(self)
+
+
+class FakeAPIClient():
+    """The in-memory state and low-level API behind a FakeDockerClient."""
+    _version = '1.37'
+
+    def __init__(
+                self,
+                latency: float=0.0,
+                latencies: Optional[Dict[str, float]]=None,
+                failure_rates: Optional[Dict[str, float]]=None,
+                seed: Optional[int]=None,
+                exec_handler: Optional[
+                    Callable[[dict, Any], Tuple[int, bytes]]
+                ]=None
+            ):
+        """Create an empty daemon.
+
+        latency is the time each call takes, in seconds, unless latencies
+        gives another time for that call by name. failure_rates gives, by
+        call name, the probability of that call failing with a 500 error;
+        seed seeds the random choices. exec_handler is called with the
+        container's attributes and the command for each exec, and returns
+        the exit code and output; by default every command succeeds with no
+        output.
+        """
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        self.failure_rates = dict(failure_rates or {})
+        self.exec_handler = exec_handler or (lambda container, cmd: (0, b''))
+        self.calls = Counter()
+        self._random = Random(seed)
+        self._failures = Counter()
+        self._lock = RLock()
+        self._images = {}       # type: Dict[str, dict]
+        self._networks = {}     # type: Dict[str, dict]
+        self._volumes = {}      # type: Dict[str, dict]
+        self._containers = {}   # type: Dict[str, dict]
+        self._archives = {}     # type: Dict[str, List[Tuple[str, bytes]]]
+        self._execs = {}        # type: Dict[str, dict]
+        self._subscribers = []  # type: List[EventStream]
+        # The digest and the layer IDs of images in the "registry", by
+        # reference. Images not given here get a digest and a layer of their
+        # own when they're pulled.
+        self.registry = {}      # type: Dict[str, str]
+        self.layers = {}        # type: Dict[str, List[str]]
+        # Called with a response after each call, as requests' hooks are.
+        self.hooks = {'response': []}   # type: Dict[str, List[Callable]]
+
+    # Behaviour injection
+
+    def fail_next(self, call: str, times: int=1):
+        """Make the next times calls of the named call fail."""
+        with self._lock:
+            self._failures[call] += times
+
+    def _call(self, name: str):
+        """Account for a call: count it, wait out its latency, maybe fail."""
+        with self._lock:
+            self.calls[name] += 1
+            fail = self._failures[name] > 0
+            if fail:
+                self._failures[name] -= 1
+            elif name in self.failure_rates:
+                fail = self._random.random() < self.failure_rates[name]
+        delay = self.latencies.get(name, self.latency)
+        if delay:
+            sleep(delay)
+        for hook in list(self.hooks['response']):
+            hook(FakeResponse(500 if fail else 200))
+        if fail:
+            raise api_error(500, "Injected failure of %s." % name)
+
+    def _emit(self, kind: str, action: str, actor_id: str, **attributes):
+        """Send an event to everyone following the event stream."""
+        event = {
+            'Type': kind,
+            'Action': action,
+            'id': actor_id,
+            'status': action,
+            'Actor': {'ID': actor_id, 'Attributes': attributes},
+            'time': int(time()),
+        }
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for stream in subscribers:
+            stream.queue.put(event)
+
+    # System
+
+    def ping(self) -> bool:
+        self._call('ping')
+        return True
+
+    def version(self, api_version: bool=True) -> dict:
+        self._call('version')
+        return {'ApiVersion': self._version, 'Version': 'fake'}
+
+    def events(
+                self,
+                since=None,
+                until=None,
+                filters: Optional[dict]=None,
+                decode: Optional[bool]=None
+            ) -> EventStream:
+        self._call('events')
+        kinds = (filters or {}).get('type')
+        kinds = [kinds] if isinstance(kinds, str) else kinds
+
+        def unsubscribe(stream):
+            with self._lock:
+                if stream in self._subscribers:
+                    self._subscribers.remove(stream)
+        stream = EventStream(unsubscribe)
+        if kinds:
+            put = stream.queue.put
+            stream.queue.put = lambda event: \
+                put(event) if event['Type'] in kinds else None
+        with self._lock:
+            self._subscribers.append(stream)
+        return stream
+
+    # Images
+
+    def add_image(self, reference: str, digest: Optional[str]=None) -> dict:
+        """Put an image in the local store without pulling it."""
+        repository, tag = reference.rsplit(':', 1) \
+            if ':' in reference.rsplit('/', 1)[-1] else (reference, 'latest')
+        with self._lock:
+            for image in self._images.values():
+                if "%s:%s" % (repository, tag) in image['RepoTags']:
+                    return image
+            image_id = 'sha256:' + fake_id('image')
+            digest = digest or self.registry.get(
+                "%s:%s" % (repository, tag)
+            ) or 'sha256:' + fake_id('digest')
+            layers = self.layers.get("%s:%s" % (repository, tag)) \
+                or [fake_id('layer')[:12]]
+            image = {
+                'Id': image_id,
+                'RepoTags': ["%s:%s" % (repository, tag)],
+                'RepoDigests': ["%s@%s" % (repository, digest)],
+                'Created': timestamp(),
+                'Size': 0,
+                'RootFS': {'Type': 'layers', 'Layers': list(layers)},
+            }
+            self._images[image_id] = image
+        self._emit('image', 'pull', "%s:%s" % (repository, tag))
+        return image
+
+    def _find_image(self, name: str) -> dict:
+        """Look an image up by tag, digest or (short) ID."""
+        with self._lock:
+            if ':' not in name.rsplit('/', 1)[-1] and '@' not in name \
+                    and not re.fullmatch('[0-9a-f]{12,64}', name):
+                name += ':latest'
+            for image in self._images.values():
+                if name in image['RepoTags'] or name in image['RepoDigests'] \
+                        or image['Id'] == name \
+                        or image['Id'][len('sha256:'):].startswith(name):
+                    return image
+        raise api_error(404, "No such image: %s" % name, ImageNotFound)
+
+    def images(
+                self,
+                name: Optional[str]=None,
+                quiet: bool=False,
+                all: bool=False,
+                filters: Optional[dict]=None
+            ) -> list:
+        self._call('images')
+        with self._lock:
+            summaries = [deepcopy(image) for image in self._images.values()]
+        if name:
+            summaries = [
+                image for image in summaries if any(
+                    tag.rsplit(':', 1)[0] == name for tag in image['RepoTags']
+                )
+            ]
+        if quiet:
+            return [image['Id'] for image in summaries]
+        return summaries
+
+    def inspect_image(self, image: str) -> dict:
+        self._call('inspect_image')
+        return deepcopy(self._find_image(image))
+
+    def pull(
+                self,
+                repository: str,
+                tag: Optional[str]=None,
+                stream: bool=False,
+                decode: bool=False,
+                **kwargs
+            ):
+        """Pull an image; every image exists in the fake's registry."""
+        self._call('pull')
+        tag = tag or 'latest'
+        with self._lock:
+            present = {
+                layer for image in self._images.values()
+                for layer in image['RootFS']['Layers']
+            }
+        if tag.startswith('sha256:'):
+            reference = "%s@%s" % (repository, tag)
+            with self._lock:
+                known = [
+                    ref for ref, digest in self.registry.items()
+                    if digest == tag
+                ]
+            image = self.add_image(known[0] if known else repository, tag)
+        else:
+            reference = "%s:%s" % (repository, tag)
+            image = self.add_image(reference)
+        progress = [{'status': 'Pulling from %s' % repository, 'id': tag}]
+        progress += [
+            {
+                'status': 'Already exists' if layer in present
+                else 'Pull complete',
+                'id': layer
+            } for layer in image['RootFS']['Layers']
+        ]
+        progress += [
+            {'status': 'Digest: %s' % image['RepoDigests'][0].split('@')[1]},
+            {'status': 'Status: Downloaded newer image for %s' % reference},
+        ]
+        if not decode:
+            progress = [json.dumps(line).encode() for line in progress]
+        return iter(progress) if stream else b'\n'.join(
+            line if isinstance(line, bytes) else json.dumps(line).encode()
+            for line in progress
+        ).decode()
+
+    # Networks
+
+    def networks(
+                self,
+                names: Optional[List[str]]=None,
+                ids: Optional[List[str]]=None,
+                filters: Optional[dict]=None
+            ) -> list:
+        self._call('networks')
+        with self._lock:
+            found = [deepcopy(net) for net in self._networks.values()]
+        if names:
+            # The daemon matches names as substrings.
+            found = [
+                net for net in found
+                if any(name in net['Name'] for name in names)
+            ]
+        if ids:
+            found = [
+                net for net in found
+                if any(net['Id'].startswith(i) for i in ids)
+            ]
+        return found
+
+    def create_network(
+                self,
+                name: str,
+                driver: Optional[str]=None,
+                check_duplicate: Optional[bool]=None,
+                labels: Optional[dict]=None,
+                **kwargs
+            ) -> dict:
+        self._call('create_network')
+        with self._lock:
+            if any(net['Name'] == name for net in self._networks.values()):
+                raise api_error(
+                    409, "network with name %s already exists" % name
+                )
+            network_id = fake_id('network')
+            self._networks[network_id] = {
+                'Id': network_id,
+                'Name': name,
+                'Driver': driver or 'bridge',
+                'Labels': labels or {},
+                'Created': timestamp(),
+                'Containers': {},
+            }
+        self._emit('network', 'create', network_id, name=name)
+        return {'Id': network_id, 'Warning': ''}
+
+    def _find_network(self, net_id: str) -> dict:
+        with self._lock:
+            for net in self._networks.values():
+                if net['Id'].startswith(net_id) or net['Name'] == net_id:
+                    return net
+        raise api_error(404, "network %s not found" % net_id, NotFound)
+
+    def inspect_network(self, net_id: str, verbose=None, scope=None) -> dict:
+        self._call('inspect_network')
+        return deepcopy(self._find_network(net_id))
+
+    def remove_network(self, net_id: str):
+        self._call('remove_network')
+        with self._lock:
+            self._networks.pop(self._find_network(net_id)['Id'])
+
+    def connect_container_to_network(
+                self, container: str, net_id: str, aliases=None, **kwargs
+            ):
+        self._call('connect_container_to_network')
+        with self._lock:
+            attrs = self._find_container(container)
+            net = self._find_network(net_id)
+            attrs['NetworkSettings']['Networks'][net['Name']] = {
+                'NetworkID': net['Id'], 'Aliases': list(aliases or [])
+            }
+
+    def disconnect_container_from_network(
+                self, container: str, net_id: str, force: bool=False
+            ):
+        self._call('disconnect_container_from_network')
+        with self._lock:
+            attrs = self._find_container(container)
+            net = self._find_network(net_id)
+            attrs['NetworkSettings']['Networks'].pop(net['Name'], None)
+
+    # Volumes
+
+    def _find_volume(self, name: str) -> dict:
+        with self._lock:
+            try:
+                return self._volumes[name]
+            except KeyError:
+                raise api_error(
+                    404, "get %s: no such volume" % name, NotFound
+                )
+
+    def volumes(self, filters: Optional[dict]=None) -> dict:
+        self._call('volumes')
+        with self._lock:
+            found = [deepcopy(volume) for volume in self._volumes.values()]
+        for key, wanted in (filters or {}).items():
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            if key == 'name':
+                found = [
+                    volume for volume in found
+                    if any(name in volume['Name'] for name in wanted)
+                ]
+            elif key == 'label':
+                found = [
+                    volume for volume in found
+                    if all(self._labelled(volume['Labels'], label)
+                           for label in wanted)
+                ]
+        return {'Volumes': found, 'Warnings': None}
+
+    @staticmethod
+    def _labelled(labels: Optional[dict], label: str) -> bool:
+        """Whether labels match a label filter, key or key=value."""
+        key, _, value = label.partition('=')
+        labels = labels or {}
+        return key in labels and (not value or labels[key] == value)
+
+    def create_volume(
+                self,
+                name: Optional[str]=None,
+                driver: Optional[str]=None,
+                driver_opts: Optional[dict]=None,
+                labels: Optional[dict]=None
+            ) -> dict:
+        """Create a volume; like the daemon, return one which exists."""
+        self._call('create_volume')
+        name = name or fake_id('volume')
+        with self._lock:
+            if name not in self._volumes:
+                self._volumes[name] = {
+                    'Name': name,
+                    'Driver': driver or 'local',
+                    'Labels': dict(labels or {}),
+                    'Mountpoint': '/var/lib/docker/volumes/%s/_data' % name,
+                    'CreatedAt': timestamp(),
+                    'Scope': 'local',
+                }
+            volume = deepcopy(self._volumes[name])
+        self._emit('volume', 'create', name)
+        return volume
+
+    def inspect_volume(self, name: str) -> dict:
+        self._call('inspect_volume')
+        return deepcopy(self._find_volume(name))
+
+    def _volume_in_use(self, name: str) -> bool:
+        """Whether a container mounts a volume. The lock must be held."""
+        return any(
+            mount['Type'] == 'volume' and mount['Source'] == name
+            for attrs in self._containers.values()
+            for mount in attrs['Mounts']
+        )
+
+    def remove_volume(self, name: str, force: bool=False):
+        self._call('remove_volume')
+        with self._lock:
+            self._find_volume(name)
+            if self._volume_in_use(name):
+                raise api_error(409, "remove %s: volume is in use" % name)
+            del self._volumes[name]
+        self._emit('volume', 'destroy', name)
+
+    def prune_volumes(self, filters: Optional[dict]=None) -> dict:
+        self._call('prune_volumes')
+        labels = (filters or {}).get('label') or []
+        labels = [labels] if isinstance(labels, str) else labels
+        with self._lock:
+            unused = [
+                name for name, volume in self._volumes.items()
+                if not self._volume_in_use(name)
+                and all(self._labelled(volume['Labels'], label)
+                        for label in labels)
+            ]
+            for name in unused:
+                del self._volumes[name]
+        return {'VolumesDeleted': unused, 'SpaceReclaimed': 0}
+
+    # Containers
+
+    def _find_container(self, container: str) -> dict:
+        with self._lock:
+            for attrs in self._containers.values():
+                if attrs['Id'].startswith(container) \
+                        or attrs['Name'] == '/' + container.lstrip('/'):
+                    return attrs
+        raise api_error(
+            404, "No such container: %s" % container, NotFound
+        )
+
+    @staticmethod
+    def _matches(attrs: dict, filters: dict) -> bool:
+        """Whether a container matches the filters of a containers call."""
+        for key, wanted in filters.items():
+            wanted = [wanted] if isinstance(wanted, (str, bool)) else wanted
+            if key == 'name':
+                if not any(re.search(w, attrs['Name']) for w in wanted):
+                    return False
+            elif key == 'label':
+                labels = attrs['Config']['Labels'] or {}
+                for label in wanted:
+                    label_key, _, value = label.partition('=')
+                    if label_key not in labels \
+                            or (value and labels[label_key] != value):
+                        return False
+            elif key == 'status':
+                if attrs['State']['Status'] not in wanted:
+                    return False
+            elif key == 'id':
+                if not any(attrs['Id'].startswith(w) for w in wanted):
+                    return False
+        return True
+
+    def containers(
+                self,
+                quiet: bool=False,
+                all: bool=False,
+                filters: Optional[dict]=None,
+                **kwargs
+            ) -> list:
+        self._call('containers')
+        with self._lock:
+            found = [
+                attrs for attrs in self._containers.values()
+                if (all or attrs['State']['Running'])
+                and self._matches(attrs, filters or {})
+            ]
+            summaries = [{
+                'Id': attrs['Id'],
+                'Names': [attrs['Name']],
+                'Image': attrs['Config']['Image'],
+                'ImageID': attrs['Image'],
+                'Labels': dict(attrs['Config']['Labels'] or {}),
+                'State': attrs['State']['Status'],
+                'Status': attrs['State']['Status'],
+            } for attrs in found]
+        if quiet:
+            return [{'Id': summary['Id']} for summary in summaries]
+        return summaries
+
+    def create_container(
+                self,
+                image: str,
+                command=None,
+                name: Optional[str]=None,
+                labels: Optional[dict]=None,
+                host_config: Optional[dict]=None,
+                networking_config: Optional[dict]=None,
+                **kwargs
+            ) -> dict:
+        self._call('create_container')
+        host_config = dict(host_config or {})
+        found = self._find_image(image)
+        with self._lock:
+            if name is None:
+                name = "fake_%s" % fake_id('name')[:8]
+            if any(
+                        attrs['Name'] == '/' + name
+                        for attrs in self._containers.values()
+                    ):
+                raise api_error(
+                    409, 'Conflict. The container name "/%s" is already in '
+                    'use.' % name
+                )
+            networks = {}
+            mode = host_config.get('NetworkMode')
+            if mode and mode not in ('default', 'bridge', 'host', 'none'):
+                net = self._find_network(mode)
+                networks[net['Name']] = {'NetworkID': net['Id']}
+            else:
+                networks['bridge'] = {}
+            container_id = fake_id('container')
+            self._containers[container_id] = {
+                'Id': container_id,
+                'Created': timestamp(),
+                'Name': '/' + name,
+                'Image': found['Id'],
+                'Config': {
+                    'Image': image,
+                    'Cmd': command,
+                    'Labels': dict(labels or {}),
+                },
+                'HostConfig': host_config,
+                'Mounts': [
+                    {
+                        'Type': mount.get('Type'),
+                        'Source': mount.get('Source'),
+                        'Destination': mount.get('Target'),
+                        'RW': not mount.get('ReadOnly', False),
+                    } for mount in host_config.get('Mounts') or []
+                ],
+                'NetworkSettings': {'Networks': networks},
+                'State': {
+                    'Status': 'created',
+                    'Running': False,
+                    'Paused': False,
+                    'Restarting': False,
+                    'OOMKilled': False,
+                    'Dead': False,
+                    'Pid': 0,
+                    'ExitCode': 0,
+                    'Error': '',
+                    'StartedAt': '0001-01-01T00:00:00Z',
+                    'FinishedAt': '0001-01-01T00:00:00Z',
+                },
+            }
+            self._archives[container_id] = []
+        self._emit('container', 'create', container_id, name=name)
+        return {'Id': container_id, 'Warnings': []}
+
+    def inspect_container(self, container: str) -> dict:
+        self._call('inspect_container')
+        return deepcopy(self._find_container(container))
+
+    def _host_ports(self, attrs: dict) -> set:
+        """The host ports a container binds."""
+        return {
+            binding.get('HostPort')
+            for bindings in (
+                attrs['HostConfig'].get('PortBindings') or {}
+            ).values()
+            for binding in bindings or ()
+            if binding.get('HostPort')
+        }
+
+    def start(self, container: str, *args, **kwargs):
+        self._call('start')
+        with self._lock:
+            attrs = self._find_container(container)
+            if attrs['State']['Running']:
+                return
+            taken = set()
+            for other in self._containers.values():
+                if other['State']['Running']:
+                    taken |= self._host_ports(other)
+            clash = self._host_ports(attrs) & taken
+            if clash:
+                raise api_error(
+                    500, "Bind for 0.0.0.0:%s failed: port is already "
+                    "allocated" % clash.pop()
+                )
+            attrs['State'].update(
+                Status='running', Running=True, StartedAt=timestamp()
+            )
+        self._emit('container', 'start', attrs['Id'])
+
+    def _exited(self, attrs: dict, exit_code: int):
+        """Move a running container to exited. The lock must be held."""
+        attrs['State'].update(
+            Status='exited',
+            Running=False,
+            ExitCode=exit_code,
+            FinishedAt=timestamp()
+        )
+
+    def stop(self, container: str, timeout: Optional[int]=None):
+        self._call('stop')
+        with self._lock:
+            attrs = self._find_container(container)
+            if not attrs['State']['Running']:
+                # The daemon answers 304 Not Modified, which isn't an error.
+                return
+            self._exited(attrs, 0)
+        self._emit('container', 'die', attrs['Id'], exitCode='0')
+        self._emit('container', 'stop', attrs['Id'])
+        self._auto_remove(attrs)
+
+    def kill(self, container: str, signal=None):
+        self._call('kill')
+        with self._lock:
+            attrs = self._find_container(container)
+            if not attrs['State']['Running']:
+                raise api_error(
+                    409, "Container %s is not running" % attrs['Id']
+                )
+            self._exited(attrs, 137)
+        self._emit('container', 'kill', attrs['Id'])
+        self._emit('container', 'die', attrs['Id'], exitCode='137')
+        self._auto_remove(attrs)
+
+    def _auto_remove(self, attrs: dict):
+        """Remove a container which was created with auto_remove."""
+        if attrs['HostConfig'].get('AutoRemove'):
+            self._remove(attrs)
+
+    def _remove(self, attrs: dict):
+        with self._lock:
+            self._containers.pop(attrs['Id'], None)
+            self._archives.pop(attrs['Id'], None)
+        self._emit('container', 'destroy', attrs['Id'])
+
+    def remove_container(
+                self,
+                container: str,
+                v: bool=False,
+                link: bool=False,
+                force: bool=False
+            ):
+        self._call('remove_container')
+        with self._lock:
+            attrs = self._find_container(container)
+            if attrs['State']['Running']:
+                if not force:
+                    raise api_error(
+                        409, "You cannot remove a running container %s."
+                        % attrs['Id']
+                    )
+                self._exited(attrs, 137)
+        self._remove(attrs)
+
+    def rename(self, container: str, name: str):
+        self._call('rename')
+        with self._lock:
+            attrs = self._find_container(container)
+            if any(
+                        other['Name'] == '/' + name
+                        for other in self._containers.values()
+                    ):
+                raise api_error(409, "Name %s is already in use" % name)
+            attrs['Name'] = '/' + name
+        self._emit('container', 'rename', attrs['Id'], name=name)
+
+    def put_archive(self, container: str, path: str, data) -> bool:
+        """Accept an archive; it's kept for archives() to return."""
+        self._call('put_archive')
+        if not isinstance(data, (bytes, bytearray)):
+            data = b''.join(data)
+        with self._lock:
+            attrs = self._find_container(container)
+            self._archives[attrs['Id']].append((path, bytes(data)))
+        return True
+
+    def archives(self, container: str) -> List[Tuple[str, List[str]]]:
+        """The paths archives were put at and the names of their members."""
+        with self._lock:
+            found = self._find_container(container)
+            stored = list(self._archives[found['Id']])
+        listed = []
+        for path, data in stored:
+            with tarfile.open(fileobj=BytesIO(data)) as archive:
+                listed.append((path, archive.getnames()))
+        return listed
+
+    def exec_create(self, container: str, cmd, **kwargs) -> dict:
+        self._call('exec_create')
+        with self._lock:
+            attrs = self._find_container(container)
+            if not attrs['State']['Running']:
+                raise api_error(
+                    409, "Container %s is not running" % attrs['Id']
+                )
+            exec_id = fake_id('exec')
+            self._execs[exec_id] = {
+                'Container': attrs['Id'], 'Cmd': cmd, 'ExitCode': None
+            }
+        return {'Id': exec_id}
+
+    def exec_start(self, exec_id: str, **kwargs) -> bytes:
+        self._call('exec_start')
+        with self._lock:
+            execution = self._execs[exec_id]
+            attrs = deepcopy(self._containers[execution['Container']])
+        exit_code, output = self.exec_handler(attrs, execution['Cmd'])
+        with self._lock:
+            execution['ExitCode'] = exit_code
+        return output
+
+    def exec_inspect(self, exec_id: str) -> dict:
+        self._call('exec_inspect')
+        with self._lock:
+            return dict(self._execs[exec_id])
+
+
+class FakeDockerClient(DockerClient):
+    """A DockerClient backed by a FakeAPIClient instead of a daemon.
+
+    images are references to put in the local image store to begin with;
+    the other arguments are passed to FakeAPIClient.
+    """
+    def __init__(self, images: Iterable[str]=(), **kwargs):
+        """Create the fake daemon; no connection is made."""
+        self.api = FakeAPIClient(**kwargs)
+        for reference in images:
+            self.api.add_image(reference)
+
+    @property
+    def calls(self) -> Counter:
+        """How many times each API call has been made."""
+        return self.api.calls
+
+    def close(self):
+        """Nothing to close."""
@@ -0,0 +1,215 @@
+"""Pulling images ahead of deploys, and pinning them by digest.
+
+prepull() pulls a set of images side by side before any site needs them, so
+that deploys find them in the local cache instead of each waiting for a
+pull. References are normalised and deduplicated first, images which are
+already present aren't pulled again, and the daemon's progress messages are
+passed to a callback as they arrive. The daemon shares a layer between
+concurrent pulls rather than downloading it twice, and the results record
+this: a layer is counted as downloaded by one pull only, however many of the
+images contain it.
+
+A pin maps a tag (such as nginx:latest) to the digest reference of one
+particular image (nginx@sha256:...). BasicNginXSite.resolve_image() uses
+the pinned image for a tag in Config.image_pins, so every deploy gets the
+same image regardless of what the tag points to upstream. Pins can be
+saved to and loaded from a JSON file to carry them between hosts.
+"""
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Optional, Tuple
+from src.config import Config
+from src.typecheck import strict
+
+# Pulls are mostly waiting on the registry, so several run at once.
+DEFAULT_WORKERS = 4
+
+# The progress statuses of a layer which the daemon had to download...
+DOWNLOADED = ('Download complete', 'Pull complete')
+# ...and of one it already had.
+REUSED = ('Already exists',)
+
+PullResult = namedtuple(
+    'PullResult',
+    ['reference', 'pulled', 'digest', 'layers_downloaded', 'layers_reused',
+     'elapsed', 'error']
+)
+PullResult.__doc__ = """The outcome of getting one image with prepull().
+
+reference is the reference which was pulled (after pinning); pulled is
+False if the image was already present. digest is the reference of the
+image by digest, or None if it has none (e.g. it was built locally).
+layers_downloaded and layers_reused count its layers which were downloaded
+for this pull and those which were already present or downloaded for
+another image. error is the exception which stopped the pull, if any.
+"""
+
+
+@strict
+def split_reference(reference: str) -> Tuple[str, str]:
+    """Split a reference into its repository and its tag or digest.
+
+    A reference without a tag or digest refers to the latest tag. A registry
+    port (as in localhost:5000/site) isn't mistaken for a tag.
+    """
+    if '@' in reference:
+        repository, digest = reference.split('@', 1)
+        return repository, digest
+    repository, _, tag = reference.rpartition(':')
+    if not repository or '/' in tag:
+        return reference, 'latest'
+    return repository, tag
+
+
+@strict
+def normalise(reference: str) -> str:
+    """The reference with its tag made explicit, e.g. nginx:latest."""
+    repository, tag = split_reference(reference)
+    separator = '@' if tag.startswith('sha256:') else ':'
+    return repository + separator + tag
+
+
+@strict
+def pinned(reference: str) -> str:
+    """The reference to use for an image, honouring Config.image_pins."""
+    reference = normalise(reference)
+    return Config.image_pins.get(reference, reference)
+
+
+def digest_reference(image, repository: str) -> Optional[str]:
+    """The repository@digest reference of a local image, if it has one."""
+    for digest in image.attrs.get('RepoDigests') or ():
+        if digest.split('@', 1)[0] == repository:
+            return digest
+    return None
+
+
+def pull_one(
+            reference: str,
+            progress: Optional[Callable[[str, dict], None]],
+            layers: Dict[str, str],
+            layers_lock: Lock
+        ) -> PullResult:
+    """Pull one image, streaming its progress. See prepull().
+
+    layers maps the ID of each layer seen by the pulls so far to the
+    reference of the pull which downloaded it.
+    """
+    started = monotonic()
+    repository, tag = split_reference(reference)
+    downloaded = set()
+    reused = set()
+    try:
+        for event in Config.client.api.pull(
+                    repository, tag=tag, stream=True, decode=True
+                ):
+            if 'error' in event:
+                raise RuntimeError(event['error'])
+            if progress is not None:
+                progress(reference, event)
+            layer = event.get('id')
+            status = event.get('status', '')
+            if layer is None or layer == tag:
+                continue
+            if status in DOWNLOADED:
+                with layers_lock:
+                    if layers.setdefault(layer, reference) == reference:
+                        downloaded.add(layer)
+                    else:
+                        reused.add(layer)
+            elif status in REUSED:
+                reused.add(layer)
+        image = Config.client.images.get(reference)
+        Config.image_index.add(image)
+    except Exception as error:
+        return PullResult(
+            reference, False, None, 0, 0, monotonic() - started, error
+        )
+    reused -= downloaded
+    return PullResult(
+        reference=reference,
+        pulled=True,
+        digest=digest_reference(image, repository),
+        layers_downloaded=len(downloaded),
+        layers_reused=len(reused),
+        elapsed=monotonic() - started,
+        error=None
+    )
+
+
+@strict
+def prepull(
+            references: list,
+            workers: int=DEFAULT_WORKERS,
+            progress: Optional[Callable[[str, dict], None]]=None,
+            pin: bool=False
+        ) -> Dict[str, PullResult]:
+    """Make sure each of the images referred to is present locally.
+
+    Returns a PullResult for each distinct (normalised) reference. Pinned
+    tags are pulled by their digest. Up to workers images are pulled at once,
+    and progress, if given, is called from the pulling threads with the
+    reference and each progress message from the daemon. A failed pull
+    doesn't stop the others; its error is in its result.
+
+    If pin is True, each tag is pinned to the digest of the image it now
+    refers to. A tag which is already pinned keeps its pin.
+    """
+    wanted = {}
+    for reference in references:
+        wanted.setdefault(normalise(reference), pinned(reference))
+    results = {}
+    to_pull = {}
+    for reference, source in wanted.items():
+        image = Config.image_index.get(source)
+        if image is None:
+            to_pull[reference] = source
+        else:
+            results[reference] = PullResult(
+                source, False,
+                digest_reference(image, split_reference(source)[0]),
+                0, 0, 0.0, None
+            )
+    layers = {}     # type: Dict[str, str]
+    layers_lock = Lock()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pulls = {
+            reference: pool.submit(
+                pull_one, source, progress, layers, layers_lock
+            )
+            for reference, source in to_pull.items()
+        }
+        for reference, pull in pulls.items():
+            results[reference] = pull.result()
+    if pin:
+        for reference, result in results.items():
+            if result.digest is not None and '@' not in reference:
+                Config.image_pins.setdefault(reference, result.digest)
+    return results
+
+
+@strict
+def save_pins(path: str):
+    """Write Config.image_pins to a JSON file, replacing it atomically."""
+    if dirname(path):
+        os.makedirs(dirname(path), exist_ok=True)
+    with open(path + '.new', 'w') as file:
+        json.dump(Config.image_pins, file, indent=1, sort_keys=True)
+    os.replace(path + '.new', path)
+
+
+@strict
+def load_pins(path: str) -> Dict[str, str]:
+    """Add the pins in a JSON file to Config.image_pins, and return them."""
+    with open(path) as file:
+        pins = {
+            normalise(tag): reference
+            for tag, reference in json.load(file).items()
+        }
+    Config.image_pins.update(pins)
+    return pins
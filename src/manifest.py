@@ -0,0 +1,244 @@
+"""Declarative deployment of many sites from a manifest.
+
+A manifest is a JSON (or, if PyYAML is installed, YAML) document listing
+the sites which should exist:
+
+    sites:
+      - name: blog
+        kind: CopyFoldersToMounts
+        ports: auto
+        webroot: {/srv/blog/webroot: /home/me/blog/public}
+      - name: docs
+        kind: CopyFilesToMountedWebroot_BasicNginxSite
+        files: [/home/me/docs/index.html]
+      - name: plain
+        kind: BasicNginXSite
+        image: nginx:1.15
+
+kind names one of the classes in src.basic_nginx_site (BasicNginXSite by
+default); files are passed as its positional arguments, after the name, and
+every other key as a keyword argument.
+
+Each site's spec is hashed together with the ID of the image it will use
+and the fingerprint (see ArchiveCache.fingerprint) of every local source
+path it names, and the hash is stored in a label on its container. apply()
+reads the labels of every site's container with a single request and only
+deploys the sites whose hash has changed, so applying an unchanged manifest
+costs one request and a walk of the sources' metadata.
+"""
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os.path import exists
+from time import monotonic
+from typing import Dict, List, Optional
+from src import basic_nginx_site
+from src.archive import ArchiveCache
+from src.bulk import DEFAULT_WORKERS, DeployResult, SiteSpec, deploy_many
+from src.config import Config
+from src.images import pinned, prepull
+from src.typecheck import strict
+
+# The container label holding the hash of a site's spec.
+SPEC_LABEL = 'tech.tams.quick_deployments.spec'
+
+# Container states in which a site needs deploying again even if its spec
+# hasn't changed.
+DEFUNCT = ('exited', 'dead', 'removing')
+
+Plan = namedtuple(
+    'Plan', ['create', 'update', 'unchanged', 'remove', 'hashes']
+)
+Plan.__doc__ = """What apply() will do.
+
+create, update, unchanged and remove are lists of site names: the sites
+with no container yet, those whose spec or content has changed (or whose
+container has stopped), those to be left alone, and those with a
+container but no entry in the manifest. hashes maps the name of each site
+in the manifest to its spec hash.
+"""
+
+ApplyResult = namedtuple(
+    'ApplyResult', ['plan', 'deployed', 'removed', 'elapsed']
+)
+ApplyResult.__doc__ = """The outcome of apply().
+
+deployed is the DeployResult of the sites which were (re)deployed, removed
+the names of the sites which were removed, and elapsed the time taken in
+seconds.
+"""
+
+
+@strict
+def load(path: str) -> List[dict]:
+    """Read the site entries from a JSON or YAML manifest.
+
+    Raises ValueError if an entry is malformed, and ImportError for a YAML
+    manifest if PyYAML isn't installed.
+    """
+    with open(path) as file:
+        if path.endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(
+                    "PyYAML is needed to read %s; install it or use JSON."
+                    % path
+                )
+            document = yaml.safe_load(file)
+        else:
+            document = json.load(file)
+    sites = (document or {}).get('sites') or []
+    names = set()
+    for entry in sites:
+        if not isinstance(entry, dict) or 'name' not in entry:
+            raise ValueError("Every site needs a name: %r" % (entry,))
+        if entry['name'] in names:
+            raise ValueError("Site %s is listed twice." % entry['name'])
+        names.add(entry['name'])
+        site_class(entry)
+    return sites
+
+
+def site_class(entry: dict) -> type:
+    """The BasicNginXSite class an entry's kind names."""
+    kind = entry.get('kind', 'BasicNginXSite')
+    found = getattr(basic_nginx_site, kind, None)
+    if not isinstance(found, type) \
+            or not issubclass(found, basic_nginx_site.BasicNginXSite):
+        raise ValueError(
+            "Site %s has an unknown kind: %s" % (entry['name'], kind)
+        )
+    return found
+
+
+def _ports(ports):
+    """Ports from a manifest, with JSON's string keys made numbers again."""
+    if isinstance(ports, dict):
+        return {int(container): host for container, host in ports.items()}
+    return ports
+
+
+@strict
+def site_spec(entry: dict) -> SiteSpec:
+    """The SiteSpec for a manifest entry, without its spec label."""
+    kwargs = {
+        key: value for key, value in entry.items()
+        if key not in ('kind', 'files')
+    }
+    if 'ports' in kwargs:
+        kwargs['ports'] = _ports(kwargs['ports'])
+    files = entry.get('files') or ()
+    if files:
+        # The files follow the name, so the name has to be positional too.
+        return SiteSpec.of(
+            site_class(entry), kwargs.pop('name'), *files, **kwargs
+        )
+    return SiteSpec.of(site_class(entry), **kwargs)
+
+
+def sources_of(entry: dict) -> List[str]:
+    """The local paths whose content an entry deploys."""
+    sources = list(entry.get('files', ()))
+    for key in ('webroot', 'confdir'):
+        sources += [
+            source for source in (entry.get(key) or {}).values()
+            if isinstance(source, str)
+        ]
+    for mount in (entry.get('other_mounts') or {}).values():
+        sources.append(mount['incoming_data'])
+    return sources
+
+
+@strict
+def spec_hash(entry: dict) -> str:
+    """A hash of an entry, its image and the content of its sources."""
+    spec = site_spec(entry)
+    image = pinned(spec.image)
+    found = Config.image_index.get(image)
+    content = {
+        source: ArchiveCache.fingerprint(source) if exists(source) else None
+        for source in sources_of(entry)
+    }
+    return sha256(json.dumps(
+        {'entry': entry, 'image': found.id if found else image,
+         'content': content},
+        sort_keys=True, default=str
+    ).encode()).hexdigest()
+
+
+@strict
+def deployed_hashes() -> Dict[str, Optional[str]]:
+    """The spec hash of each deployed site, by name, in a single request.
+
+    A site whose container has stopped maps to None.
+    """
+    hashes = {}
+    for summary in Config.client.api.containers(
+                all=True, filters={'label': SPEC_LABEL}
+            ):
+        name = summary['Names'][0].lstrip('/')
+        hashes[name] = None if summary['State'] in DEFUNCT \
+            else summary['Labels'][SPEC_LABEL]
+    return hashes
+
+
+@strict
+def plan(sites: list, workers: int=DEFAULT_WORKERS) -> Plan:
+    """Work out what apply() needs to do for a list of manifest entries.
+
+    Entries are hashed on up to workers threads, since hashing walks their
+    sources.
+    """
+    deployed = deployed_hashes()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        wanted = dict(zip(
+            (entry['name'] for entry in sites), pool.map(spec_hash, sites)
+        ))
+    create, update, unchanged = [], [], []
+    for name, digest in wanted.items():
+        if name not in deployed:
+            create.append(name)
+        elif deployed[name] != digest:
+            update.append(name)
+        else:
+            unchanged.append(name)
+    remove = [name for name in deployed if name not in wanted]
+    return Plan(create, update, unchanged, remove, wanted)
+
+
+@strict
+def apply(
+            sites: list, prune: bool=False, workers: int=DEFAULT_WORKERS
+        ) -> ApplyResult:
+    """Bring the deployed sites into line with a list of manifest entries.
+
+    Missing images are pulled first, so that they're part of the hashes.
+    Only the sites which are new or have changed are deployed, with
+    deploy_many(). Sites which aren't in the manifest are only removed if
+    prune is True.
+    """
+    started = monotonic()
+    prepull(
+        [site_spec(entry).image for entry in sites], workers=workers
+    )
+    todo = plan(sites, workers)
+    changed = set(todo.create + todo.update)
+    specs = []
+    for entry in sites:
+        if entry['name'] in changed:
+            spec = site_spec(entry)
+            spec.kwargs['labels'] = dict(
+                spec.kwargs.get('labels') or {},
+                **{SPEC_LABEL: todo.hashes[entry['name']]}
+            )
+            specs.append(spec)
+    deployed = deploy_many(specs, workers) if specs \
+        else DeployResult(sites={}, failures={}, elapsed=0.0)
+    removed = []
+    if prune:
+        for name in todo.remove:
+            basic_nginx_site.BasicNginXSite.check_for_existing_instance(name)
+            removed.append(name)
+    return ApplyResult(todo, deployed, removed, monotonic() - started)
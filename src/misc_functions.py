@@ -4,16 +4,27 @@ All code in this file should be purely functional.
 """
 
 from subprocess import run, PIPE, CompletedProcess
-from os.path import isdir, dirname, realpath
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from mmap import mmap, ACCESS_READ
+from os.path import basename, isdir, dirname, realpath
 from os.path import join as getpath
-from os import access, listdir, removedirs, stat, walk
+from os import access, fstat, listdir, removedirs, scandir, stat
 from os import F_OK as file_exists
 from os import X_OK as executable_file
 from os import makedirs as mkdir
 from os import sep as root
 from shutil import copytree, copy
 from hashlib import sha256
-from strict_hint import strict
+from queue import Queue, Full
+from threading import Event
+from types import GeneratorType
+from src.typecheck import strict
+
+# Files are hashed this many bytes at a time...
+HASH_CHUNK_SIZE = 1024 * 1024
+# ...unless they're at least this big, in which case they're memory mapped.
+HASH_MMAP_THRESHOLD = 64 * 1024 * 1024
 
 
 @strict
@@ -25,11 +36,157 @@ def list_recursively(f: str, *filepath: str) -> list:
     if not isdir(getpath(f, *filepath)):
         # If the specified file isn't a directory, just return that one file.
         return [getpath(f, *filepath)]
-    return [
-        getpath(dp, f) for dp, dn, fn in walk(
-            getpath(f, *filepath)
-        ) for f in fn
-    ]
+    return [entry.path for entry in walk_tree(f, *filepath)]
+
+
+def _matches(relative: str, name: str, patterns: tuple) -> bool:
+    """Whether a path or its name matches any of the glob patterns."""
+    return any(
+        fnmatch(relative, pattern) or fnmatch(name, pattern)
+        for pattern in patterns
+    )
+
+
+def _scan(
+            path: str,
+            start: int,
+            include: tuple,
+            exclude: tuple,
+            directories: bool,
+            recurse: bool=True
+        ) -> GeneratorType:
+    """Yield the entries under path, files first and then each subfolder.
+
+    start is the index into each entry's path where its path relative to the
+    top of the walk begins. Symbolic links are yielded, not followed; as with
+    os.walk, a link to a folder counts as a folder. If recurse is False only
+    path itself is scanned.
+    """
+    subfolders = []
+    with scandir(path) as entries:
+        for entry in entries:
+            relative = entry.path[start:]
+            if exclude and _matches(relative, entry.name, exclude):
+                continue
+            if entry.is_dir():
+                subfolders.append(entry)
+            elif not include or _matches(relative, entry.name, include):
+                yield entry
+    for entry in subfolders:
+        if directories:
+            yield entry
+        if recurse and not entry.is_symlink():
+            yield from _scan(
+                entry.path, start, include, exclude, directories
+            )
+
+
+_DONE = object()
+
+
+def _scan_parallel(
+            subfolders: list,
+            start: int,
+            include: tuple,
+            exclude: tuple,
+            directories: bool,
+            workers: int
+        ) -> GeneratorType:
+    """Yield the entries in several subfolders, each walked on its own thread.
+
+    Entries are passed back through a bounded queue, so a fast walk waits for
+    a slow consumer rather than piling entries up in memory.
+    """
+    found = Queue(maxsize=1024)
+    stop = Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                found.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def walk_one(folder):
+        try:
+            if directories:
+                put(folder)
+            for entry in _scan(
+                        folder.path, start, include, exclude, directories
+                    ):
+                if stop.is_set():
+                    return
+                put(entry)
+        finally:
+            put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        walks = [pool.submit(walk_one, folder) for folder in subfolders]
+        try:
+            remaining = len(walks)
+            while remaining:
+                entry = found.get()
+                if entry is _DONE:
+                    remaining -= 1
+                else:
+                    yield entry
+        finally:
+            stop.set()
+    for walk in walks:
+        # Raise any error which stopped one of the walks.
+        walk.result()
+
+
+@strict
+def walk_tree(
+            f: str,
+            *filepath: str,
+            include: tuple=(),
+            exclude: tuple=(),
+            directories: bool=False,
+            workers: int=0
+        ) -> GeneratorType:
+    """Lazily walk a folder and its subfolders with os.scandir.
+
+    Yields os.DirEntry objects, which carry the file type and, once fetched,
+    the stat data of each entry, so they needn't be looked up again. Only
+    the entries for non-folders are yielded unless directories is True.
+    Symbolic links are yielded but not followed, and a link to a folder
+    counts as a folder, as it does for os.walk. If the path isn't a folder,
+    only its own entry is yielded.
+
+    include and exclude are tuples of glob patterns, matched against both
+    the path of an entry relative to the top of the walk and its name. A
+    folder which matches exclude is not walked at all; a file is only
+    yielded if it doesn't match exclude and, if include is given, matches
+    include.
+
+    If workers is more than one, each subfolder of the top folder is walked
+    on a separate thread, up to that many at once. The order of entries from
+    different subfolders is then not defined.
+    """
+    path = getpath(f, *filepath)
+    if not isdir(path):
+        with scandir(dirname(path) or '.') as entries:
+            for entry in entries:
+                if entry.name == basename(path):
+                    yield entry
+                    return
+        raise FileNotFoundError("No such file or directory: %s" % path)
+    start = len(path.rstrip(root)) + 1
+    if workers <= 1:
+        yield from _scan(path, start, include, exclude, directories)
+        return
+    subfolders = []
+    for entry in _scan(path, start, include, exclude, True, recurse=False):
+        if entry.is_dir(follow_symlinks=False):
+            subfolders.append(entry)
+        elif directories or not entry.is_dir():
+            yield entry
+    yield from _scan_parallel(
+        subfolders, start, include, exclude, directories, workers
+    )
 
 
 @strict
@@ -55,8 +212,35 @@ def perms(f: str, *filepath: str) -> int:
 
 @strict
 def hash_of_file(f: str, *filepath: str) -> str:
-    """Get the sha256 hash of a file read by read_absolute."""
-    return hash_of_str(read_absolute(f, *filepath))
+    """Get the sha256 hash of the contents of a file.
+
+    The file is read as binary, so any kind of file may be hashed, and only
+    HASH_CHUNK_SIZE bytes of it are held in memory at once. Files of
+    HASH_MMAP_THRESHOLD bytes or more are memory mapped and hashed in one go
+    instead. For a text file the hash is the same as hash_of_str() of its
+    contents.
+    """
+    digest = sha256()
+    with open(getpath(f, *filepath), 'rb') as file:
+        if fstat(file.fileno()).st_size >= HASH_MMAP_THRESHOLD:
+            with mmap(file.fileno(), 0, access=ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@strict
+def hash_of_files(paths: list, workers: int=None) -> dict:
+    """Get the sha256 hashes of many files, mapped from their paths.
+
+    The files are hashed on a pool of workers threads (by default the
+    ThreadPoolExecutor default for this machine). Reading and hashing both
+    release the GIL, so this scales with cores and disk bandwidth.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(paths, pool.map(hash_of_file, paths)))
 
 
 @strict
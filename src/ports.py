@@ -0,0 +1,170 @@
+"""Allocation of free host ports, so that many sites can share a host.
+
+Ports are found by trying to bind them, which takes microseconds, rather
+than by scanning. An allocated port is reserved in-process until it's
+released, so concurrent deployments can't be handed the same port between
+allocating it and docker binding it, and it's recorded in a label on the
+site's container, so that other processes (and later runs) know it's taken
+even while the container is stopped.
+"""
+import json
+import socket
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+from src.config import Config
+
+# The container label holding a site's port mapping, as JSON.
+PORTS_LABEL = 'tech.tams.quick_deployments.ports'
+
+
+def host_port(binding: Any) -> Optional[int]:
+    """The fixed host port of a binding, or None if docker chooses it.
+
+    A binding may be a port, a port as a string, an (address, port) tuple or
+    a list of those, as docker's ports argument allows; the first fixed port
+    of a list is used.
+    """
+    if isinstance(binding, list):
+        for each in binding:
+            if host_port(each) is not None:
+                return host_port(each)
+        return None
+    if isinstance(binding, tuple):
+        binding = binding[-1]
+    try:
+        return int(binding)
+    except (TypeError, ValueError):
+        return None
+
+
+def fixed_ports(ports: Dict[Any, Any]) -> Dict[int, int]:
+    """The container -> host mapping of the fixed host ports in ports.
+
+    Container ports may be given as '80/tcp'. Bindings without a fixed host
+    port, such as None, and container ports which aren't numbers are left
+    out.
+    """
+    fixed = {}
+    for container, binding in ports.items():
+        try:
+            container_port = int(str(container).split('/')[0])
+        except ValueError:
+            continue
+        port = host_port(binding)
+        if port is not None:
+            fixed[container_port] = port
+    return fixed
+
+
+def port_labels(ports: Dict[Any, Any]) -> Dict[str, str]:
+    """The container labels recording a container -> host port mapping.
+
+    Only fixed host ports are recorded; see fixed_ports().
+    """
+    return {PORTS_LABEL: json.dumps(
+        {str(container): host
+         for container, host in fixed_ports(ports).items()},
+        sort_keys=True
+    )}
+
+
+def bind_probe(port: int) -> bool:
+    """Whether the port is free on every interface, by trying to bind it."""
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Don't let connections in TIME_WAIT make the port look taken.
+    probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        probe.bind(('', port))
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class PortAllocator():
+    """Hands out free host ports from a range, and remembers who has them.
+
+    Each allocation belongs to an owner (a site's name). Allocating again for
+    the same owner returns the same ports, so a redeployed site keeps its
+    ports. The first allocation reads the port labels of every existing
+    container, so ports held by stopped sites aren't handed out.
+    """
+    def __init__(self, port_range: Tuple[int, int]):
+        """Allocate ports from the inclusive range given."""
+        self.low, self.high = port_range
+        self._lock = Lock()
+        self._next = self.low
+        self._owners = {}   # type: Dict[int, str]
+        self._allocations = {}  # type: Dict[str, Dict[int, int]]
+        self._seeded = False
+
+    def reserve(self, owner: str, ports: Dict[int, int]):
+        """Record that owner holds the host ports of a mapping."""
+        with self._lock:
+            self._release(owner)
+            self._allocations[owner] = dict(ports)
+            for host_port in ports.values():
+                self._owners[host_port] = owner
+
+    def release(self, owner: str):
+        """Free the ports held by owner."""
+        with self._lock:
+            self._release(owner)
+
+    def _release(self, owner: str):
+        """Free the ports held by owner. The lock must be held."""
+        for host_port in self._allocations.pop(owner, {}).values():
+            self._owners.pop(host_port, None)
+
+    def seed(self):
+        """Reserve the ports recorded on existing containers."""
+        for container in Config.client.containers.list(
+                    all=True, filters={'label': PORTS_LABEL}
+                ):
+            try:
+                ports = json.loads(container.labels[PORTS_LABEL])
+            except (KeyError, ValueError):
+                continue
+            if isinstance(ports, dict):
+                # Labels written before only fixed ports were recorded may
+                # hold anything the ports argument could.
+                self.reserve(container.name, fixed_ports(ports))
+        self._seeded = True
+
+    def allocate(self, owner: str, container_ports: tuple) -> Dict[int, int]:
+        """Get a free host port for each of container_ports.
+
+        Returns a mapping of container ports to host ports, suitable for the
+        ports argument of a site. Raises RuntimeError if the range has run
+        out of free ports.
+        """
+        if not self._seeded:
+            self.seed()
+        with self._lock:
+            held = self._allocations.get(owner, {})
+            if set(held) == set(container_ports):
+                return dict(held)
+            self._release(owner)
+            allocation = {}
+            for container_port in container_ports:
+                allocation[container_port] = self._find_free()
+                self._owners[allocation[container_port]] = owner
+            self._allocations[owner] = allocation
+            return dict(allocation)
+
+    def _find_free(self) -> int:
+        """Find an unreserved port which can be bound. The lock must be held.
+
+        The search carries on from where the last one stopped, so recently
+        released ports are the last to be reused.
+        """
+        size = self.high - self.low + 1
+        for _ in range(size):
+            port = self._next
+            self._next = self.low + (port - self.low + 1) % size
+            if port not in self._owners and bind_probe(port):
+                return port
+        raise RuntimeError(
+            "No free ports between %d and %d." % (self.low, self.high)
+        )
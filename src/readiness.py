@@ -0,0 +1,96 @@
+"""Waiting for a site to actually serve requests.
+
+A container being "running" doesn't mean nginx is accepting connections
+yet. wait_until_ready() probes the site, first with a plain TCP connection
+and then with an HTTP request, backing off exponentially (with jitter)
+between attempts, until it answers or a deadline passes.
+"""
+import socket
+from collections import namedtuple
+from random import uniform
+from time import monotonic, sleep
+from typing import Callable, Iterator
+from requests import get, RequestException
+
+Readiness = namedtuple(
+    'Readiness',
+    ['ready_after', 'attempts', 'status_code', 'time_to_first_byte']
+)
+Readiness.__doc__ = """How a site became ready.
+
+ready_after is the number of seconds from the start of the wait until the
+site answered, attempts the number of probes made, status_code the HTTP
+status of the answer and time_to_first_byte the number of seconds that
+answer took to arrive.
+"""
+
+
+def backoff_delays(
+            initial: float, maximum: float, factor: float=2.0
+        ) -> Iterator[float]:
+    """Yield delays which grow exponentially, each with full jitter.
+
+    The nth delay is chosen uniformly between 0 and initial * factor ** n,
+    capped at maximum, so that many waiters don't probe in lockstep.
+    """
+    ceiling = initial
+    while True:
+        yield uniform(0, ceiling)
+        ceiling = min(maximum, ceiling * factor)
+
+
+def probe_tcp(host: str, port: int, timeout: float) -> bool:
+    """Whether a TCP connection can be made to host:port."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def wait_until_ready(
+            host: str='localhost',
+            port: int=80,
+            path: str='/',
+            deadline: float=30.0,
+            initial_delay: float=0.05,
+            max_delay: float=2.0,
+            accept: Callable[[int], bool]=lambda status: status < 500
+        ) -> Readiness:
+    """Block until http://host:port/path answers with an accepted status.
+
+    By default any status below 500 is accepted. Raises TimeoutError if the
+    site isn't ready within deadline seconds.
+    """
+    started = monotonic()
+    url = "http://%s:%d%s" % (host, port, path)
+    delays = backoff_delays(initial_delay, max_delay)
+    attempts = 0
+    while True:
+        attempts += 1
+        remaining = deadline - (monotonic() - started)
+        if probe_tcp(host, port, timeout=max(0.01, min(remaining, 1.0))):
+            try:
+                with get(
+                            url,
+                            timeout=max(0.01, min(remaining, 5.0)),
+                            stream=True
+                        ) as response:
+                    # elapsed runs until the response headers were parsed.
+                    first_byte = response.elapsed.total_seconds()
+                    if accept(response.status_code):
+                        return Readiness(
+                            ready_after=monotonic() - started,
+                            attempts=attempts,
+                            status_code=response.status_code,
+                            time_to_first_byte=first_byte
+                        )
+            except RequestException:
+                pass
+        delay = next(delays)
+        if monotonic() - started + delay > deadline:
+            raise TimeoutError(
+                "%s wasn't ready after %.1fs and %d attempts."
+                % (url, monotonic() - started, attempts)
+            )
+        sleep(delay)
@@ -0,0 +1,233 @@
+"""Container state kept up to date from the docker event stream.
+
+Rather than inspecting a container again whenever its state is wanted, a
+StateTracker subscribes once to the daemon's container events and applies
+each one to the state it holds, so reading a container's state costs
+nothing and waiting for a state change needs no polling.
+"""
+import sys
+from collections import OrderedDict, namedtuple
+from threading import Condition, Thread
+from time import monotonic, sleep
+from typing import Callable, Dict, Optional
+from src.config import Config
+
+ContainerState = namedtuple(
+    'ContainerState', ['status', 'health', 'exit_code']
+)
+ContainerState.__doc__ = """The state of a container.
+
+status is one of docker's container statuses (created, running, paused,
+restarting, exited, dead) or "removed" once the container is gone; health
+is its healthcheck status, or None if it has no healthcheck; exit_code is
+the code it last exited with.
+"""
+
+# The status a container is left in by each event.
+STATUS_AFTER = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'destroy': 'removed',
+}
+
+
+class StateTracker():
+    """Tracks the state of containers by following the docker event stream.
+
+    States are seeded from an inspection (see seed()) and then updated by
+    each event seen for the container. A single thread follows the stream;
+    if the stream breaks it's reopened after retry_delay seconds. Every
+    tracked container is inspected again each time the stream is opened,
+    since events may have been missed while it wasn't.
+
+    A removed container stops being tracked, but its final state is kept
+    among the last removed_history removed containers, for those waiting
+    for it to be removed.
+    """
+    def __init__(self, retry_delay: float=1.0, removed_history: int=256):
+        """Create a tracker. It isn't following events until watch()."""
+        self.retry_delay = retry_delay
+        self.removed_history = removed_history
+        self._states = {}   # type: Dict[str, ContainerState]
+        self._removed = OrderedDict()   # type: OrderedDict
+        self._changed = Condition()
+        self._thread = None
+        self._events = None
+        self._stopped = False
+
+    @staticmethod
+    def from_inspection(inspection: dict) -> ContainerState:
+        """The state described by the output of inspect_container."""
+        state = inspection['State']
+        return ContainerState(
+            status=state['Status'],
+            health=(state.get('Health') or {}).get('Status'),
+            exit_code=state['ExitCode']
+        )
+
+    def seed(self, inspection: dict):
+        """Start tracking a container from its inspect_container output.
+
+        A container which is already tracked keeps the state its events gave
+        it, since that may be newer than the inspection.
+        """
+        with self._changed:
+            if inspection['Id'] not in self._states \
+                    and inspection['Id'] not in self._removed:
+                self._settle(
+                    inspection['Id'], self.from_inspection(inspection)
+                )
+
+    def _settle(self, container_id: str, state: ContainerState):
+        """Record a container's new state. The lock must be held."""
+        if state.status == 'removed':
+            self._states.pop(container_id, None)
+            self._removed[container_id] = state
+            while len(self._removed) > self.removed_history:
+                self._removed.popitem(last=False)
+        else:
+            self._states[container_id] = state
+        self._changed.notify_all()
+
+    def _state_of(self, container_id: str) -> Optional[ContainerState]:
+        """A container's state, even if removed. The lock must be held."""
+        state = self._states.get(container_id)
+        return self._removed.get(container_id) if state is None else state
+
+    def get(self, container_id: str) -> Optional[ContainerState]:
+        """The last known state of a container, or None if it's untracked."""
+        with self._changed:
+            return self._state_of(container_id)
+
+    def forget(self, container_id: str):
+        """Stop tracking a container."""
+        with self._changed:
+            self._states.pop(container_id, None)
+            self._removed.pop(container_id, None)
+
+    def apply(self, event: dict):
+        """Update the state of the container an event is about."""
+        container_id = event.get('id') or event['Actor']['ID']
+        action = event.get('Action') or event.get('status', '')
+        with self._changed:
+            state = self._states.get(container_id)
+            if state is None:
+                return
+            if action.startswith('health_status:'):
+                health = action.split(':', 1)[1].strip()
+                state = state._replace(health=health)
+            elif action in STATUS_AFTER:
+                state = state._replace(status=STATUS_AFTER[action])
+                if action == 'die':
+                    attributes = event.get('Actor', {}).get('Attributes', {})
+                    state = state._replace(
+                        exit_code=int(attributes.get('exitCode', 0))
+                    )
+            else:
+                return
+            self._settle(container_id, state)
+
+    def wait_for(
+                self,
+                container_id: str,
+                predicate: Callable[[ContainerState], bool],
+                timeout: Optional[float]=None
+            ) -> ContainerState:
+        """Block until a container's state satisfies predicate.
+
+        Returns the state which did. Raises TimeoutError if timeout seconds
+        pass first.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._changed:
+            while True:
+                state = self._state_of(container_id)
+                if state is not None and predicate(state):
+                    return state
+                remaining = None if deadline is None \
+                    else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(
+                        "Container %s is still %s." % (container_id, state)
+                    )
+                self._changed.wait(remaining)
+
+    def watch(self):
+        """Start following the event stream, if not already.
+
+        The stream is open by the time this returns, so no event after it is
+        missed. If it can't be opened, opening it is retried on the thread.
+        """
+        with self._changed:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            try:
+                self._events = self._subscribe()
+            except Exception as error:
+                self._report(error)
+                self._events = None
+            self._thread = Thread(
+                target=self._follow_events,
+                name="container-state-events",
+                daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop following the event stream."""
+        self._stopped = True
+        if self._events is not None:
+            self._events.close()
+
+    @staticmethod
+    def _subscribe():
+        """Open the stream of container events."""
+        return Config.client.events(
+            decode=True, filters={'type': 'container'}
+        )
+
+    @staticmethod
+    def _report(error: Exception):
+        """Warn that the event stream failed; it will be reopened."""
+        print(
+            "WARNING: Following container events failed, retrying:",
+            repr(error), file=sys.stderr
+        )
+
+    def _follow_events(self):
+        """Apply events as they arrive, reopening the stream if it breaks."""
+        while not self._stopped:
+            try:
+                if self._events is None:
+                    self._events = self._subscribe()
+                self._refresh()
+                for event in self._events:
+                    self.apply(event)
+            except Exception as error:
+                if self._stopped:
+                    return
+                self._report(error)
+            self._events = None
+            if not self._stopped:
+                sleep(self.retry_delay)
+
+    def _refresh(self):
+        """Inspect every tracked container again."""
+        from docker.errors import NotFound
+        with self._changed:
+            tracked = list(self._states)
+        for container_id in tracked:
+            try:
+                state = self.from_inspection(
+                    Config.client.api.inspect_container(container_id)
+                )
+            except NotFound:
+                state = ContainerState('removed', None, None)
+            with self._changed:
+                if container_id in self._states:
+                    self._settle(container_id, state)
@@ -0,0 +1,180 @@
+"""Incremental copying of files into a site's host folders.
+
+A manifest of what was copied last time (each file's source, size,
+modification time and sha256 hash) is kept next to the site's folders, so
+that a redeploy only copies the files which are new or have changed, and
+removes the files which are no longer wanted.
+"""
+import json
+import os
+from collections import namedtuple
+from hashlib import sha256
+from os.path import dirname, exists, isdir, join, lexists
+from typing import Dict, Iterator, Tuple
+from src.misc_functions import get_parent_dir, hash_of_file, walk_tree
+from src.typecheck import strict
+
+CHUNK_SIZE = 64 * 1024
+
+SyncReport = namedtuple(
+    'SyncReport',
+    ['copied', 'deleted', 'unchanged', 'bytes_copied', 'bytes_saved']
+)
+SyncReport.__doc__ = """The outcome of a sync.
+
+copied and deleted are lists of the paths affected, relative to the
+destination; unchanged is the number of files which were left alone, and
+bytes_saved the total size of those files.
+"""
+
+
+@strict
+def manifest_path(name: str, folder: str) -> str:
+    """The location of the manifest for one of a named instance's folders."""
+    return join(get_parent_dir(name), "%s_manifest.json" % folder)
+
+
+@strict
+def load_manifest(path: str) -> dict:
+    """Read a manifest, or return an empty one if there isn't one yet."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+@strict
+def save_manifest(path: str, manifest: dict):
+    """Replace the manifest at path atomically."""
+    os.makedirs(dirname(path), exist_ok=True)
+    with open(path + '.new', 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(path + '.new', path)
+
+
+def wanted_files(*sources: str) -> Iterator[Tuple[os.DirEntry, str]]:
+    """Yield (source entry, destination-relative path) for the sources.
+
+    A file is placed under its own name; a folder is copied recursively under
+    its own name. Entries are found lazily by walk_tree.
+    """
+    for source in sources:
+        if not isdir(source):
+            for entry in walk_tree(source):
+                yield entry, entry.name
+            continue
+        start = len(dirname(source.rstrip(os.sep))) + 1
+        for entry in walk_tree(source):
+            yield entry, entry.path[start:]
+
+
+def copy_and_hash(source: str, destination: str) -> str:
+    """Copy a file's contents and permissions, returning their sha256 hash.
+
+    The file is only read once, for both the copy and the hash.
+    """
+    digest = sha256()
+    os.makedirs(dirname(destination), exist_ok=True)
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            dst.write(chunk)
+    os.chmod(destination, os.stat(source).st_mode & 0o7777)
+    return digest.hexdigest()
+
+
+def unchanged(
+            source: str, stat: os.stat_result, entry: Dict, copy: str
+        ) -> bool:
+    """Whether a file already copied to copy still matches its source.
+
+    Sizes and modification times are compared first; the file is only hashed
+    if its size is the same but its modification time has changed.
+    """
+    if entry is None or entry['source'] != source:
+        return False
+    try:
+        if os.stat(copy).st_size != stat.st_size:
+            return False
+    except FileNotFoundError:
+        return False
+    if entry['size'] != stat.st_size:
+        return False
+    if entry['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    return hash_of_file(source) == entry['sha256']
+
+
+def remove_copy(destination: str, target: str):
+    """Delete a file copied by an earlier sync, and any folders it empties."""
+    try:
+        os.remove(join(destination, target))
+    except FileNotFoundError:
+        pass
+    folder_path = dirname(join(destination, target))
+    while folder_path != destination.rstrip(os.sep) \
+            and exists(folder_path) and not os.listdir(folder_path):
+        os.rmdir(folder_path)
+        folder_path = dirname(folder_path)
+
+
+def clear_way(destination: str, target: str):
+    """Delete any file standing where one of target's folders needs to be."""
+    folder_path = destination
+    for part in target.split(os.sep)[:-1]:
+        folder_path = join(folder_path, part)
+        if lexists(folder_path) and not isdir(folder_path):
+            os.remove(folder_path)
+
+
+@strict
+def sync_files(manifest: str, destination: str, *sources: str):
+    """Make destination hold exactly the given source files and folders.
+
+    manifest is the path of the manifest file recording the last sync into
+    destination; see manifest_path(). Files which were copied by a previous
+    sync and haven't changed since are left alone, and files which were
+    copied by a previous sync but are no longer among the sources are
+    deleted, before anything is copied, since a file may be replaced by a
+    folder of the same name or the other way around. Other files in
+    destination are never touched, unless they stand where a folder among
+    the sources needs to go.
+
+    Returns a SyncReport.
+    """
+    previous = load_manifest(manifest)
+    wanted = list(wanted_files(*sources))
+    deleted = sorted(set(previous) - {target for _, target in wanted})
+    for target in deleted:
+        remove_copy(destination, target)
+    current = {}
+    copied = []
+    bytes_copied = 0
+    bytes_saved = 0
+    for entry, target in wanted:
+        source = entry.path
+        stat = entry.stat()
+        entry = previous.get(target)
+        if unchanged(source, stat, entry, join(destination, target)):
+            entry['mtime_ns'] = stat.st_mtime_ns
+            current[target] = entry
+            bytes_saved += stat.st_size
+            continue
+        clear_way(destination, target)
+        current[target] = {
+            'source': source,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': copy_and_hash(source, join(destination, target))
+        }
+        copied.append(target)
+        bytes_copied += stat.st_size
+    save_manifest(manifest, current)
+    return SyncReport(
+        copied=copied,
+        deleted=deleted,
+        unchanged=len(current) - len(copied),
+        bytes_copied=bytes_copied,
+        bytes_saved=bytes_saved
+    )
@@ -0,0 +1,192 @@
+"""Timing spans for the phases of a deploy.
+
+A span times one phase of a deploy (resolving the image, fetching the
+network, copying files, creating the container, putting archives...), and
+counts the bytes the phase moved and the docker API round trips made while
+it was open. Spans nest: a phase started while another is open is its
+child, and its round trips count toward both.
+
+Spans are only recorded if Config.telemetry_sink is set. The sink is any
+callable, which is passed each span as it ends, so children arrive before
+their parents. JSONExporter writes them to a file as JSON lines:
+
+    Config.telemetry_sink = JSONExporter('/tmp/deploy_spans.jsonl')
+
+Round trips are counted by a response hook on the docker client, which is
+added the first time a span is opened. The spans open on a thread are held
+in a context variable, so deploys on different threads are timed
+separately; use carry() to count the calls made on a worker thread toward
+the spans open where the work was handed out.
+"""
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import signature
+from itertools import count
+from threading import Lock
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Optional, TextIO, Tuple, Union
+from src.config import Config
+
+# The spans open in the current context, innermost last.
+_open = ContextVar('open_spans', default=())  # type: ContextVar[Tuple]
+_ids = count(1)
+_lock = Lock()
+
+
+class Span():
+    """A timed phase of a deploy."""
+    def __init__(
+                self,
+                name: str,
+                parent: Optional['Span']=None,
+                attributes: Optional[Dict[str, Any]]=None
+            ):
+        """Start timing a phase."""
+        self.name = name
+        self.id = next(_ids)
+        self.parent_id = None if parent is None else parent.id
+        self.attributes = dict(attributes or {})
+        self.started = time()
+        self.duration = None    # type: Optional[float]
+        self.bytes = 0
+        self.api_calls = 0
+        self.error = None       # type: Optional[str]
+        self._began = perf_counter()
+
+    def add_bytes(self, size: int):
+        """Count bytes moved by the phase."""
+        with _lock:
+            self.bytes += size
+
+    def end(self):
+        """Stop timing."""
+        self.duration = perf_counter() - self._began
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The span as a JSON-serialisable dict."""
+        return {
+            'name': self.name,
+            'id': self.id,
+            'parent_id': self.parent_id,
+            'started': self.started,
+            'duration': self.duration,
+            'bytes': self.bytes,
+            'api_calls': self.api_calls,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+def count_round_trip(response, *args, **kwargs):
+    """A requests response hook counting a call toward the open spans."""
+    spans = _open.get()
+    if spans:
+        with _lock:
+            for open_span in spans:
+                open_span.api_calls += 1
+
+
+def instrument(client):
+    """Add the round trip counting hook to a docker client, once."""
+    hooks = getattr(client.api, 'hooks', None)
+    if hooks is not None and count_round_trip not in hooks['response']:
+        hooks['response'].append(count_round_trip)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the code in the with block as a phase called name.
+
+    Yields the Span, so that bytes can be added to it. If no sink is set,
+    the span is timed but not recorded.
+    """
+    sink = Config.telemetry_sink
+    spans = _open.get()
+    current = Span(name, spans[-1] if spans else None, attributes)
+    if sink is None:
+        yield current
+        current.end()
+        return
+    instrument(Config.client)
+    token = _open.set(spans + (current,))
+    try:
+        yield current
+    except BaseException as error:
+        current.error = repr(error)
+        raise
+    finally:
+        _open.reset(token)
+        current.end()
+        sink(current)
+
+
+def traced(name: str) -> Callable:
+    """Decorate a function to run it in a span called name.
+
+    If the function takes a name argument, e.g. a site's constructor, its
+    value is recorded as the span's site attribute.
+    """
+    def decorator(function: Callable) -> Callable:
+        parameters = signature(function).parameters
+
+        @wraps(function)
+        def traced_function(*args, **kwargs):
+            attributes = {}
+            if 'name' in kwargs:
+                attributes['site'] = kwargs['name']
+            elif 'name' in parameters:
+                position = list(parameters).index('name')
+                if position < len(args):
+                    attributes['site'] = args[position]
+            with span(name, **attributes):
+                return function(*args, **kwargs)
+        return traced_function
+    return decorator
+
+
+def carry(function: Callable) -> Callable:
+    """Wrap function to run in the spans open now, on whichever thread."""
+    spans = _open.get()
+
+    @wraps(function)
+    def carried(*args, **kwargs):
+        token = _open.set(spans)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _open.reset(token)
+    return carried
+
+
+def counted(stream, phase: Span):
+    """Pass on the byte strings of stream, adding their sizes to a span."""
+    for chunk in stream:
+        phase.add_bytes(len(chunk))
+        yield chunk
+
+
+class JSONExporter():
+    """A sink writing each span to a file as a line of JSON."""
+    def __init__(self, destination: Union[str, TextIO]):
+        """Append to the file at destination, or write to an open file."""
+        self._lock = Lock()
+        if isinstance(destination, str):
+            self.file = open(destination, 'a')
+            self._owned = True
+        else:
+            self.file = destination
+            self._owned = False
+
+    def __call__(self, finished: Span):
+        """Write a span."""
+        line = json.dumps(finished.as_dict(), sort_keys=True, default=str)
+        with self._lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        """Close the file, if it was opened here."""
+        if self._owned:
+            self.file.close()
@@ -0,0 +1,149 @@
+"""Runtime checks of arguments and return values against type hints.
+
+strict is a drop-in replacement for strict_hint's decorator of the same
+name, raising the same errors, with two differences:
+
+ - The signature of a function is introspected once, when it's decorated,
+   and turned into a tuple of types to check each parameter against, so a
+   call costs a few isinstance() checks and nothing more.
+ - typing constructs are understood: Union and Optional accept any of their
+   members, generic aliases such as List[str] or Iterator[bytes] check
+   against their origin (list, collections.abc.Iterator), and Any, type
+   variables and forward references aren't checked.
+
+As with strict_hint, a value equal to a parameter's default is always
+accepted, and so is a return value of None, whatever the return hint.
+
+If the environment variable QUICK_DEPLOYMENTS_NO_TYPECHECK is set to a
+non-empty value when a module is imported, its functions are left
+undecorated, so the checks cost nothing at all in production.
+"""
+import os
+import typing
+from functools import wraps
+from inspect import Parameter, signature
+from typing import Any, Callable, Dict, Optional, Tuple
+from strict_hint.strict_hint import (
+    ArgumentTypeHintError, ReturnValueTypeHintError
+)
+
+ENVIRONMENT_SETTING = 'QUICK_DEPLOYMENTS_NO_TYPECHECK'
+
+# Used for annotations which can't be checked.
+_UNCHECKED = None
+
+
+def enabled() -> bool:
+    """Whether checks are added by strict, according to the environment."""
+    return not os.environ.get(ENVIRONMENT_SETTING)
+
+
+def types_for(hint) -> Optional[Tuple[type, ...]]:
+    """The types a hint allows, for isinstance(), or None for any type."""
+    if hint is Parameter.empty or hint is Any \
+            or isinstance(hint, (str, typing.TypeVar, typing.ForwardRef)):
+        return _UNCHECKED
+    if hint is None or hint is type(None):
+        return (type(None),)
+    if isinstance(hint, list):
+        # strict_hint treats [str] as meaning a list.
+        return (list,)
+    if hasattr(hint, '__supertype__'):
+        # A NewType.
+        return types_for(hint.__supertype__)
+    origin = typing.get_origin(hint)
+    if origin is typing.Union:
+        allowed = ()
+        for member in typing.get_args(hint):
+            member_types = types_for(member)
+            if member_types is _UNCHECKED:
+                return _UNCHECKED
+            allowed += member_types
+        return allowed
+    if origin is not None:
+        return types_for(origin)
+    if isinstance(hint, type):
+        return (hint,)
+    return _UNCHECKED
+
+
+def _name_of(function: Callable) -> str:
+    """The name strict_hint gives a function in its errors."""
+    return function.__qualname__.split('.<locals>.', 1)[-1]
+
+
+def strict(function: Callable) -> Callable:
+    """Check the arguments and return value of function against its hints.
+
+    Raises strict_hint's ArgumentTypeHintError or ReturnValueTypeHintError,
+    both TypeErrors, on a mismatch.
+    """
+    if not enabled():
+        return function
+    sig = signature(function)
+    name = _name_of(function)
+    # (name, types, default) of each positional parameter, in order.
+    positional = []
+    # The same, for every parameter which can be passed by keyword.
+    by_keyword = {}     # type: Dict[str, Tuple[str, tuple, Any]]
+    var_positional = var_keyword = None
+    for parameter in sig.parameters.values():
+        check = (
+            parameter.name,
+            types_for(parameter.annotation),
+            parameter.default
+        )
+        if parameter.kind is Parameter.VAR_POSITIONAL:
+            var_positional = check
+        elif parameter.kind is Parameter.VAR_KEYWORD:
+            var_keyword = check
+        else:
+            if parameter.kind is not Parameter.KEYWORD_ONLY:
+                positional.append(check)
+            if parameter.kind is not Parameter.POSITIONAL_ONLY:
+                by_keyword[parameter.name] = check
+    positional = tuple(positional)
+    returns = types_for(sig.return_annotation)
+    annotated = any(
+        check[1] is not _UNCHECKED for check in by_keyword.values()
+    ) or any(
+        check is not None and check[1] is not _UNCHECKED
+        for check in (var_positional, var_keyword)
+    ) or any(check[1] is not _UNCHECKED for check in positional)
+
+    def mismatch(check, value):
+        parameter, allowed, default = check
+        if value is default or value == default:
+            return
+        raise ArgumentTypeHintError(
+            parameter,
+            name,
+            sig.parameters[parameter].annotation,
+            type(value)
+        )
+
+    @wraps(function)
+    def checked(*args, **kwargs):
+        if annotated:
+            for check, value in zip(positional, args):
+                if check[1] is not _UNCHECKED \
+                        and not isinstance(value, check[1]):
+                    mismatch(check, value)
+            if var_positional is not None \
+                    and var_positional[1] is not _UNCHECKED:
+                for value in args[len(positional):]:
+                    if not isinstance(value, var_positional[1]):
+                        mismatch(var_positional, value)
+            for keyword, value in kwargs.items():
+                check = by_keyword.get(keyword, var_keyword)
+                if check is not None and check[1] is not _UNCHECKED \
+                        and not isinstance(value, check[1]):
+                    mismatch(check, value)
+        result = function(*args, **kwargs)
+        if returns is not _UNCHECKED and result is not None \
+                and not isinstance(result, returns):
+            raise ReturnValueTypeHintError(
+                name, sig.return_annotation, type(result)
+            )
+        return result
+    return checked
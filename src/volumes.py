@@ -0,0 +1,182 @@
+"""Named docker volumes holding the content of source folders.
+
+Each distinct tree of content is copied into a volume of its own once, named
+after the sha256 digest of the content (see tree_digest), and any number of
+containers mount that volume read-only. Deploying another container with
+the same content costs nothing beyond the mount, unlike put_archive, which
+copies the content into every container.
+
+A volume is filled through a helper container which mounts it and is never
+started: the archive of the source is put into the helper, which is then
+removed. Which volumes have been filled completely is recorded in an index
+in a local folder once each fill has finished, so a volume which exists but
+isn't in the index is never used. Fills are serialised between processes
+with a lock file per volume; the lock is dropped if its holder dies, and
+whoever takes it next empties the volume and fills it again.
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from os.path import join
+from threading import Lock
+from typing import Dict, List, Tuple
+from docker.errors import NotFound
+from docker.types import Mount
+from src.archive import ArchiveCache
+from src.config import Config
+from src.typecheck import strict
+from src.webroot_store import tree_digest
+
+# The label on every content volume, holding the digest of its content.
+CONTENT_LABEL = 'tech.tams.quick_deployments.content'
+
+# Where the helper container mounts the volume it fills.
+FILL_PATH = '/content'
+
+
+class ContentVolumes():
+    """Creates, fills and finds the volumes holding each tree of content.
+
+    directory holds the index of filled volumes and the lock files; it's
+    created when first written.
+    """
+    def __init__(self, directory: str):
+        """Keep the record of filled volumes in directory."""
+        self.directory = directory
+        self.index_path = join(directory, 'index.json')
+        self._lock = Lock()
+        self._name_locks = {}   # type: Dict[str, Lock]
+        self._digests = {}      # type: Dict[str, Tuple[str, str]]
+
+    def _lock_for(self, name: str) -> Lock:
+        """Get the lock which serialises filling of the named volume."""
+        with self._lock:
+            return self._name_locks.setdefault(name, Lock())
+
+    @contextmanager
+    def _filling(self, name: str):
+        """Hold the named volume's locks, within and between processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock_for(name), \
+                open(join(self.directory, name + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def filled(self) -> Dict[str, str]:
+        """The digests of the volumes which were filled, by volume name."""
+        try:
+            with open(self.index_path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def _record(self, changes: Dict[str, str], removed: tuple=()):
+        """Add volumes to the index and take others out of it."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self.filled()
+            index.update(changes)
+            for name in removed:
+                index.pop(name, None)
+            with open(self.index_path + '.new', 'w') as file:
+                json.dump(index, file, indent=1, sort_keys=True)
+            os.replace(self.index_path + '.new', self.index_path)
+
+    def digest(self, source: str) -> str:
+        """The digest of source, worked out again only if it has changed."""
+        fingerprint = ArchiveCache.fingerprint(source)
+        known = self._digests.get(source)
+        if known is not None and known[0] == fingerprint:
+            return known[1]
+        digest = tree_digest(source)
+        self._digests[source] = (fingerprint, digest)
+        return digest
+
+    @staticmethod
+    def name_for(digest: str) -> str:
+        """The name of the volume holding the content with a digest."""
+        return 'quick_deployments_%s' % digest[:32]
+
+    @staticmethod
+    def _exists(name: str) -> bool:
+        """Whether the daemon has the named volume."""
+        try:
+            Config.client.volumes.get(name)
+            return True
+        except NotFound:
+            return False
+
+    def _ready(self, name: str) -> bool:
+        """Whether the named volume was filled and still exists."""
+        return name in self.filled() and self._exists(name)
+
+    @strict
+    def acquire(self, source: str, image: str) -> str:
+        """Get the name of a volume holding the content of source.
+
+        The volume is created and filled, through a helper container using
+        image, unless a volume with identical content already exists.
+        """
+        digest = self.digest(source)
+        name = self.name_for(digest)
+        if self._ready(name):
+            return name
+        with self._filling(name):
+            if not self._ready(name):
+                self._fill(name, digest, source, image)
+                self._record({name: digest})
+        return name
+
+    @staticmethod
+    def _fill(name: str, digest: str, source: str, image: str):
+        """Fill the named volume from nothing. The locks must be held."""
+        # Anything left by a fill which didn't finish is thrown away.
+        try:
+            Config.client.containers.get(name + '_fill').remove(force=True)
+        except NotFound:
+            pass
+        try:
+            Config.client.volumes.get(name).remove(force=True)
+        except NotFound:
+            pass
+        volume = Config.client.volumes.create(
+            name=name, labels={CONTENT_LABEL: digest}
+        )
+        helper = Config.client.containers.create(
+            image=image,
+            name=name + '_fill',
+            labels={CONTENT_LABEL: digest},
+            mounts=[Mount(target=FILL_PATH, source=volume.name,
+                          type='volume')]
+        )
+        try:
+            helper.put_archive(
+                path=FILL_PATH, data=Config.archive_cache.stream(source)
+            )
+        finally:
+            helper.remove(force=True)
+
+    @staticmethod
+    @strict
+    def mount(volume: str, destination: str) -> Mount:
+        """A read-only mount of a content volume at destination."""
+        # no_copy stops the daemon copying what the image has at
+        # destination into a volume which happens to be empty.
+        return Mount(
+            target=destination,
+            source=volume,
+            type='volume',
+            read_only=True,
+            no_copy=True
+        )
+
+    @strict
+    def prune(self) -> List[str]:
+        """Remove unused content volumes, returning their names."""
+        removed = Config.client.volumes.prune(
+            filters={'label': CONTENT_LABEL}
+        ).get('VolumesDeleted') or []
+        self._record({}, removed=tuple(removed))
+        return removed
@@ -0,0 +1,207 @@
+"""A content-addressed store of webroot trees shared between sites.
+
+Each distinct tree is kept once, in a folder named after the sha256 digest
+of its content, and any number of sites mount that folder read-only in
+place of a copy of their own. The store records which sites use each tree,
+so trees which no site uses any more can be collected. Each site's container
+carries WEBROOT_LABEL, so a site whose container has gone without releasing
+its tree (one which was auto-removed, say, or whose process died) is noticed
+when trees are collected.
+
+A tree's digest covers the relative path, type, permissions and content of
+everything in it, so identical trees from different places share a folder.
+Working it out means hashing every file, so the digest of each source is
+remembered along with its metadata fingerprint (see ArchiveCache) and only
+worked out again once the source has changed.
+
+The store's index is a JSON file in its folder, read and written under an
+exclusive file lock, so several processes may share a store.
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from hashlib import sha256
+from os.path import exists, join
+from shutil import copytree, rmtree
+from time import time
+from typing import Dict, List
+from src.archive import ArchiveCache, tree_members
+from src.config import Config
+from src.misc_functions import hash_of_files
+from src.typecheck import strict
+
+# The label on the container of every site using the store, holding the
+# digest of its tree.
+WEBROOT_LABEL = 'tech.tams.quick_deployments.webroot'
+
+# Seconds for which a site which has acquired a tree, but whose container
+# can't be found, is taken to be still creating it.
+PENDING = 600.0
+
+
+@strict
+def tree_digest(source: str) -> str:
+    """The sha256 digest of the content of a tree."""
+    members = sorted(tree_members(source), key=lambda member: member[1])
+    hashes = hash_of_files([
+        entry.path for entry, _ in members
+        if entry.is_file(follow_symlinks=False)
+    ])
+    digest = sha256()
+    for entry, arcname in members:
+        if entry.is_symlink():
+            kind, content = 'link', os.readlink(entry.path)
+        elif entry.is_dir(follow_symlinks=False):
+            kind, content = 'dir', ''
+        else:
+            kind, content = 'file', hashes[entry.path]
+        mode = entry.stat(follow_symlinks=False).st_mode & 0o7777
+        digest.update(("%s\0%s\0%o\0%s\n" % (
+            arcname, kind, mode, content
+        )).encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+class WebrootStore():
+    """A folder of shared webroot trees, with a record of their users."""
+    def __init__(self, directory: str):
+        """Use the store in directory; it's created when first written."""
+        self.directory = directory
+        self.index_path = join(directory, 'index.json')
+
+    def path_for(self, digest: str) -> str:
+        """Where the tree with a digest is kept."""
+        return join(self.directory, 'trees', digest)
+
+    @contextmanager
+    def _index(self):
+        """Lock the store, yielding its index to be read and changed.
+
+        The index is written back when the block finishes without error.
+        """
+        os.makedirs(join(self.directory, 'trees'), exist_ok=True)
+        with open(join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.index_path) as file:
+                    index = json.load(file)
+            except FileNotFoundError:
+                index = {'trees': {}, 'sources': {}}
+            index.setdefault('acquired', {})
+            yield index
+            with open(self.index_path + '.new', 'w') as file:
+                json.dump(index, file, indent=1, sort_keys=True)
+            os.replace(self.index_path + '.new', self.index_path)
+
+    def _digest(self, index: dict, source: str) -> str:
+        """The digest of source, worked out again only if it has changed."""
+        fingerprint = ArchiveCache.fingerprint(source)
+        known = index['sources'].get(source)
+        if known is not None and known[0] == fingerprint:
+            return known[1]
+        digest = tree_digest(source)
+        index['sources'][source] = [fingerprint, digest]
+        return digest
+
+    def _add(self, index: dict, source: str) -> str:
+        """Put a copy of source in the store unless it's already there."""
+        digest = self._digest(index, source)
+        path = self.path_for(digest)
+        if not exists(path):
+            partial = path + '.partial'
+            if exists(partial):
+                rmtree(partial)
+            copytree(source, partial, symlinks=True)
+            os.replace(partial, path)
+        index['trees'].setdefault(digest, [])
+        return digest
+
+    @strict
+    def acquire(self, owner: str, source: str) -> str:
+        """Get the path of the stored copy of source, for owner to use.
+
+        The tree is copied into the store if no identical tree is there
+        yet. Whatever tree owner used before is released.
+        """
+        with self._index() as index:
+            digest = self._add(index, source)
+            self._release(index, owner)
+            index['trees'][digest].append(owner)
+            index['acquired'][owner] = time()
+        return self.path_for(digest)
+
+    @strict
+    def release(self, owner: str):
+        """Record that owner no longer uses any tree."""
+        if not exists(self.index_path):
+            # Nothing has been stored, so there's no need to create the store.
+            return
+        with self._index() as index:
+            self._release(index, owner)
+
+    @strict
+    def transfer(self, owner: str, new_owner: str):
+        """Hand owner's tree to new_owner, whose own tree is released.
+
+        This is for a site's replacement container taking over its name.
+        """
+        if not exists(self.index_path):
+            return
+        with self._index() as index:
+            self._release(index, new_owner)
+            for owners in index['trees'].values():
+                owners[:] = [
+                    new_owner if each == owner else each for each in owners
+                ]
+            if owner in index['acquired']:
+                index['acquired'][new_owner] = index['acquired'].pop(owner)
+
+    @staticmethod
+    def _release(index: dict, owner: str):
+        """Remove owner from the users of every tree."""
+        for owners in index['trees'].values():
+            if owner in owners:
+                owners.remove(owner)
+        index['acquired'].pop(owner, None)
+
+    def references(self) -> Dict[str, int]:
+        """The number of users of each tree, by digest."""
+        with self._index() as index:
+            return {
+                digest: len(owners)
+                for digest, owners in index['trees'].items()
+            }
+
+    @strict
+    def collect(self, pending: float=PENDING) -> List[str]:
+        """Delete the trees which no site uses, returning their digests.
+
+        Sites whose containers no longer exist are released first, unless
+        they acquired their tree less than pending seconds ago, since their
+        containers may not have been created yet.
+        """
+        existing = {
+            container.name for container in Config.client.containers.list(
+                all=True, filters={'label': WEBROOT_LABEL}
+            )
+        }
+        cutoff = time() - pending
+        with self._index() as index:
+            for owners in index['trees'].values():
+                for owner in list(owners):
+                    if owner not in existing \
+                            and index['acquired'].get(owner, 0) < cutoff:
+                        self._release(index, owner)
+            unused = sorted(
+                digest for digest, owners in index['trees'].items()
+                if not owners
+            )
+            for digest in unused:
+                rmtree(self.path_for(digest), ignore_errors=True)
+                del index['trees'][digest]
+            index['sources'] = {
+                source: known for source, known in index['sources'].items()
+                if known[1] in index['trees']
+            }
+        return unused
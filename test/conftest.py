@@ -0,0 +1,55 @@
+"""Fixtures shared by every test."""
+from pytest import fixture
+from src.config import Config, ImageIndex, LazyAttribute, NetworkRegistry
+
+
+def pytest_configure(config):
+    """Register the marker for tests which need a real daemon."""
+    config.addinivalue_line(
+        'markers', 'docker: the test needs a real docker daemon'
+    )
+
+
+@fixture(autouse=True)
+def fake_docker(request, tmp_path):
+    """Point the configuration at a fresh FakeDockerClient for each test.
+
+    Every attribute of Config is put back as it was once the test is over,
+    including any a test added, so nothing a test assigns or lazily creates
+    leaks into the next one. The lazily created attributes start afresh, with
+    their folders in a scratch folder of the test's own. Tests marked docker
+    keep the real client. Returns the client, or None for those tests.
+    """
+    saved = dict(vars(Config))
+    for key, value in saved.items():
+        if isinstance(value, LazyAttribute):
+            setattr(Config, key, LazyAttribute(value.factory))
+    Config.archive_cache_dir = str(tmp_path / 'archives')
+    Config.webroot_store_dir = str(tmp_path / 'store')
+    Config.content_volumes_dir = str(tmp_path / 'volumes')
+    Config.image_index = ImageIndex()
+    Config.image_pins = {}
+    Config.networks = NetworkRegistry()
+    client = None
+    if request.node.get_closest_marker('docker') is None:
+        from src.fake_docker import FakeDockerClient
+        client = Config.client = FakeDockerClient(images=['nginx:latest'])
+    yield client
+    _stop_followers()
+    for key in set(vars(Config)) - set(saved):
+        delattr(Config, key)
+    for key, value in saved.items():
+        if vars(Config)[key] is not value:
+            setattr(Config, key, value)
+
+
+def _stop_followers():
+    """Stop the event streams followed by the test's index and tracker."""
+    from src.state import StateTracker
+    for value in list(vars(Config).values()):
+        if isinstance(value, LazyAttribute):
+            if not value._created:
+                continue
+            value = value._value
+        if isinstance(value, (ImageIndex, StateTracker)):
+            value.stop()
@@ -0,0 +1,239 @@
+"""Tests for the streaming tar archives in archive.py."""
+import os
+import tarfile
+from io import BytesIO
+from os.path import dirname, join, realpath
+from shutil import copy2, copytree
+from tempfile import TemporaryDirectory
+from src import archive
+from src.misc_functions import read_absolute
+
+thisdir = dirname(realpath(__file__))
+
+
+def read_stream(stream) -> tarfile.TarFile:
+    """Collect a stream of chunks and open it as a tarfile."""
+    return tarfile.open(fileobj=BytesIO(b''.join(stream)))
+
+
+class Test_TarStream:
+    """Tests for the tar_stream generator."""
+    def test_folder(self):
+        """Member names should be relative to the folder being archived."""
+        with read_stream(archive.tar_stream(
+                    join(thisdir, "test_document_folder")
+                )) as tf:
+            assert sorted(tf.getnames()) == [
+                "test_folder2",
+                "test_folder2/test_string2.txt",
+                "test_string.txt"
+            ]
+            assert tf.extractfile("test_string.txt").read().decode() \
+                == read_absolute(
+                    thisdir, "test_document_folder", "test_string.txt"
+                )
+
+    def test_single_file(self):
+        """A single file should be archived under its own name."""
+        with read_stream(archive.tar_stream(join(
+                    thisdir, "test_document_folder", "test_string.txt"
+                ))) as tf:
+            assert tf.getnames() == ["test_string.txt"]
+
+    def test_chunks_are_bounded(self):
+        """No chunk should be larger than the chunk size or a trailer."""
+        for chunk in archive.tar_stream(
+                    join(thisdir, "test_document_folder"), chunk_size=16
+                ):
+            assert len(chunk) <= max(16, tarfile.RECORDSIZE)
+
+    def test_whole_records(self):
+        """The archive should be padded out to a whole number of records."""
+        data = b''.join(archive.tar_stream(
+            join(thisdir, "test_document_folder")
+        ))
+        assert len(data) % tarfile.RECORDSIZE == 0
+
+    def test_archive_passthrough(self):
+        """An existing archive should be streamed as it is."""
+        path = join(thisdir, "test_archive.tar")
+        with open(path, 'rb') as original:
+            assert b''.join(archive.tar_stream(path)) == original.read()
+
+
+class Test_RestreamTar:
+    """Tests for copying the members of one archive into another."""
+    @property
+    def source(self) -> tarfile.TarFile:
+        """A streamed archive of the test document folder."""
+        return read_stream(archive.tar_stream(
+            join(thisdir, "test_document_folder")
+        ))
+
+    def test_same_members(self):
+        """Without a rename or filter every member should be copied."""
+        with self.source as original:
+            names = original.getnames()
+        with self.source as original, \
+                read_stream(archive.restream_tar(original)) as tf:
+            assert tf.getnames() == names
+            assert tf.extractfile("test_string.txt").read().decode() \
+                == read_absolute(
+                    thisdir, "test_document_folder", "test_string.txt"
+                )
+
+    def test_from_stream(self):
+        """A tarfile opened as a stream should be copied just the same."""
+        with open(join(thisdir, "test_archive.tar"), 'rb') as data:
+            with tarfile.open(fileobj=data, mode='r|*') as original:
+                restreamed = b''.join(archive.restream_tar(original))
+        with tarfile.open(join(thisdir, "test_archive.tar")) as original, \
+                tarfile.open(fileobj=BytesIO(restreamed)) as tf:
+            assert tf.getnames() == original.getnames()
+
+    def test_rename(self):
+        """Members outside the stripped prefix should be left out."""
+        with self.source as original, read_stream(archive.restream_tar(
+                    original, rename=archive.strip_prefix("test_folder2")
+                )) as tf:
+            assert tf.getnames() == ["test_string2.txt"]
+
+    def test_rename_pax(self):
+        """Names kept in PAX headers should be renamed too."""
+        names = ["x" * 120 + ".txt", "caf\u00e9.txt"]
+        data = BytesIO()
+        with tarfile.open(
+                    fileobj=data, mode='w', format=tarfile.PAX_FORMAT
+                ) as original:
+            for name in names:
+                original.addfile(tarfile.TarInfo("top/" + name))
+            link = tarfile.TarInfo("top/link")
+            link.type, link.linkname = tarfile.LNKTYPE, "top/" + names[0]
+            original.addfile(link)
+        data.seek(0)
+        with tarfile.open(fileobj=data) as original, \
+                read_stream(archive.restream_tar(
+                    original, rename=archive.strip_prefix("top")
+                )) as tf:
+            assert tf.getnames() == names + ["link"]
+            assert tf.getmember("link").linkname == names[0]
+
+    def test_sparse_pax(self):
+        """Sparse members in PAX archives should become whole files."""
+        # A GNU sparse 1.0 member: the map of its data (5 bytes at offset
+        # 9995) takes a block of its own ahead of the data.
+        sparse_map = b"1\n9995\n5\n".ljust(tarfile.BLOCKSIZE, b"\0")
+        info = tarfile.TarInfo("top/GNUSparseFile.0/sparse")
+        info.size = len(sparse_map) + 5
+        info.pax_headers = {
+            'GNU.sparse.major': '1',
+            'GNU.sparse.minor': '0',
+            'GNU.sparse.name': 'top/sparse',
+            'GNU.sparse.realsize': '10000',
+        }
+        data = BytesIO()
+        with tarfile.open(
+                    fileobj=data, mode='w', format=tarfile.PAX_FORMAT
+                ) as original:
+            original.addfile(info, BytesIO(sparse_map + b"hello"))
+        for rename in (None, archive.strip_prefix("top")):
+            data.seek(0)
+            with tarfile.open(fileobj=data) as original, \
+                    read_stream(archive.restream_tar(
+                        original, rename=rename
+                    )) as tf:
+                member, = tf.getmembers()
+                assert member.isreg() and member.sparse is None
+                assert member.size == 10000
+                assert tf.extractfile(member).read() == \
+                    b"\0" * 9995 + b"hello"
+
+    def test_include(self):
+        """Members which the include function rejects should be left out."""
+        with self.source as original, read_stream(archive.restream_tar(
+                    original, include=lambda info: not info.isdir()
+                )) as tf:
+            assert sorted(tf.getnames()) == [
+                "test_folder2/test_string2.txt", "test_string.txt"
+            ]
+
+
+class Test_ArchiveCache:
+    """Tests for the content-addressed archive cache."""
+    def setup_method(self):
+        """Create a cache and a source tree it can archive."""
+        self.tmp = TemporaryDirectory()
+        self.source = join(self.tmp.name, "source")
+        copytree(join(thisdir, "test_document_folder"), self.source)
+        self.cache = archive.ArchiveCache(
+            join(self.tmp.name, "cache"), 2 ** 20
+        )
+
+    def teardown_method(self):
+        """Remove the cache and source tree."""
+        self.tmp.cleanup()
+
+    def test_hit_after_miss(self):
+        """A second stream of an unchanged tree should be a cache hit."""
+        first = b''.join(self.cache.stream(self.source))
+        second = b''.join(self.cache.stream(self.source))
+        assert first == second
+        assert self.cache.stats['hits'] == 1
+        assert self.cache.stats['misses'] == 1
+        assert self.cache.stats['entries'] == 1
+
+    def test_change_misses(self):
+        """Changing a file in the tree should change its fingerprint."""
+        before = self.cache.fingerprint(self.source)
+        with open(join(self.source, "test_string.txt"), 'a') as f:
+            f.write("one more line\n")
+        assert self.cache.fingerprint(self.source) != before
+        b''.join(self.cache.stream(self.source))
+        b''.join(self.cache.stream(self.source))
+        assert self.cache.stats['misses'] == 1
+
+    def test_same_size_and_mtime(self):
+        """Rewrites keeping the size and mtime should still be noticed."""
+        path = join(self.source, "test_string.txt")
+        stat = os.stat(path)
+        before = self.cache.fingerprint(self.source)
+        with open(path, 'r+') as f:
+            f.write("X")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        rewritten = self.cache.fingerprint(self.source)
+        assert rewritten != before
+        # A copy restored with its metadata, as by cp -p.
+        copy2(path, path + ".new")
+        os.replace(path + ".new", path)
+        assert self.cache.fingerprint(self.source) != rewritten
+
+    def test_abandoned_stream(self):
+        """A stream which isn't read to the end shouldn't be stored."""
+        stream = self.cache.stream(self.source)
+        next(stream)
+        stream.close()
+        assert self.cache.stats['entries'] == 0
+
+    def test_eviction(self):
+        """The least recently used archive should go when over the limit."""
+        self.cache.max_bytes = tarfile.RECORDSIZE
+        first = self.cache.fingerprint(self.source)
+        b''.join(self.cache.stream(self.source))
+        with open(join(self.source, "new.txt"), 'w') as f:
+            f.write("new\n")
+        b''.join(self.cache.stream(self.source))
+        assert first not in self.cache.entries
+        assert self.cache.size <= tarfile.RECORDSIZE
+
+    def test_too_large(self):
+        """A tree too large for the cache should be streamed, not stored."""
+        self.cache.max_bytes = tarfile.BLOCKSIZE
+        streamed = b''.join(self.cache.stream(self.source))
+        assert streamed == b''.join(archive.tar_stream(self.source))
+        assert self.cache.stats['entries'] == 0
+        assert self.cache.stats['misses'] == 1
+
+    def test_survey(self):
+        """The surveyed size should be that of the archive."""
+        _, size = self.cache.survey(self.source)
+        assert size == len(b''.join(archive.tar_stream(self.source)))
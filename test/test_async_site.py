@@ -0,0 +1,175 @@
+"""Tests for the asyncio site lifecycle in async_site.py.
+
+A small HTTP server on a unix socket plays the part of the docker daemon.
+"""
+import asyncio
+import json
+import tarfile
+from io import BytesIO
+from os.path import dirname, join, realpath
+from tempfile import TemporaryDirectory
+from pytest import raises
+from src.archive import tar_stream
+from src.async_site import AsyncAPIError, AsyncBasicNginXSite
+from src.async_site import AsyncDockerClient
+
+thisdir = dirname(realpath(__file__))
+
+
+class StandInDaemon():
+    """Answers the requests made while creating and running a site."""
+    def __init__(self):
+        self.requests = []
+        self.archives = {}
+        self.pulls = []
+
+    async def handle(self, reader, writer):
+        """Read one request and write the response."""
+        method, target, _ = (await reader.readline()).decode().split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers[key.lower()] = value.strip()
+        body = b''
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int(await reader.readline(), 16)
+                if not size:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        path = target.split('?')[0]
+        self.requests.append((method, path))
+        status, response = self.respond(method, path, target, body)
+        payload = response if isinstance(response, bytes) \
+            else json.dumps(response).encode()
+        # Responses are chunked, as the daemon's usually are.
+        writer.write(
+            b"HTTP/1.1 %d OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"%x\r\n%s\r\n0\r\n\r\n" % (status, len(payload), payload)
+        )
+        await writer.drain()
+        writer.close()
+
+    def respond(self, method, path, target, body):
+        """Choose the status and JSON response for a request."""
+        if path == '/v1.37/containers/json':
+            return 200, [{'Id': 'old'}]
+        if path == '/v1.37/containers/create':
+            assert 'name=test_site' in target
+            config = json.loads(body.decode())
+            assert config['Image'] == 'nginx:latest'
+            assert config['HostConfig']['PortBindings'] == {
+                '80/tcp': [{'HostIp': '', 'HostPort': '8080'}]
+            }
+            return 201, {'Id': 'new'}
+        if path == '/v1.37/containers/new/json':
+            return 200, {'Id': 'new', 'State': {'Status': 'created'}}
+        if path == '/v1.37/containers/new/archive':
+            self.archives[target] = body
+            return 200, None
+        if path == '/v1.37/images/httpd%3A2/json':
+            return 404, {'message': 'No such image: httpd:2'}
+        if path == '/v1.37/images/nginx%40sha256%3Aab/json':
+            return 404, {'message': 'No such image: nginx@sha256:ab'}
+        if path == '/v1.37/images/create' and 'sha256' in target:
+            self.pulls.append(target.split('?')[1])
+            return 200, b'{"status": "Downloaded"}\r\n'
+        if path == '/v1.37/images/create':
+            return 200, b'{"status": "Pulling"}\r\n{"error": "denied", ' \
+                b'"errorDetail": {"message": "denied"}}\r\n'
+        if path == '/v1.37/containers/missing/start':
+            return 404, {'message': 'No such container: missing'}
+        return 200, {}
+
+
+def run(coroutine_function):
+    """Run a coroutine function with a stand-in daemon listening."""
+    daemon = StandInDaemon()
+
+    async def main():
+        with TemporaryDirectory() as tmp:
+            socket_path = join(tmp, 'docker.sock')
+            server = await asyncio.start_unix_server(
+                daemon.handle, path=socket_path
+            )
+            try:
+                await coroutine_function(AsyncDockerClient(socket_path))
+            finally:
+                server.close()
+                await server.wait_closed()
+    asyncio.run(main())
+    return daemon
+
+
+class Test_AsyncBasicNginXSite:
+    """Tests for the lifecycle methods."""
+    def test_create(self):
+        """Existing containers should be removed, then the site created."""
+        async def create(client):
+            site = await AsyncBasicNginXSite.create(
+                'nginx:latest', name='test_site', client=client,
+                ports={80: 8080}
+            )
+            assert site.container_id == 'new'
+            assert site.state['State']['Status'] == 'created'
+        daemon = run(create)
+        assert daemon.requests == [
+            ('GET', '/v1.37/containers/json'),
+            ('DELETE', '/v1.37/containers/old'),
+            ('GET', '/v1.37/images/nginx%3Alatest/json'),
+            ('POST', '/v1.37/containers/create'),
+            ('GET', '/v1.37/containers/new/json'),
+        ]
+
+    def test_put_archive(self):
+        """A streamed archive should arrive whole."""
+        async def put(client):
+            site = AsyncBasicNginXSite('new', client)
+            await site.put_archive(
+                '/usr/share/nginx/html',
+                tar_stream(join(thisdir, "test_document_folder"))
+            )
+        daemon = run(put)
+        archive, = daemon.archives.values()
+        with tarfile.open(fileobj=BytesIO(archive)) as tf:
+            assert "test_string.txt" in tf.getnames()
+
+    def test_error(self):
+        """An error response should raise AsyncAPIError."""
+        async def start(client):
+            with raises(AsyncAPIError) as error:
+                await AsyncBasicNginXSite('missing', client).start()
+            assert error.value.status_code == 404
+            assert error.value.explanation == 'No such container: missing'
+        run(start)
+
+    def test_pull_error(self):
+        """An error in the pull's progress stream should be raised."""
+        async def pull(client):
+            with raises(AsyncAPIError) as error:
+                await AsyncBasicNginXSite.ensure_image('httpd:2', client)
+            assert error.value.explanation == 'denied'
+        run(pull)
+
+    def test_pull_digest(self):
+        """An image named by digest should be pulled by that digest."""
+        async def pull(client):
+            await AsyncBasicNginXSite.ensure_image('nginx@sha256:ab', client)
+        assert run(pull).pulls == ['fromImage=nginx&tag=sha256%3Aab']
+
+    def test_concurrent(self):
+        """Many operations should be able to run on one loop at once."""
+        async def inspect(client):
+            sites = [AsyncBasicNginXSite('new', client) for _ in range(50)]
+            states = await asyncio.gather(*(
+                site.inspect() for site in sites
+            ))
+            assert all(state['Id'] == 'new' for state in states)
+        assert len(run(inspect).requests) == 50
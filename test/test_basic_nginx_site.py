@@ -5,7 +5,7 @@ from docker.models.networks import Network
 from docker.errors import APIError
 from textwrap import dedent
 from requests import get, ConnectionError
-from pytest import raises
+from pytest import mark, raises
 from typing import Dict
 from src.config import Config
 from src.basic_nginx_site import BasicNginXSite, BlankMounted_BasicNginXSite
@@ -15,6 +15,8 @@ from src.misc_functions import get_parent_dir
 from shutil import rmtree
 from strict_hint import strict
 
+pytestmark = mark.docker
+
 
 class TestBasicNginXSite:
     """Tests that apply to all of the variations on BasicNginXSite."""
@@ -0,0 +1,61 @@
+"""Tests for deploying many sites at once."""
+from threading import Lock
+from src import bulk
+from src.basic_nginx_site import BasicNginXSite
+
+
+class StandInSite():
+    """Takes the place of a site class, recording what was deployed."""
+    default_image = "nginx:latest"
+    deployed = []
+    lock = Lock()
+
+    def __init__(self, name: str, fail: bool=False):
+        if fail:
+            raise RuntimeError("deployment of %s failed" % name)
+        self.name = name
+        with self.lock:
+            self.deployed.append(name)
+
+
+class Test_DeployMany:
+    """Tests for the deploy_many function."""
+    def setup_method(self):
+        """Forget the sites deployed by earlier tests."""
+        StandInSite.deployed = []
+
+    def test_results_and_failures(self, monkeypatch):
+        """Each site should end up either deployed or failed."""
+        resolved = []
+        monkeypatch.setattr(
+            BasicNginXSite, 'resolve_image', staticmethod(resolved.append)
+        )
+        result = bulk.deploy_many([
+            bulk.SiteSpec.of(StandInSite, "site-%d" % number)
+            for number in range(20)
+        ] + [
+            bulk.SiteSpec.of(StandInSite, "broken", fail=True)
+        ], workers=4)
+        assert sorted(result.sites) == sorted(StandInSite.deployed)
+        assert len(result.sites) == 20
+        assert list(result.failures) == ["broken"]
+        assert isinstance(result.failures["broken"], RuntimeError)
+        # The image all of the sites share is only resolved once.
+        assert resolved == ["nginx:latest"]
+
+    def test_unavailable_image(self, monkeypatch):
+        """Sites whose image can't be had shouldn't be attempted."""
+        def resolve_image(image):
+            if image == "missing:latest":
+                raise LookupError(image)
+        monkeypatch.setattr(
+            BasicNginXSite, 'resolve_image', staticmethod(resolve_image)
+        )
+        result = bulk.deploy_many([
+            bulk.SiteSpec(StandInSite, ("present",), {}),
+            bulk.SiteSpec(
+                StandInSite, (), {'name': "absent", 'image': "missing:latest"}
+            )
+        ])
+        assert StandInSite.deployed == ["present"]
+        assert isinstance(result.failures["absent"], LookupError)
@@ -1,11 +1,183 @@
 """Tests for the configuration object."""
-from src.config import Config
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname, realpath
+from subprocess import check_output
+from textwrap import dedent
+from threading import Lock
+from time import monotonic, sleep
+from types import SimpleNamespace
+from pytest import mark
+from src.config import Config, ImageIndex, LazyAttribute, NetworkRegistry
+from src.fake_docker import FakeDockerClient
 from docker import DockerClient
+from docker.errors import APIError
 
 
+@mark.docker
 class TestConfig():
     """Tests for the configuration object."""
     def test_client(self):
         """Be sure that the docker client interface is properly configured."""
         assert isinstance(Config.client, DockerClient)
         assert Config.client.version()['ApiVersion'] == '1.37'
+
+
+class Test_LazyAttribute():
+    """Tests for the attributes of Config which are created on first use."""
+    @staticmethod
+    def run(script: str) -> str:
+        """Run a script in a new interpreter, returning what it printed."""
+        return check_output(
+            [sys.executable, '-c', dedent(script)],
+            cwd=dirname(dirname(realpath(__file__)))
+        ).decode().strip()
+
+    def test_import(self):
+        """Importing the configuration shouldn't import docker or nmap."""
+        assert self.run("""
+            import sys
+            from src.config import Config
+            print(sorted({'docker', 'nmap'} & set(sys.modules)))
+        """) == "[]"
+
+    def test_injection(self):
+        """An assigned client should replace the attribute, unread."""
+        assert self.run("""
+            import sys
+            from src.config import Config
+            client = object()
+            Config.client = Config.port_scanner = client
+            print(Config.client is client, Config.port_scanner is client,
+                  'docker' in sys.modules, 'nmap' in sys.modules)
+        """) == "True True False False"
+
+    def test_created_once(self):
+        """The factory should be called on the first read, and only then."""
+        made = []
+
+        class Holder():
+            value = LazyAttribute(lambda: made.append(object()) or made[-1])
+        assert made == []
+        assert Holder.value is Holder.value
+        assert len(made) == 1
+
+
+class Test_ImageIndex():
+    """Tests for the ImageIndex, against a fake daemon."""
+    def setup_method(self):
+        """Index the fake daemon, which holds one image."""
+        self.index = ImageIndex()
+
+    def teardown_method(self):
+        """Stop following events."""
+        self.index.stop()
+
+    def test_lookup(self):
+        """Images should be found by tag and digest, and fetched once."""
+        image = self.index.get('nginx:latest')
+        digest, = image.attrs['RepoDigests']
+        assert self.index.get(digest) is image
+        assert self.index.get('httpd:2') is None
+        assert self.index.tags() == ['nginx:latest']
+        assert Config.client.calls['images'] == 1
+        assert Config.client.calls['inspect_image'] == 1
+
+    def test_ttl(self):
+        """The index should be loaded again once its TTL has passed."""
+        self.index.ttl = 0
+        self.index.tags()
+        sleep(0.01)
+        self.index.tags()
+        assert Config.client.calls['images'] == 2
+
+    def test_add(self):
+        """An added image should be found without loading the index again."""
+        self.index.tags()
+        # Pulled elsewhere, so no event invalidates the index meanwhile.
+        image = FakeDockerClient(images=['httpd:2']).images.get('httpd:2')
+        self.index.add(image)
+        assert self.index.get('httpd:2') is image
+        assert Config.client.calls['images'] == 1
+
+    def test_events(self):
+        """An image event should make the index load again."""
+        assert self.index.get('httpd:2') is None
+        Config.client.api.add_image('httpd:2')
+        deadline = monotonic() + 5
+        while not self.index.stale and monotonic() < deadline:
+            sleep(0.01)
+        assert self.index.get('httpd:2') is not None
+
+
+class StandInNetworks():
+    """Answers the network requests made by a NetworkRegistry."""
+    def __init__(self, *names: str):
+        self.calls = Counter()
+        self.existing = [
+            SimpleNamespace(id='%s-id' % name, name=name) for name in names
+        ]
+        # How many creations are beaten by someone else's.
+        self.conflicts = 0
+        self._lock = Lock()
+
+    def list(self, names=()):
+        self.calls['list'] += 1
+        with self._lock:
+            return [
+                network for network in self.existing
+                if any(name in network.name for name in names)
+            ]
+
+    def create(self, name, check_duplicate=False):
+        self.calls['create'] += 1
+        sleep(0.01)
+        with self._lock:
+            network = SimpleNamespace(id='%s-id' % name, name=name)
+            self.existing.append(network)
+            if self.conflicts:
+                self.conflicts -= 1
+                raise APIError('Conflict', response=SimpleNamespace(
+                    status_code=409, reason='Conflict', url=''
+                ))
+            return network
+
+
+class Test_NetworkRegistry():
+    """Tests for the NetworkRegistry, against stand-in networks."""
+    def setup_method(self):
+        """Use a client which has networks whose names are similar."""
+        Config.client = SimpleNamespace(networks=StandInNetworks(
+            'site_network_2', 'old_site_network'
+        ))
+        self.registry = NetworkRegistry()
+
+    def test_created_once(self):
+        """A network should be created once, then remembered."""
+        network = self.registry.get_or_create('site_network')
+        assert network.name == 'site_network'
+        assert self.registry.get_or_create('site_network') is network
+        assert Config.client.networks.calls == {'list': 1, 'create': 1}
+
+    def test_existing(self):
+        """A network which exists should be found, not created."""
+        network = self.registry.get_or_create('old_site_network')
+        assert network.id == 'old_site_network-id'
+        assert Config.client.networks.calls == {'list': 1}
+
+    def test_race(self):
+        """A network created elsewhere meanwhile should be used."""
+        Config.client.networks.conflicts = 1
+        network = self.registry.get_or_create('site_network')
+        assert network.name == 'site_network'
+        assert Config.client.networks.calls == {'list': 2, 'create': 1}
+
+    def test_threads(self):
+        """Threads asking at once should share one creation."""
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            networks = list(pool.map(
+                self.registry.get_or_create, ['site_network'] * 8
+            ))
+        assert all(network is networks[0] for network in networks)
+        assert Config.client.networks.calls['create'] == 1
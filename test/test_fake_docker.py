@@ -0,0 +1,266 @@
+"""Tests for the in-process docker daemon stand-in."""
+from threading import Lock
+from time import monotonic
+from docker.errors import APIError, ImageNotFound, NotFound
+from pytest import raises
+from src.basic_nginx_site import AUTO_PORTS, BasicNginXSite
+from src.config import Config, NetworkRegistry
+from src.fake_docker import FakeDockerClient
+from src.ports import PORTS_LABEL, PortAllocator, port_labels
+
+
+class Test_FakeDockerClient:
+    """Tests for the FakeDockerClient."""
+    def setup_method(self):
+        """Create a daemon with one image."""
+        self.client = FakeDockerClient(images=['nginx:latest'])
+
+    def test_container_lifecycle(self):
+        """A container should go from created to running to removed."""
+        container = self.client.containers.create(
+            'nginx:latest', name='site', labels={'role': 'site'}
+        )
+        assert container.name == 'site'
+        assert container.status == 'created'
+        assert container.image.tags == ['nginx:latest']
+        container.start()
+        container.reload()
+        assert container.status == 'running'
+        with raises(APIError):
+            container.remove()
+        container.stop()
+        container.remove()
+        with raises(NotFound):
+            self.client.containers.get('site')
+
+    def test_filters(self):
+        """containers.list() should honour the name and label filters."""
+        self.client.containers.create('nginx', name='site')
+        self.client.containers.create('nginx', name='site_2')
+        self.client.containers.create(
+            'nginx', name='other', labels={'role': 'site'}
+        )
+        assert [c.name for c in self.client.containers.list(
+            all=True, filters={'name': '^/site$'}
+        )] == ['site']
+        assert [c.name for c in self.client.containers.list(
+            all=True, filters={'label': 'role=site'}
+        )] == ['other']
+        assert self.client.containers.list() == []
+
+    def test_conflicts(self):
+        """Names and host ports in use should be refused."""
+        first = self.client.containers.create(
+            'nginx', name='first', ports={80: 28080}
+        )
+        with raises(APIError) as error:
+            self.client.containers.create('nginx', name='first')
+        assert error.value.status_code == 409
+        second = self.client.containers.create(
+            'nginx', name='second', ports={80: 28080}
+        )
+        first.start()
+        with raises(APIError):
+            second.start()
+
+    def test_images(self):
+        """Unknown images should be missing until pulled."""
+        with raises(ImageNotFound):
+            self.client.images.get('httpd:2')
+        pulled = self.client.images.pull('httpd', tag='2')
+        assert pulled.tags == ['httpd:2']
+        assert self.client.images.get('httpd:2').id == pulled.id
+
+    def test_latency(self):
+        """Every call should take at least its configured latency."""
+        client = FakeDockerClient(latency=0.01, latencies={'ping': 0.05})
+        began = monotonic()
+        client.images.list()
+        client.ping()
+        assert monotonic() - began >= 0.06
+        assert client.calls['images'] == 1
+        assert client.calls['ping'] == 1
+
+    def test_failures(self):
+        """Failures should be injected when asked for, and at random."""
+        self.client.api.fail_next('create_network', 2)
+        for _ in range(2):
+            with raises(APIError):
+                self.client.networks.create('net')
+        assert self.client.networks.create('net').name == 'net'
+        client = FakeDockerClient(failure_rates={'ping': 1.0})
+        with raises(APIError):
+            client.ping()
+
+    def test_events(self):
+        """Container events should be sent to event streams."""
+        events = self.client.events(decode=True, filters={'type': 'container'})
+        self.client.networks.create('net')
+        self.client.containers.create('nginx', name='site').start()
+        assert [next(events)['Action'] for _ in range(2)] == \
+            ['create', 'start']
+        events.close()
+
+
+class Test_AgainstFake:
+    """Tests of the project's docker code against the FakeDockerClient."""
+    def test_site_replaced(self):
+        """Constructing a site again should replace its container."""
+        first = BasicNginXSite(name='site', image='nginx:latest')
+        second = BasicNginXSite(name='site', image='nginx')
+        assert [c.id for c in Config.client.containers.list(all=True)] == \
+            [second.container.id]
+        assert first.image.id == second.image.id
+        assert second.current_state.status == 'created'
+
+    def test_image_index(self):
+        """The index should be loaded with a single call."""
+        assert Config.all_image_tags() == ['nginx:latest']
+        assert Config.image_index.get('nginx:latest').tags == ['nginx:latest']
+        assert Config.image_index.get('httpd:2') is None
+        assert Config.client.calls['images'] == 1
+
+    def test_network_registry(self):
+        """A network should be created once and then reused."""
+        first = Config.networks.get_or_create('site_network')
+        Config.networks.forget('site_network')
+        assert Config.networks.get_or_create('site_network').id == first.id
+        assert Config.client.calls['create_network'] == 1
+
+    def test_network_race(self, monkeypatch):
+        """A network created elsewhere since the lookup should be used."""
+        Config.client.networks.create('site_network')
+        lookup = NetworkRegistry.lookup
+        missed = []
+
+        def late_lookup(name):
+            # The first lookup happens before the other process creates it.
+            if not missed:
+                missed.append(name)
+                return None
+            return lookup(name)
+        monkeypatch.setattr(
+            NetworkRegistry, 'lookup', staticmethod(late_lookup)
+        )
+        network = Config.networks.get_or_create('site_network')
+        assert network.id == lookup('site_network').id
+        assert Config.client.calls['create_network'] == 2
+
+    def test_network_removed(self):
+        """A site whose network was removed elsewhere should get a new one."""
+        BasicNginXSite.get_network('site').remove()
+        site = BasicNginXSite(
+            name='site', image='nginx',
+            network=BasicNginXSite.get_network('site').id
+        )
+        assert list(site.state['NetworkSettings']['Networks']) == \
+            ['site_network']
+        assert Config.client.calls['create_network'] == 2
+
+    def test_existing_instance_removed(self):
+        """Containers with the name, and only those, should be removed."""
+        Config.client.containers.create('nginx', name='site').start()
+        Config.client.containers.create('nginx', name='site_2')
+        BasicNginXSite.check_for_existing_instance('site', grace=0)
+        assert [c.name for c in Config.client.containers.list(all=True)] == \
+            ['site_2']
+
+    def test_ports_seeded(self):
+        """Ports recorded on containers shouldn't be allocated again."""
+        Config.client.containers.create(
+            'nginx', name='site', labels=port_labels({80: 29500})
+        )
+        allocator = PortAllocator((29500, 29501))
+        assert allocator.allocate('other', (80,)) == {80: 29501}
+
+    def test_ports_seeded_unfixed(self):
+        """Labels holding bindings without fixed ports should be skipped."""
+        Config.client.containers.create('nginx', name='site', labels={
+            PORTS_LABEL: '{"80": null, "443/tcp": "29500"}'
+        })
+        allocator = PortAllocator((29500, 29501))
+        assert allocator.allocate('other', (80,)) == {80: 29501}
+
+    def test_ports_released(self):
+        """Ports allocated to a site which couldn't be created are freed."""
+        Config.port_allocator = PortAllocator((29500, 29501))
+        Config.client.api.fail_next('create_container')
+        with raises(APIError):
+            BasicNginXSite(name='site', image='nginx', ports=AUTO_PORTS)
+        assert Config.port_allocator.allocate('other', (80, 443)) == \
+            {80: 29500, 443: 29501}
+
+
+class Test_Teardown:
+    """Tests for check_for_existing_instance's teardown of many containers."""
+    def setup_method(self):
+        """Run twenty containers which are all taken to be the site's."""
+        for number in range(20):
+            Config.client.containers.create(
+                'nginx', name='site_%d' % number
+            ).start()
+
+    @staticmethod
+    def match_all(monkeypatch):
+        """Make the site's name match every container, as a pattern would."""
+        containers = Config.client.api.containers
+        monkeypatch.setattr(
+            Config.client.api, 'containers',
+            lambda **kwargs: containers(all=True, filters={'name': '^/site_'})
+        )
+
+    @staticmethod
+    def in_flight(monkeypatch, call: str) -> list:
+        """Record the most calls of the named fake API call at once."""
+        original = getattr(Config.client.api, call)
+        lock = Lock()
+        counts = [0, 0]
+
+        def counted(*args, **kwargs):
+            with lock:
+                counts[0] += 1
+                counts[1] = max(counts)
+            try:
+                return original(*args, **kwargs)
+            finally:
+                with lock:
+                    counts[0] -= 1
+        monkeypatch.setattr(Config.client.api, call, counted)
+        return counts
+
+    def test_concurrent_stop(self, monkeypatch):
+        """Every container should be stopped at once, then removed."""
+        self.match_all(monkeypatch)
+        counts = self.in_flight(monkeypatch, 'stop')
+        Config.client.api.latencies['stop'] = 0.05
+        BasicNginXSite.check_for_existing_instance('site', grace=0)
+        assert counts[1] == Config.teardown_batch_size
+        assert Config.client.calls['stop'] == 20
+        assert Config.client.containers.list(all=True) == []
+
+    def test_kill_fallback(self, monkeypatch):
+        """Containers should get the grace period, then be killed."""
+        self.match_all(monkeypatch)
+        timeouts = []
+        stop = Config.client.api.stop
+
+        def recorded(container, timeout=None):
+            timeouts.append(timeout)
+            return stop(container, timeout)
+        monkeypatch.setattr(Config.client.api, 'stop', recorded)
+        Config.client.api.fail_next('stop', 5)
+        BasicNginXSite.check_for_existing_instance('site', grace=7)
+        assert timeouts == [7] * 20
+        assert Config.client.calls['kill'] == 5
+        assert Config.client.containers.list(all=True) == []
+
+    def test_batches(self, monkeypatch):
+        """No more than Config.teardown_batch_size removals should overlap."""
+        Config.teardown_batch_size = 3
+        self.match_all(monkeypatch)
+        counts = self.in_flight(monkeypatch, 'remove_container')
+        Config.client.api.latencies['remove_container'] = 0.02
+        BasicNginXSite.check_for_existing_instance('site', grace=0)
+        assert counts[1] == 3
+        assert Config.client.calls['remove_container'] == 20
+        assert Config.client.containers.list(all=True) == []
@@ -0,0 +1,67 @@
+"""Tests for pulling images ahead of time and pinning them."""
+from os.path import join
+from tempfile import TemporaryDirectory
+from src import images
+from src.basic_nginx_site import BasicNginXSite
+from src.config import Config
+
+
+class Test_References:
+    """Tests for the parsing of image references."""
+    def test_split(self):
+        """Tags, digests and registry ports should be told apart."""
+        assert images.split_reference('nginx') == ('nginx', 'latest')
+        assert images.split_reference('nginx:1.15') == ('nginx', '1.15')
+        assert images.split_reference('localhost:5000/site') == \
+            ('localhost:5000/site', 'latest')
+        assert images.split_reference('nginx@sha256:ab') == \
+            ('nginx', 'sha256:ab')
+        assert images.normalise('nginx') == 'nginx:latest'
+
+
+class Test_Prepull:
+    """Tests for prepull() and pinning, against a fake daemon."""
+    def setup_method(self):
+        """Use a fake daemon in which two images share a layer."""
+        Config.client.api.layers = {
+            'httpd:2': ['base', 'httpd'],
+            'httpd:2-alpine': ['base', 'alpine'],
+        }
+
+    def test_pulls(self):
+        """Missing images should be pulled once, present ones not at all."""
+        seen = []
+        results = images.prepull(
+            ['nginx', 'httpd:2', 'httpd:2', 'httpd:2-alpine'],
+            progress=lambda reference, event: seen.append(reference)
+        )
+        assert set(results) == {'nginx:latest', 'httpd:2', 'httpd:2-alpine'}
+        assert not results['nginx:latest'].pulled
+        assert results['httpd:2'].pulled and results['httpd:2-alpine'].pulled
+        assert Config.client.calls['pull'] == 2
+        assert set(seen) == {'httpd:2', 'httpd:2-alpine'}
+        # The shared layer was downloaded by one of the pulls only.
+        assert sum(
+            result.layers_downloaded for result in results.values()
+        ) == 3
+        assert Config.image_index.get('httpd:2') is not None
+
+    def test_failure(self):
+        """A failed pull should be recorded without stopping the others."""
+        Config.client.api.fail_next('pull')
+        results = images.prepull(['httpd:2'], workers=1)
+        assert results['httpd:2'].error is not None
+        assert images.prepull(['httpd:2'])['httpd:2'].error is None
+
+    def test_pinning(self):
+        """A pinned tag should resolve to its pinned image."""
+        Config.client.api.registry['httpd:2'] = 'sha256:' + 'a' * 64
+        images.prepull(['httpd:2'], pin=True)
+        assert Config.image_pins == {'httpd:2': 'httpd@sha256:' + 'a' * 64}
+        pinned = BasicNginXSite.resolve_image('httpd:2')
+        with TemporaryDirectory() as folder:
+            images.save_pins(join(folder, 'pins.json'))
+            Config.image_pins = {}
+            images.load_pins(join(folder, 'pins.json'))
+        assert BasicNginXSite.resolve_image('httpd:2').id == pinned.id
+        assert Config.client.calls['pull'] == 1
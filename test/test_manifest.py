@@ -0,0 +1,122 @@
+"""Tests for manifests and their reconciliation."""
+import json
+import os
+from os.path import join
+from tempfile import TemporaryDirectory
+from pytest import importorskip, raises
+from src import basic_nginx_site, manifest, sync
+from src.config import Config
+from src.ports import PortAllocator
+
+
+class Test_Load:
+    """Tests for reading manifests."""
+    def test_json_and_yaml(self):
+        """Both formats should give the same entries."""
+        importorskip('yaml')
+        sites = [{'name': 'one', 'ports': {'80': 8080}}, {'name': 'two'}]
+        with TemporaryDirectory() as folder:
+            with open(join(folder, 'sites.json'), 'w') as file:
+                json.dump({'sites': sites}, file)
+            with open(join(folder, 'sites.yml'), 'w') as file:
+                file.write(
+                    "sites:\n"
+                    "  - name: one\n"
+                    "    ports: {'80': 8080}\n"
+                    "  - name: two\n"
+                )
+            assert manifest.load(join(folder, 'sites.json')) == sites
+            assert manifest.load(join(folder, 'sites.yml')) == sites
+
+    def test_invalid(self):
+        """Unknown kinds and repeated names should be refused."""
+        with TemporaryDirectory() as folder:
+            path = join(folder, 'sites.json')
+            for sites in (
+                        [{'name': 'one', 'kind': 'Config'}],
+                        [{'name': 'one'}, {'name': 'one'}],
+                    ):
+                with open(path, 'w') as file:
+                    json.dump({'sites': sites}, file)
+                with raises(ValueError):
+                    manifest.load(path)
+
+
+class Test_Apply:
+    """Tests for apply(), against a fake daemon."""
+    def setup_method(self):
+        """Create a scratch folder holding the sites' content."""
+        self.folder = TemporaryDirectory()
+        self.source = join(self.folder.name, 'source')
+        os.mkdir(self.source)
+        with open(join(self.source, 'index.html'), 'w') as file:
+            file.write("<h1>Hello</h1>")
+        self.sites = [
+            {'name': 'plain', 'image': 'nginx'},
+            {
+                'name': 'copied',
+                'kind': 'CopyFoldersToMounts',
+                'webroot': {join(self.folder.name, 'webroot'): self.source},
+                'confdir': {join(self.folder.name, 'conf'): self.source},
+            },
+        ]
+
+    def teardown_method(self):
+        """Remove the scratch folder."""
+        self.folder.cleanup()
+
+    def test_noop(self):
+        """Applying the same manifest again should deploy nothing."""
+        first = manifest.apply(self.sites)
+        assert sorted(first.plan.create) == ['copied', 'plain']
+        assert not first.deployed.failures
+        creates = Config.client.calls['create_container']
+        second = manifest.apply(self.sites)
+        assert sorted(second.plan.unchanged) == ['copied', 'plain']
+        assert Config.client.calls['create_container'] == creates
+
+    def test_changes(self):
+        """Changed specs and content should be redeployed, only them."""
+        manifest.apply(self.sites)
+        self.sites[0]['ports'] = {'80': 28080}
+        with open(join(self.source, 'index.html'), 'w') as file:
+            file.write("<h1>Hello again</h1>")
+        os.utime(join(self.source, 'index.html'), ns=(0, 0))
+        assert sorted(manifest.plan(self.sites).update) == \
+            ['copied', 'plain']
+        result = manifest.apply(self.sites[:1], prune=True)
+        assert result.removed == ['copied']
+        assert [c.name for c in Config.client.containers.list(all=True)] == \
+            ['plain']
+
+    def test_auto_ports(self, monkeypatch):
+        """A plain site with automatic ports should get free host ports."""
+        monkeypatch.setattr(
+            Config, 'port_allocator', PortAllocator((29700, 29799))
+        )
+        result = manifest.apply(
+            [{'name': 'automatic', 'image': 'nginx', 'ports': 'auto'}]
+        )
+        assert not result.deployed.failures
+        site = result.deployed.sites['automatic']
+        assert 29700 <= site.host_port(80) <= 29799
+
+    def test_files(self, monkeypatch):
+        """A site given files should be planned, deployed and synced."""
+        static = join(self.folder.name, 'static')
+        for module in (basic_nginx_site, sync):
+            monkeypatch.setattr(
+                module, 'get_parent_dir', lambda name: join(static, name)
+            )
+        os.makedirs(join(static, 'docs'))
+        sites = [{
+            'name': 'docs',
+            'kind': 'CopyFilesToMountedWebroot_BasicNginxSite',
+            'files': [join(self.source, 'index.html')],
+        }]
+        assert manifest.plan(sites).create == ['docs']
+        result = manifest.apply(sites)
+        assert not result.deployed.failures
+        assert result.deployed.sites['docs'].sync_report.copied == \
+            ['index.html']
+        assert manifest.plan(sites).unchanged == ['docs']
@@ -4,8 +4,9 @@ Each class below stores the tests for one of the functions, named Test_%s where
 %s is the name of the function converted to CamelCase.
 """
 from src import misc_functions
-from os.path import join, isdir
-from os import access, rmdir
+from hashlib import sha256
+from os.path import join, isdir, dirname, realpath
+from os import access, rmdir, symlink, walk
 from os import R_OK as readable_file
 from os import W_OK as writable_file
 from os import X_OK as executable_file
@@ -14,7 +15,8 @@ from os import sep as root
 from os import pardir as parent
 from subprocess import CompletedProcess, CalledProcessError
 from pytest import raises
-from shutil import rmtree
+from shutil import copytree, rmtree
+from tempfile import TemporaryDirectory
 
 test_string = """The Zen of Python, by Tim Peters
 
@@ -68,6 +70,87 @@ class Test_ListRecursively:
         ]
 
 
+class Test_WalkTree:
+    """Test that the walk_tree generator works properly."""
+    @property
+    def folder(self) -> str:
+        """The path to the test document folder."""
+        return join(dirname(realpath(__file__)), "test_document_folder")
+
+    def test_is_lazy(self):
+        """Nothing should be scanned until the first entry is asked for."""
+        walk = misc_functions.walk_tree(join(self.folder, "nonexistent"))
+        with raises(FileNotFoundError):
+            next(walk)
+
+    def test_files(self):
+        """Only the files should be yielded by default."""
+        assert [
+            entry.path for entry in misc_functions.walk_tree(self.folder)
+        ] == [
+            join(self.folder, "test_string.txt"),
+            join(self.folder, "test_folder2", "test_string2.txt")
+        ]
+
+    def test_directories(self):
+        """Folders should be yielded too if asked for."""
+        assert [
+            entry.name for entry in misc_functions.walk_tree(
+                self.folder, directories=True
+            )
+        ] == ["test_string.txt", "test_folder2", "test_string2.txt"]
+
+    def test_globs(self):
+        """Excluded folders shouldn't be walked, and include should filter."""
+        assert [
+            entry.name for entry in misc_functions.walk_tree(
+                self.folder, exclude=("test_folder2",)
+            )
+        ] == ["test_string.txt"]
+        assert [
+            entry.name for entry in misc_functions.walk_tree(
+                self.folder, include=("test_folder2/*",)
+            )
+        ] == ["test_string2.txt"]
+
+    def test_parallel(self):
+        """A parallel walk should find the same entries."""
+        assert sorted(
+            entry.path for entry in misc_functions.walk_tree(
+                self.folder, directories=True, workers=4
+            )
+        ) == sorted(
+            entry.path for entry in misc_functions.walk_tree(
+                self.folder, directories=True
+            )
+        )
+
+    def test_directory_symlink(self):
+        """A link to a folder should be treated as a folder, not followed."""
+        with TemporaryDirectory() as folder:
+            copytree(self.folder, join(folder, "tree"))
+            symlink(
+                join(folder, "tree", "test_folder2"),
+                join(folder, "tree", "linked")
+            )
+            tree = join(folder, "tree")
+            assert sorted(misc_functions.list_recursively(tree)) == sorted(
+                join(path, name) for path, _, names in walk(tree)
+                for name in names
+            )
+            for workers in (0, 4):
+                assert "linked" in [
+                    entry.name for entry in misc_functions.walk_tree(
+                        tree, directories=True, workers=workers
+                    )
+                ]
+                assert "linked" not in [
+                    entry.name for entry in misc_functions.walk_tree(
+                        tree, workers=workers
+                    )
+                ]
+
+
 class Test_HashOfString:
     """Test that the function hash_of_str works."""
     def test_hash_of_string(self):
@@ -98,6 +181,35 @@ class Test_HashOfFile:
         with raises(TypeError):
             misc_functions.hash_of_str(['invalid', {'inputs': 5}], 987.6)
 
+    def test_binary_file(self):
+        """Check that a binary file hashes the same as its bytes."""
+        archive = join(dirname(realpath(__file__)), "test_archive.tar")
+        with open(archive, 'rb') as f:
+            assert misc_functions.hash_of_file(archive) == \
+                sha256(f.read()).hexdigest()
+
+    def test_memory_mapped(self, monkeypatch):
+        """Check that a memory mapped file hashes the same as a read one."""
+        archive = join(dirname(realpath(__file__)), "test_archive.tar")
+        expected = misc_functions.hash_of_file(archive)
+        monkeypatch.setattr(misc_functions, 'HASH_MMAP_THRESHOLD', 1)
+        assert misc_functions.hash_of_file(archive) == expected
+
+
+class Test_HashOfFiles:
+    """Test that the function hash_of_files works."""
+    def test_many_files(self):
+        """Each file's hash should be mapped from its path."""
+        folder = join(dirname(realpath(__file__)), "test_document_folder")
+        paths = [
+            join(folder, "test_string.txt"),
+            join(folder, "test_folder2", "test_string2.txt")
+        ]
+        assert misc_functions.hash_of_files(paths, workers=2) == {
+            paths[0]: misc_functions.hash_of_str(test_string),
+            paths[1]: misc_functions.hash_of_str(test_string2)
+        }
+
 
 class TestPerms:
     """Test that the perms function returns the right values."""
@@ -0,0 +1,67 @@
+"""Tests for the host port allocator."""
+import json
+import socket
+from pytest import raises
+from src import ports
+
+
+class Test_PortAllocator:
+    """Tests for the PortAllocator."""
+    def setup_method(self):
+        """Create an allocator which doesn't look for existing containers."""
+        self.allocator = ports.PortAllocator((29000, 29099))
+        self.allocator._seeded = True
+
+    def test_distinct(self):
+        """Different owners should get different ports."""
+        first = self.allocator.allocate("first", (80, 443))
+        second = self.allocator.allocate("second", (80, 443))
+        assert set(first) == {80, 443}
+        assert not set(first.values()) & set(second.values())
+
+    def test_same_owner(self):
+        """An owner asking again should keep its ports."""
+        assert self.allocator.allocate("site", (80, 443)) == \
+            self.allocator.allocate("site", (80, 443))
+
+    def test_bound_port_skipped(self):
+        """A port which is in use shouldn't be allocated."""
+        listener = socket.socket()
+        listener.bind(('', 29000))
+        listener.listen()
+        try:
+            assert self.allocator.allocate("site", (80,))[80] != 29000
+        finally:
+            listener.close()
+
+    def test_release(self):
+        """Released ports should become available again."""
+        allocator = ports.PortAllocator((29100, 29101))
+        allocator._seeded = True
+        allocator.allocate("first", (80, 443))
+        with raises(RuntimeError):
+            allocator.allocate("second", (80,))
+        allocator.release("first")
+        assert allocator.allocate("second", (80,))
+
+    def test_reserved_by_label(self):
+        """Ports recorded on a container's label should be reserved."""
+        labels = ports.port_labels({80: 29000, 443: 29001})
+        self.allocator.reserve(
+            "stopped_site",
+            {
+                int(container): host for container, host
+                in json.loads(labels[ports.PORTS_LABEL]).items()
+            }
+        )
+        allocated = self.allocator.allocate("site", (80, 443))
+        assert not set(allocated.values()) & {29000, 29001}
+
+    def test_unfixed_ports(self):
+        """Bindings without a fixed host port shouldn't be recorded."""
+        assert ports.fixed_ports({
+            80: None, '443/tcp': '29001', 8080: ('127.0.0.1', 29002),
+            8443: [None, 29003], 'http': 29004
+        }) == {443: 29001, 8080: 29002, 8443: 29003}
+        assert json.loads(ports.port_labels({80: None})[ports.PORTS_LABEL]) \
+            == {}
@@ -0,0 +1,55 @@
+"""Tests for waiting until a site is ready."""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread, Timer
+from pytest import raises
+from src import readiness
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers every request with an empty 200."""
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Test_WaitUntilReady:
+    """Tests for the wait_until_ready function."""
+    def setup_method(self):
+        """Reserve a port for a server, which isn't serving yet."""
+        self.server = HTTPServer(('localhost', 0), Handler, False)
+        self.server.server_bind()
+        self.port = self.server.server_address[1]
+
+    def teardown_method(self):
+        """Stop the server."""
+        self.server.server_close()
+
+    def serve(self):
+        """Start accepting connections."""
+        self.server.server_activate()
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def test_ready_later(self):
+        """The wait should end soon after the server starts."""
+        Timer(0.3, self.serve).start()
+        ready = readiness.wait_until_ready(port=self.port, deadline=10)
+        assert ready.status_code == 200
+        assert ready.attempts > 1
+        assert 0.3 <= ready.ready_after < 10
+        assert ready.time_to_first_byte >= 0
+        self.server.shutdown()
+
+    def test_timeout(self):
+        """A server which never starts should time out."""
+        with raises(TimeoutError):
+            readiness.wait_until_ready(port=self.port, deadline=0.2)
+
+    def test_backoff(self):
+        """Delays should stay under the growing, capped ceiling."""
+        delays = readiness.backoff_delays(0.1, 1.0)
+        for ceiling in (0.1, 0.2, 0.4, 0.8, 1.0, 1.0):
+            assert 0 <= next(delays) <= ceiling
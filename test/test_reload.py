@@ -0,0 +1,73 @@
+"""Tests for reloading a site's nginx configuration in place."""
+import os
+from os.path import join
+from tempfile import TemporaryDirectory
+from docker.types import Mount
+from pytest import raises
+from src.basic_nginx_site import BasicNginXSite, InvalidConfiguration
+from src.config import Config
+from src.fake_docker import FakeDockerClient
+
+
+def write(path: str, content: str):
+    """Write a file."""
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+class Test_ReloadConfiguration:
+    """Tests for reload_configuration(), against a fake daemon."""
+    def setup_method(self):
+        """Run a site whose nginx only accepts "good" configurations."""
+        self.commands = []
+
+        def nginx(container, command):
+            self.commands.append(command[1:])
+            with open(join(self.confdir, 'nginx.conf')) as file:
+                valid = 'good' in file.read()
+            return (0, b'ok') if valid else (1, b'nginx: [emerg] bad')
+        Config.client = FakeDockerClient(
+            images=['nginx:latest'], exec_handler=nginx
+        )
+        self.folder = TemporaryDirectory()
+        self.confdir = join(self.folder.name, 'configuration')
+        self.source = join(self.folder.name, 'source')
+        self.manifest = join(self.folder.name, 'manifest.json')
+        os.mkdir(self.confdir)
+        os.mkdir(self.source)
+        write(join(self.confdir, 'nginx.conf'), 'good')
+        self.site = BasicNginXSite(
+            name='site',
+            image='nginx',
+            mounts=[Mount(
+                target='/etc/nginx', source=self.confdir, type='bind'
+            )]
+        )
+        self.site.container.start()
+
+    def teardown_method(self):
+        """Remove the scratch folder."""
+        self.folder.cleanup()
+
+    def test_reload(self):
+        """A valid configuration should be copied, tested and reloaded."""
+        write(join(self.source, 'nginx.conf'), 'good, again')
+        report = self.site.reload_configuration(self.source, self.manifest)
+        assert report.copied == ['nginx.conf']
+        assert self.commands == [['-t'], ['-s', 'reload']]
+        # Nothing has changed the second time.
+        self.site.reload_configuration(self.source, self.manifest)
+        assert len(self.commands) == 2
+
+    def test_rollback(self):
+        """An invalid configuration should be rolled back."""
+        write(join(self.source, 'nginx.conf'), 'bad')
+        write(join(self.source, 'extra.conf'), 'new')
+        with raises(InvalidConfiguration) as error:
+            self.site.reload_configuration(self.source, self.manifest)
+        assert 'emerg' in error.value.output
+        assert self.commands == [['-t']]
+        assert sorted(os.listdir(self.confdir)) == ['nginx.conf']
+        with open(join(self.confdir, 'nginx.conf')) as file:
+            assert file.read() == 'good'
+        assert not os.path.exists(self.manifest)
@@ -0,0 +1,83 @@
+"""Tests for replacing a running site without downtime."""
+from pytest import raises
+from src.basic_nginx_site import AUTO_PORTS, BasicNginXSite
+from src.config import Config
+from src.ports import PortAllocator
+
+
+class Test_Redeploy:
+    """Tests for BasicNginXSite.redeploy(), against a fake daemon."""
+    def setup_method(self):
+        """Use a fake daemon on which the site is running."""
+        Config.port_allocator = PortAllocator((29600, 29699))
+        Config.drain_period = 0
+        self.network = BasicNginXSite.get_network('site')
+        self.old = self.construct(BasicNginXSite)
+        self.old.container.start()
+
+    def construct(self, construct, ports=AUTO_PORTS):
+        """Deploy the site with the given constructor."""
+        return construct(
+            name='site',
+            image='nginx',
+            network=self.network.id,
+            ports=ports
+        )
+
+    def test_take_over(self, monkeypatch):
+        """The new container should end up serving under the site's name."""
+        monkeypatch.setattr(
+            BasicNginXSite, 'wait_until_ready', lambda *args, **kwargs: None
+        )
+        new = self.construct(BasicNginXSite.redeploy)
+        running = Config.client.containers.list()
+        assert [c.id for c in running] == [new.container.id]
+        assert new.container.name == 'site'
+        # Only the network alias is switched; the host ports change.
+        assert new.host_port(80) != self.old.host_port(80)
+        assert Config.port_allocator.allocate('site', (80, 443)) == {
+            80: new.host_port(80), 443: new.host_port(443)
+        }
+        attachment = new.state['NetworkSettings']['Networks']['site_network']
+        assert attachment['Aliases'] == ['site']
+
+    def test_not_ready(self, monkeypatch):
+        """If the new container isn't ready, the old should carry on."""
+        def not_ready(*args, **kwargs):
+            raise TimeoutError("Not ready.")
+        monkeypatch.setattr(BasicNginXSite, 'wait_until_ready', not_ready)
+        with raises(TimeoutError):
+            self.construct(BasicNginXSite.redeploy)
+        assert [c.id for c in Config.client.containers.list(all=True)] == \
+            [self.old.container.id]
+
+    def test_not_running(self):
+        """A site which isn't running should simply be replaced."""
+        self.old.container.stop()
+        new = self.construct(BasicNginXSite.redeploy)
+        assert new.container.name == 'site'
+        assert new.host_port(80) == self.old.host_port(80)
+
+    def test_fixed_ports(self):
+        """A running site on fixed host ports can't be replaced."""
+        self.old.container.remove(force=True)
+        self.old = self.construct(BasicNginXSite, ports={80: 29650})
+        self.old.container.start()
+        with raises(ValueError):
+            self.construct(BasicNginXSite.redeploy, ports={80: 29650})
+        assert [c.id for c in Config.client.containers.list()] == \
+            [self.old.container.id]
+
+    def test_removal_not_seen(self, monkeypatch):
+        """A takeover which worked shouldn't fail for a slow removal."""
+        monkeypatch.setattr(
+            BasicNginXSite, 'wait_until_ready', lambda *args, **kwargs: None
+        )
+
+        def not_seen(*args, **kwargs):
+            raise TimeoutError("Still there.")
+        monkeypatch.setattr(Config.state_tracker, 'wait_for', not_seen)
+        site = self.construct(BasicNginXSite.redeploy)
+        new, = Config.client.containers.list(all=True)
+        assert new.name == 'site'
+        assert new.id == site.container.id != self.old.container.id
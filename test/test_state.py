@@ -0,0 +1,113 @@
+"""Tests for the event-driven container state tracking."""
+import json
+from os.path import dirname, join, realpath
+from threading import Thread
+from pytest import raises
+from src.config import Config
+from src.state import ContainerState, StateTracker
+
+thisdir = dirname(realpath(__file__))
+
+
+class Test_StateTracker:
+    """Tests for the StateTracker, fed events by hand."""
+    def setup_method(self):
+        """Seed a tracker from the sample inspection output."""
+        with open(join(dirname(thisdir), "sample_inspection_output.json")) \
+                as f:
+            self.inspection = json.load(f)
+        self.id = self.inspection['Id']
+        self.tracker = StateTracker()
+        self.tracker.seed(self.inspection)
+
+    def event(self, action: str, **attributes):
+        """Apply an event for the sample container."""
+        self.tracker.apply({
+            'Type': 'container',
+            'Action': action,
+            'id': self.id,
+            'Actor': {'ID': self.id, 'Attributes': attributes}
+        })
+
+    def test_seed(self):
+        """The seeded state should be that of the inspection."""
+        assert self.tracker.get(self.id) == ContainerState('created', None, 0)
+
+    def test_events(self):
+        """Events should move the container through its lifecycle."""
+        self.event('start')
+        assert self.tracker.get(self.id).status == 'running'
+        self.event('health_status: healthy')
+        assert self.tracker.get(self.id).health == 'healthy'
+        self.event('die', exitCode='137')
+        assert self.tracker.get(self.id) == \
+            ContainerState('exited', 'healthy', 137)
+        self.event('destroy')
+        assert self.tracker.get(self.id).status == 'removed'
+
+    def test_untracked(self):
+        """Events for containers which aren't tracked should be ignored."""
+        self.tracker.apply({'Action': 'start', 'id': 'other'})
+        assert self.tracker.get('other') is None
+
+    def test_wait_for(self):
+        """Waiting should return as soon as the state is reached."""
+        starter = Thread(target=self.event, args=('start',))
+        starter.start()
+        assert self.tracker.wait_for(
+            self.id, lambda state: state.status == 'running', timeout=5
+        ).status == 'running'
+        starter.join()
+
+    def test_wait_for_timeout(self):
+        """Waiting for a state which doesn't come should time out."""
+        with raises(TimeoutError):
+            self.tracker.wait_for(
+                self.id, lambda state: state.status == 'running', timeout=0.01
+            )
+
+    def test_removed_dropped(self):
+        """Removed containers should only be remembered for a while."""
+        self.tracker.removed_history = 1
+        self.event('destroy')
+        assert self.tracker._states == {}
+        assert self.tracker.wait_for(
+            self.id, lambda state: state.status == 'removed', timeout=0
+        ).status == 'removed'
+        other = dict(self.inspection, Id='other')
+        self.tracker.seed(other)
+        self.tracker.apply({'Action': 'destroy', 'id': 'other'})
+        assert self.tracker.get(self.id) is None
+
+
+class Test_Watch:
+    """Tests for following the event stream of a fake daemon."""
+    def setup_method(self):
+        """Track the containers of the fake daemon."""
+        self.tracker = StateTracker(retry_delay=0.01)
+
+    def teardown_method(self):
+        """Stop following events."""
+        self.tracker.stop()
+
+    def test_no_event_missed(self):
+        """An event straight after watch() should be seen."""
+        container = Config.client.containers.create('nginx')
+        self.tracker.seed(container.attrs)
+        self.tracker.watch()
+        container.start()
+        assert self.tracker.wait_for(
+            container.id, lambda state: state.status == 'running', timeout=5
+        ).status == 'running'
+
+    def test_reconnect(self, capsys):
+        """A failed stream should be reported, reopened and caught up on."""
+        container = Config.client.containers.create('nginx')
+        self.tracker.seed(container.attrs)
+        Config.client.api.fail_next('events')
+        self.tracker.watch()
+        container.start()
+        assert self.tracker.wait_for(
+            container.id, lambda state: state.status == 'running', timeout=5
+        ).status == 'running'
+        assert 'WARNING' in capsys.readouterr().err
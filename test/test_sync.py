@@ -0,0 +1,111 @@
+"""Tests for the incremental file sync in sync.py."""
+import os
+from os.path import dirname, exists, isdir, join, realpath
+from shutil import copytree
+from tempfile import TemporaryDirectory
+from src import sync
+from src.misc_functions import hash_of_file
+
+thisdir = dirname(realpath(__file__))
+
+
+class Test_SyncFiles:
+    """Tests for the sync_files function."""
+    def setup_method(self):
+        """Create a source tree, an empty destination and a manifest path."""
+        self.tmp = TemporaryDirectory()
+        self.source = join(self.tmp.name, "source")
+        copytree(join(thisdir, "test_document_folder"), self.source)
+        self.destination = join(self.tmp.name, "webroot")
+        os.mkdir(self.destination)
+        self.manifest = join(self.tmp.name, "webroot_manifest.json")
+
+    def teardown_method(self):
+        """Remove everything the test created."""
+        self.tmp.cleanup()
+
+    def sync(self, *sources: str) -> sync.SyncReport:
+        """Sync the sources into the test destination."""
+        return sync.sync_files(self.manifest, self.destination, *sources)
+
+    def test_first_sync(self):
+        """Everything should be copied the first time."""
+        report = self.sync(self.source)
+        assert sorted(report.copied) == [
+            join("source", "test_folder2", "test_string2.txt"),
+            join("source", "test_string.txt")
+        ]
+        assert report.unchanged == 0
+        assert hash_of_file(
+            self.destination, "source", "test_string.txt"
+        ) == hash_of_file(self.source, "test_string.txt")
+
+    def test_nothing_changed(self):
+        """A second sync of the same files should copy nothing."""
+        first = self.sync(self.source)
+        second = self.sync(self.source)
+        assert second.copied == []
+        assert second.deleted == []
+        assert second.unchanged == 2
+        assert second.bytes_saved == first.bytes_copied
+
+    def test_touched_but_same(self):
+        """A file with a new mtime but the same contents isn't copied."""
+        self.sync(self.source)
+        os.utime(join(self.source, "test_string.txt"), (0, 0))
+        assert self.sync(self.source).copied == []
+
+    def test_changed_file(self):
+        """Only the changed file should be copied."""
+        self.sync(self.source)
+        with open(join(self.source, "test_string.txt"), 'a') as f:
+            f.write("and one more thing\n")
+        assert self.sync(self.source).copied == [
+            join("source", "test_string.txt")
+        ]
+
+    def test_removed_file(self):
+        """A file which is no longer passed should be deleted."""
+        self.sync(self.source)
+        os.remove(join(self.source, "test_folder2", "test_string2.txt"))
+        report = self.sync(self.source)
+        assert report.deleted == [
+            join("source", "test_folder2", "test_string2.txt")
+        ]
+        assert not exists(join(self.destination, "source", "test_folder2"))
+
+    def test_single_files(self):
+        """Single files should be placed under their own names."""
+        report = self.sync(join(self.source, "test_string.txt"))
+        assert report.copied == ["test_string.txt"]
+        assert exists(join(self.destination, "test_string.txt"))
+
+    def test_file_becomes_folder(self):
+        """A file replaced by a folder of the same name, and back again."""
+        css = join(self.tmp.name, "css")
+        with open(css, 'w') as f:
+            f.write("body {}\n")
+        assert self.sync(css).copied == ["css"]
+        os.remove(css)
+        os.mkdir(css)
+        with open(join(css, "a.css"), 'w') as f:
+            f.write("a {}\n")
+        report = self.sync(css)
+        assert report.copied == [join("css", "a.css")]
+        assert report.deleted == ["css"]
+        os.remove(join(css, "a.css"))
+        os.rmdir(css)
+        with open(css, 'w') as f:
+            f.write("body {}\n")
+        report = self.sync(css)
+        assert report.copied == ["css"]
+        assert report.deleted == [join("css", "a.css")]
+        with open(join(self.destination, "css")) as f:
+            assert f.read() == "body {}\n"
+
+    def test_file_in_the_way(self):
+        """A file where a folder is needed, say from a failed sync, goes."""
+        with open(join(self.destination, "source"), 'w') as f:
+            f.write("left over\n")
+        assert len(self.sync(self.source).copied) == 2
+        assert isdir(join(self.destination, "source"))
@@ -0,0 +1,77 @@
+"""Tests for the deploy timing spans."""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from pytest import raises
+from src.basic_nginx_site import BasicNginXSite
+from src.config import Config
+from src.telemetry import JSONExporter, carry, counted, span
+
+
+class Test_Spans:
+    """Tests for spans and their sinks."""
+    def setup_method(self):
+        """Collect spans in a list, using a fake daemon."""
+        self.spans = []
+        Config.telemetry_sink = self.spans.append
+
+    def test_nesting(self):
+        """Children should end first, and count toward their parents."""
+        with span('outer') as outer:
+            with span('inner'):
+                Config.client.ping()
+            Config.client.ping()
+        inner, recorded = self.spans
+        assert recorded is outer
+        assert inner.parent_id == outer.id
+        assert (inner.api_calls, outer.api_calls) == (1, 2)
+        assert outer.duration >= inner.duration
+
+    def test_bytes_and_errors(self):
+        """Bytes streamed should be counted, and errors recorded."""
+        with raises(ValueError):
+            with span('phase') as phase:
+                assert b''.join(counted([b'ab', b'cde'], phase)) == b'abcde'
+                raise ValueError("failed")
+        assert self.spans[0].bytes == 5
+        assert 'failed' in self.spans[0].error
+
+    def test_carry(self):
+        """Calls on worker threads should count when carried."""
+        with span('phase'):
+            with ThreadPoolExecutor(2) as pool:
+                list(pool.map(carry(lambda _: Config.client.ping()), '12'))
+                list(pool.map(lambda _: Config.client.ping(), '12'))
+        assert self.spans[0].api_calls == 2
+
+    def test_phases(self):
+        """The site helpers should record their phases."""
+        Config.client.containers.create('nginx', name='site')
+        BasicNginXSite.get_network('site')
+        BasicNginXSite.check_for_existing_instance('site', grace=0)
+        network, teardown = self.spans
+        assert network.name == 'get_network'
+        assert network.attributes == {'site': 'site'}
+        # Look it up, create it and inspect it.
+        assert network.api_calls == 3
+        assert teardown.name == 'teardown'
+        # List and inspect, then stop and remove the created container.
+        assert teardown.api_calls == 4
+
+    def test_no_sink(self):
+        """Without a sink, nothing should be recorded."""
+        Config.telemetry_sink = None
+        with span('phase'):
+            Config.client.ping()
+        assert self.spans == []
+
+    def test_json_exporter(self):
+        """Spans should be written as lines of JSON."""
+        output = StringIO()
+        Config.telemetry_sink = JSONExporter(output)
+        with span('phase', site='site') as phase:
+            phase.add_bytes(10)
+        record = json.loads(output.getvalue())
+        assert record['name'] == 'phase'
+        assert record['bytes'] == 10
+        assert record['attributes'] == {'site': 'site'}
@@ -0,0 +1,80 @@
+"""Tests for the runtime type checks."""
+import os
+from typing import Iterator, List, Optional, Union
+from pytest import raises
+from strict_hint.strict_hint import (
+    ArgumentTypeHintError, ReturnValueTypeHintError
+)
+from src import typecheck
+from src.typecheck import strict, types_for
+
+
+class Test_TypesFor:
+    """Tests for the translation of hints to types."""
+    def test_typing(self):
+        """typing constructs should become the types they allow."""
+        assert types_for(Optional[int]) == (int, type(None))
+        assert types_for(Union[str, List[str]]) == (str, list)
+        assert types_for(Iterator[bytes])[0].__name__ == 'Iterator'
+        assert types_for('ForwardReference') is None
+
+
+class Test_Strict:
+    """Tests for the strict decorator."""
+    def setup_method(self):
+        """Turn the checks on, whatever the environment says."""
+        self.saved = os.environ.pop(typecheck.ENVIRONMENT_SETTING, None)
+
+    def teardown_method(self):
+        """Restore the environment."""
+        if self.saved is not None:
+            os.environ[typecheck.ENVIRONMENT_SETTING] = self.saved
+
+    def test_arguments(self):
+        """Arguments should be checked wherever they're passed."""
+        @strict
+        def joined(first: str, *rest: str, sep: Union[str, bytes]=' '):
+            return first
+
+        assert joined('a', 'b', sep=b'') == 'a'
+        with raises(ArgumentTypeHintError):
+            joined(1)
+        with raises(ArgumentTypeHintError):
+            joined('a', 'b', 2)
+        with raises(ArgumentTypeHintError):
+            joined('a', sep=3)
+
+    def test_default(self):
+        """The default value should be accepted even if of another type."""
+        @strict
+        def grace(seconds: int=None):
+            return seconds
+
+        assert grace(None) is None
+        assert grace(seconds=3) == 3
+
+    def test_return(self):
+        """The return value should be checked."""
+        @strict
+        def wrong() -> str:
+            return 1
+
+        with raises(ReturnValueTypeHintError):
+            wrong()
+
+    def test_none_returned(self):
+        """None should be accepted as a return value, as by strict_hint."""
+        @strict
+        def found() -> str:
+            return None
+
+        assert found() is None
+
+    def test_disabled(self, monkeypatch):
+        """Functions shouldn't be wrapped with the setting on."""
+        monkeypatch.setenv(typecheck.ENVIRONMENT_SETTING, '1')
+
+        def function(value: str):
+            return value
+
+        assert strict(function) is function
@@ -0,0 +1,126 @@
+"""Tests for content volumes and the sites which mount them."""
+import fcntl
+import os
+import tarfile
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Thread
+from pytest import raises
+from src import basic_nginx_site
+from src.config import Config
+from src.volumes import CONTENT_LABEL
+
+
+def write(path: str, content: str):
+    """Write a file."""
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+class Test_VolumeSites:
+    """Tests for CopyFoldersToMounts with volumes, against a fake daemon."""
+    def setup_method(self):
+        """Create a scratch folder holding the sites' content."""
+        self.folder = TemporaryDirectory()
+        for folder in ('webroot', 'config'):
+            os.mkdir(join(self.folder.name, folder))
+            write(join(self.folder.name, folder, 'index.html'), folder)
+
+    def teardown_method(self):
+        """Remove the scratch folder."""
+        self.folder.cleanup()
+
+    def deploy(self, name: str, webroot: str='webroot'):
+        """Deploy a site whose content is in volumes."""
+        return basic_nginx_site.CopyFoldersToMounts(
+            name,
+            webroot={'unused': join(self.folder.name, webroot)},
+            confdir={'unused': join(self.folder.name, 'config')},
+            volumes=True
+        )
+
+    def test_shared(self):
+        """Sites with the same content should share volumes, filled once."""
+        sites = [self.deploy(name) for name in ('first', 'second')]
+        mounts = [
+            {m['Destination']: m for m in site.state['Mounts']}
+            for site in sites
+        ]
+        assert mounts[0] == mounts[1]
+        webroot = mounts[0]['/usr/share/nginx/html']
+        assert webroot['Type'] == 'volume'
+        assert not webroot['RW']
+        assert Config.client.calls['put_archive'] == 2
+        assert Config.client.calls['create_volume'] == 2
+        assert Config.client.containers.list(all=True, filters={
+            'label': CONTENT_LABEL
+        }) == []
+
+    def test_changed(self):
+        """Different content should get a volume of its own."""
+        first = self.deploy('first')
+        write(join(self.folder.name, 'config', 'index.html'), 'changed')
+        second = self.deploy('second')
+        volumes = {
+            mount['Source'] for site in (first, second)
+            for mount in site.state['Mounts']
+        }
+        assert len(volumes) == 3
+        first.container.remove(force=True)
+        assert len(Config.content_volumes.prune()) == 1
+
+    def test_abandoned(self):
+        """A fill which didn't finish should be started again."""
+        volumes = Config.content_volumes
+        source = join(self.folder.name, 'webroot')
+        name = volumes.name_for(volumes.digest(source))
+        Config.client.volumes.create(name=name)
+        Config.client.containers.create(
+            image='nginx:latest', name=name + '_fill'
+        )
+        assert volumes.acquire(source, 'nginx:latest') == name
+        assert Config.client.calls['put_archive'] == 1
+        assert Config.client.containers.list(all=True) == []
+        assert volumes.filled() == {name: volumes.digest(source)}
+
+    def test_filling_elsewhere(self):
+        """A volume being filled by someone else shouldn't be used yet."""
+        volumes = Config.content_volumes
+        source = join(self.folder.name, 'webroot')
+        name = volumes.name_for(volumes.digest(source))
+        acquired = []
+        # Another process has created the volume and holds its lock.
+        Config.client.volumes.create(name=name)
+        os.makedirs(volumes.directory)
+        with open(join(volumes.directory, name + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            waiter = Thread(
+                target=lambda: acquired.append(
+                    volumes.acquire(source, 'nginx:latest')
+                )
+            )
+            waiter.start()
+            waiter.join(0.2)
+            assert acquired == []
+        waiter.join(5)
+        assert acquired == [name]
+        assert Config.client.calls['put_archive'] == 1
+
+    def test_removed_elsewhere(self):
+        """A filled volume which was removed should be filled again."""
+        volumes = Config.content_volumes
+        source = join(self.folder.name, 'webroot')
+        name = volumes.acquire(source, 'nginx:latest')
+        Config.client.volumes.get(name).remove()
+        assert volumes.acquire(source, 'nginx:latest') == name
+        assert Config.client.calls['put_archive'] == 2
+
+    def test_tarfile(self):
+        """Open tarfiles can't be put in volumes."""
+        path = join(self.folder.name, 'webroot.tar')
+        with tarfile.open(path, 'w') as archive:
+            archive.add(join(self.folder.name, 'webroot'), arcname='.')
+        with tarfile.open(path) as archive, raises(ValueError):
+            basic_nginx_site.CopyFoldersToMounts(
+                'site', webroot={'unused': archive}, volumes=True
+            )
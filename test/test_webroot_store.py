@@ -0,0 +1,162 @@
+"""Tests for the shared webroot store."""
+import os
+from os.path import join
+from shutil import copytree
+from tempfile import TemporaryDirectory
+from src import basic_nginx_site
+from src.config import Config
+from src.ports import PortAllocator
+from src.webroot_store import WebrootStore, tree_digest
+
+
+def write(path: str, content: str):
+    """Write a file."""
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+class Test_WebrootStore:
+    """Tests for the WebrootStore."""
+    def setup_method(self):
+        """Create a store and a webroot in a scratch folder."""
+        self.folder = TemporaryDirectory()
+        self.store = WebrootStore(join(self.folder.name, 'store'))
+        self.source = join(self.folder.name, 'webroot')
+        os.makedirs(join(self.source, 'assets'))
+        write(join(self.source, 'index.html'), "<h1>Hello</h1>")
+        write(join(self.source, 'assets', 'site.css'), "h1 {}")
+
+    def teardown_method(self):
+        """Remove the scratch folder."""
+        self.folder.cleanup()
+
+    def test_digest(self):
+        """Identical trees should have the same digest, others not."""
+        copy = join(self.folder.name, 'copy')
+        copytree(self.source, copy)
+        assert tree_digest(copy) == tree_digest(self.source)
+        write(join(copy, 'index.html'), "<h1>Goodbye</h1>")
+        assert tree_digest(copy) != tree_digest(self.source)
+
+    def test_shared(self):
+        """Sites with identical webroots should share one stored copy."""
+        copy = join(self.folder.name, 'copy')
+        copytree(self.source, copy)
+        first = self.store.acquire('first', self.source)
+        assert self.store.acquire('second', copy) == first
+        assert os.listdir(join(self.folder.name, 'store', 'trees')) == \
+            [os.path.basename(first)]
+        with open(join(first, 'assets', 'site.css')) as file:
+            assert file.read() == "h1 {}"
+        assert list(self.store.references().values()) == [2]
+
+    def test_collect(self):
+        """Only trees without users should be collected."""
+        old = self.store.acquire('site', self.source)
+        write(join(self.source, 'index.html'), "<h1>Changed</h1>")
+        new = self.store.acquire('site', self.source)
+        assert new != old
+        assert self.store.collect() == [os.path.basename(old)]
+        assert not os.path.exists(old)
+        self.store.release('site')
+        self.store.collect()
+        assert not os.path.exists(new)
+
+    def test_transfer(self):
+        """A transferred tree should belong to the new owner only."""
+        old = self.store.acquire('site', self.source)
+        write(join(self.source, 'index.html'), "<h1>Changed</h1>")
+        new = self.store.acquire('site_replacement', self.source)
+        self.store.transfer('site_replacement', 'site')
+        assert self.store.references() == {
+            os.path.basename(old): 0, os.path.basename(new): 1
+        }
+        assert self.store.acquire('site', self.source) == new
+
+
+class Test_SharedSite:
+    """Tests for a BlankMounted site using the store."""
+    def setup_method(self):
+        """Deploy sites into a scratch folder on a fake daemon."""
+        self.saved = basic_nginx_site.get_parent_dir
+        self.folder = TemporaryDirectory()
+        Config.default_nginx_webroot = join(self.folder.name, 'webroot')
+        Config.default_nginx_config = join(self.folder.name, 'config')
+        for folder in ('webroot', 'config'):
+            os.mkdir(join(self.folder.name, folder))
+            write(join(self.folder.name, folder, 'file'), folder)
+        basic_nginx_site.get_parent_dir = \
+            lambda name: join(self.folder.name, 'static', name)
+        Config.port_allocator = PortAllocator((29800, 29899))
+        Config.drain_period = 0
+
+    def teardown_method(self):
+        """Restore get_parent_dir and remove the scratch folder."""
+        basic_nginx_site.get_parent_dir = self.saved
+        self.folder.cleanup()
+
+    def test_mounted(self):
+        """Sites should mount the shared webroot instead of a copy."""
+        sites = [
+            basic_nginx_site.BlankMounted_BasicNginXSite(
+                name, shared_webroot=True
+            ) for name in ('first', 'second')
+        ]
+        sources = {
+            mount['Source'] for site in sites
+            for mount in site.state['Mounts']
+            if mount['Destination'] == '/usr/share/nginx/html'
+        }
+        assert len(sources) == 1
+        assert sources.pop().startswith(Config.webroot_store_dir)
+        assert not os.path.exists(
+            join(self.folder.name, 'static', 'first', 'webroot')
+        )
+
+    def test_released(self):
+        """Tearing a site down should release its tree."""
+        site = basic_nginx_site.BlankMounted_BasicNginXSite(
+            'first', shared_webroot=True
+        )
+        basic_nginx_site.BlankMounted_BasicNginXSite(
+            'first', shared_webroot=True
+        )
+        assert list(Config.webroot_store.references().values()) == [1]
+        site.check_for_existing_instance('first')
+        assert list(Config.webroot_store.references().values()) == [0]
+
+    def test_replaced(self, monkeypatch):
+        """A replacement should take over the tree of the site it replaces."""
+        monkeypatch.setattr(
+            basic_nginx_site.BasicNginXSite, 'wait_until_ready',
+            lambda *args, **kwargs: None
+        )
+        deploy = basic_nginx_site.BlankMounted_BasicNginXSite
+        deploy('first', ports='auto', shared_webroot=True).container.start()
+        write(join(self.folder.name, 'webroot', 'file'), 'changed')
+        deploy.redeploy('first', ports='auto', shared_webroot=True)
+        assert sorted(Config.webroot_store.references().values()) == [0, 1]
+        deploy.check_for_existing_instance('first')
+        assert Config.webroot_store.references() == {
+            digest: 0 for digest in Config.webroot_store.references()
+        }
+
+    def test_gone(self):
+        """A site whose container went without releasing its tree is freed."""
+        site = basic_nginx_site.BlankMounted_BasicNginXSite(
+            'first', shared_webroot=True
+        )
+        basic_nginx_site.BlankMounted_BasicNginXSite(
+            'second', shared_webroot=True
+        )
+        assert Config.webroot_store.collect(pending=0.0) == []
+        # Auto-removed when it stopped, so nothing released its tree.
+        site.container.start()
+        site.container.stop()
+        assert list(Config.webroot_store.references().values()) == [2]
+        assert Config.webroot_store.collect() == []
+        assert Config.webroot_store.collect(pending=0.0) == []
+        assert list(Config.webroot_store.references().values()) == [1]
+        Config.client.containers.get('second').remove(force=True)
+        digest, = Config.webroot_store.collect(pending=0.0)
+        assert not os.path.exists(Config.webroot_store.path_for(digest))